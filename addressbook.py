@@ -0,0 +1,274 @@
+# -*- coding: utf-8 -*-
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+# Copyright (C) 2016 Free Software Foundation
+# Author : David Bateman <dbateman@free.fr>
+
+"""Resolution of Lotus Notes names to SMTP addresses.
+
+The headers of the messages exported by Notes often contain Notes names like
+"CN=Jane Doe/OU=Sales/O=Acme@Acme" rather than SMTP addresses. The Resolver
+class rewrites the address headers with the SMTP addresses found in a
+directory. A directory is any object with a method Lookup(names) returning a
+dictionary of the SMTP addresses of the names it knows. The directories
+NotesDirectory (the Notes address books), CSVDirectory and LDIFDirectory are
+supplied.
+"""
+
+# Ignore variable/function/Method naming conventions of PEP8. I like my names
+# pylint: disable=C0103
+
+import base64
+import collections
+import csv
+import email.utils
+import io
+
+# Headers containing addresses that are rewritten
+AddressHeaders = ("from", "sender", "reply-to", "to", "cc", "bcc", "principal")
+
+def IsNotesName(address):
+    """Function to test if an address is a Notes name rather than an SMTP address"""
+    if "/" in address or address[:3].upper() == "CN=":
+        return True
+    # A Notes name in a flat organisation is "Jane Doe@Domain"
+    if " " in address.strip():
+        return True
+    name, dummy_sep, domain = address.rpartition("@")
+    return name != "" and "." not in domain
+
+def NameKey(name):
+    """Function returning the key of a Notes name, common to the canonical
+    (CN=Jane Doe/OU=Sales/O=Acme) and abbreviated (Jane Doe/Sales/Acme) forms,
+    without the Notes domain"""
+    name = name.strip().strip('"')
+    if "@" in name and "." not in name.rpartition("@")[2]:
+        name = name.rpartition("@")[0]
+    parts = []
+    for part in name.split("/"):
+        part = part.strip()
+        key, sep, value = part.partition("=")
+        if sep and key.strip().upper() in ("CN", "OU", "O", "C"):
+            part = value.strip()
+        parts.append(part)
+    return "/".join(parts).lower()
+
+def CommonName(name):
+    """Function returning the common name (Jane Doe) of a Notes name"""
+    name = name.strip().strip('"').split("/")[0]
+    if name[:3].upper() == "CN=":
+        name = name[3:]
+    return name.rpartition("@")[0] if "@" in name else name
+
+class Resolver(object):
+    """Cached resolution of Notes names with a directory. At most size names
+    are kept in the cache, the least recently used names being dropped first"""
+    def __init__(self, directory, size=10000):
+        """Resolver initialisation method"""
+        self.directory = directory
+        self.size = size
+        self.cache = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def _store(self, key, address):
+        self.cache[key] = address
+        if len(self.cache) > self.size:
+            self.cache.popitem(last=False)
+
+    def Prefetch(self, names):
+        """Method to look up all the names not yet in the cache with a single
+        query to the directory"""
+        keys = {}
+        for name in names:
+            if name and IsNotesName(name):
+                key = NameKey(name)
+                if key not in self.cache:
+                    keys[key] = name
+        if not keys:
+            return 0
+        found = self.directory.Lookup(list(keys.values()))
+        for key, name in keys.items():
+            # Also cache the names that aren't found, so they aren't searched again
+            self._store(key, found.get(name))
+        return len(keys)
+
+    def Resolve(self, name):
+        """Method returning the SMTP address of a Notes name or None"""
+        key = NameKey(name)
+        if key in self.cache:
+            self.hits += 1
+            address = self.cache.pop(key)
+            self.cache[key] = address
+            return address
+        self.misses += 1
+        address = self.directory.Lookup([name]).get(name)
+        self._store(key, address)
+        return address
+
+    def HitRate(self):
+        """Method returning the fraction of the names found in the cache"""
+        total = self.hits + self.misses
+        return float(self.hits) / total if total else 0.
+
+    def RewriteAddresses(self, value):
+        """Method to replace the Notes names of an address header value by their
+        SMTP address. Returns None if nothing was changed"""
+        changed = False
+        addresses = []
+        for realname, address in email.utils.getaddresses([value]):
+            if address and IsNotesName(address):
+                smtp = self.Resolve(address)
+                if smtp:
+                    if not realname or IsNotesName(realname):
+                        realname = CommonName(realname or address)
+                    address = smtp
+                    changed = True
+            addresses.append(email.utils.formataddr((realname, address)))
+        if not changed:
+            return None
+        return ", ".join(addresses)
+
+    def RewriteHeaders(self, headers):
+        """Method to rewrite the address headers in a block of header lines.
+        The other headers are returned unchanged"""
+        lines = []
+        current = []
+        for line in headers.splitlines(True):
+            if line[:1] in (" ", "\t") and current:
+                current.append(line)
+            else:
+                if current:
+                    lines.append(self._rewriteHeader(current))
+                current = [line]
+        if current:
+            lines.append(self._rewriteHeader(current))
+        return "".join(lines)
+
+    def _rewriteHeader(self, lines):
+        text = "".join(lines)
+        name, sep, value = text.partition(":")
+        if not sep or name.strip().lower() not in AddressHeaders:
+            return text
+        value = " ".join(l.strip() for l in value.splitlines())
+        rewritten = self.RewriteAddresses(value)
+        if rewritten is None:
+            return text
+        eol = "\r\n" if text.endswith("\r\n") else "\n"
+        return "%s: %s%s" % (name, rewritten, eol)
+
+class NotesDirectory(object):
+    """Directory of the Notes address books of a NotesSession"""
+    def __init__(self, session, view="($Users)"):
+        """NotesDirectory initialisation method"""
+        self.session = session
+        self.views = []
+        for book in session.AddressBooks:
+            if not book.IsOpen:
+                book.Open("", "")
+            v = book.GetView(view)
+            if v:
+                v.AutoUpdate = False
+                self.views.append(v)
+
+    def Lookup(self, names):
+        """Method returning the SMTP addresses of the names found in the address
+        books. The ($Users) view is keyed on the abbreviated names"""
+        found = {}
+        for name in names:
+            key = self.session.CreateName(name.rpartition("@")[0] if "@" in name else name).Abbreviated
+            for v in self.views:
+                doc = v.GetDocumentByKey(key, True)
+                if doc:
+                    address = doc.GetItemValue("InternetAddress")
+                    if address and address[0]:
+                        found[name] = address[0]
+                        break
+        return found
+
+class FileDirectory(object):
+    """Directory loaded in memory from a file, keyed on NameKey"""
+    def __init__(self):
+        """FileDirectory initialisation method"""
+        self.addresses = {}
+
+    def Lookup(self, names):
+        """Method returning the SMTP addresses of the names in the directory"""
+        found = {}
+        for name in names:
+            address = self.addresses.get(NameKey(name))
+            if address:
+                found[name] = address
+        return found
+
+class CSVDirectory(FileDirectory):
+    """Directory read from a CSV file with the Notes name in the first column
+    and the SMTP address in the second"""
+    def __init__(self, path):
+        """CSVDirectory initialisation method"""
+        FileDirectory.__init__(self)
+        with io.open(path, newline="", encoding="utf-8-sig") as f:
+            for row in csv.reader(f):
+                if len(row) >= 2 and row[0].strip() and "@" in row[1]:
+                    self.addresses.setdefault(NameKey(row[0]), row[1].strip())
+
+class LDIFDirectory(FileDirectory):
+    """Directory read from an LDIF file, for example exported from the Domino
+    directory. The distinguished name and the common names of each entry with
+    a mail attribute are recognised"""
+    def __init__(self, path):
+        """LDIFDirectory initialisation method"""
+        FileDirectory.__init__(self)
+        with io.open(path, encoding="utf-8-sig") as f:
+            entry = []
+            for line in f:
+                line = line.rstrip("\r\n")
+                if line.startswith(" ") and entry:
+                    entry[-1] += line[1:]
+                elif line:
+                    entry.append(line)
+                else:
+                    self._addEntry(entry)
+                    entry = []
+            self._addEntry(entry)
+
+    def _addEntry(self, lines):
+        attrs = {}
+        for line in lines:
+            if line.startswith("#"):
+                continue
+            key, sep, value = line.partition(":")
+            if not sep:
+                continue
+            if value.startswith(":"):
+                value = base64.b64decode(value[1:].strip()).decode("utf-8")
+            attrs.setdefault(key.strip().lower(), []).append(value.strip())
+        mail = attrs.get("mail")
+        if not mail:
+            return
+        names = []
+        if "dn" in attrs:
+            # CN=Jane Doe,OU=Sales,O=Acme is written CN=Jane Doe/OU=Sales/O=Acme by Notes
+            names.append("/".join(p.strip() for p in attrs["dn"][0].split(",")))
+        names.extend(attrs.get("cn", []))
+        for name in names:
+            self.addresses.setdefault(NameKey(name), mail[0])
+
+def OpenDirectory(path):
+    """Function returning the directory for a CSV or LDIF file"""
+    if path.lower().endswith((".ldif", ".ldf")):
+        return LDIFDirectory(path)
+    return CSVDirectory(path)
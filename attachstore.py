@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+# Copyright (C) 2016 Free Software Foundation
+# Author : David Bateman <dbateman@free.fr>
+
+"""Content-addressed store of the attachments exported by NSF2X.
+
+The same attachments occur many times in a mailbox and across mailboxes. With
+an AttachmentStore, the decoded content of each attachment is hashed with
+SHA-256 and stored once, in the file "<store>/<xx>/<digest>" where xx are the
+first two hexadecimal digits of the digest. In the message the attachment is
+replaced by a message/external-body part with the access type AccessType,
+whose body holds the original headers of the attachment :
+
+  Content-Type: message/external-body; access-type=x-nsf2x-store; name="<digest>"; size=<size>
+
+  Content-Type: application/pdf; name="report.pdf"
+  Content-Transfer-Encoding: base64
+  Content-Disposition: attachment; filename="report.pdf"
+
+Rehydrate rebuilds the complete messages of an EML, MBOX or compressed MBOX
+file, encoding the content of the store with the Content-Transfer-Encoding of
+these headers. It can be run from the command line with
+
+  python attachstore.py [store] [source] [destination]
+
+where source and destination are files or directories. The messages of a
+directory are its EML and MBOX files and the files of the Maildir directories
+new and cur, including their fan-out sub-directories.
+"""
+
+# Ignore variable/function/Method naming conventions of PEP8. I like my names
+# pylint: disable=C0103
+
+import binascii
+import gzip
+import hashlib
+import itertools
+import os
+import re
+import sys
+
+import mimewriter
+
+AccessType = "x-nsf2x-store"
+
+# Attachments smaller than MinSize bytes are left in the messages
+MinSize = 4096
+
+_REFERENCE = re.compile(br'^Content-Type: message/external-body; access-type=' +
+                        AccessType.encode("ascii") + br'; name="([0-9a-f]{64})"')
+_ENCODING = re.compile(br"(?i)^Content-Transfer-Encoding:\s*([^\s;]+)")
+
+def BlobPath(root, digest):
+    """Function returning the path of the content with a digest in a store"""
+    return os.path.join(root, digest[:2], digest)
+
+class AttachmentStore(object):
+    """Store of the decoded content of the attachments, each content being
+    written once whatever the number of messages referencing it"""
+    def __init__(self, path, minsize=MinSize):
+        """AttachmentStore initialisation method"""
+        self.path = path
+        self.minsize = minsize
+        self.known = set()
+        self.counter = itertools.count()
+        self.parts = 0
+        self.size = 0
+        self.distinct = 0
+        self.unique = 0
+        self.stored = 0
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+    def Add(self, chunks):
+        """Method to add a content to the store. chunks is a function returning
+        an iterable of the bytes of the content, called once to hash the content
+        and a second time to write it if it isn't already in the store. Returns
+        the digest and the size of the content"""
+        sha = hashlib.sha256()
+        size = 0
+        for data in chunks():
+            sha.update(data)
+            size += len(data)
+        digest = sha.hexdigest()
+        path = BlobPath(self.path, digest)
+        if digest not in self.known:
+            self.distinct += size
+        if digest not in self.known and not os.path.exists(path):
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Renamed once complete, so that the store never holds a partial content
+            tmp = "%s.%d.%d.tmp" % (path, os.getpid(), next(self.counter))
+            try:
+                with open(tmp, "wb") as f:
+                    for data in chunks():
+                        f.write(data)
+                os.replace(tmp, path)
+            except:
+                try:
+                    os.remove(tmp)
+                except OSError:
+                    pass
+                raise
+            self.unique += 1
+            self.stored += size
+        self.known.add(digest)
+        self.parts += 1
+        self.size += size
+        return digest, size
+
+    def Ratio(self):
+        """Method returning the ratio of the size of the attachments to the size
+        of their distinct contents, whether written to the store by this run or
+        already in it"""
+        return float(self.size) / self.distinct if self.distinct else 0.
+
+    @staticmethod
+    def Reference(headers, digest, size, binary=False):
+        """Method returning the message/external-body part replacing an
+        attachment with the headers and content in the store. The content of a
+        binary part is encoded in base64 when it is rehydrated"""
+        if binary:
+            headers = mimewriter.EncodingHeader(headers, "base64")
+        if not headers.endswith("\n"):
+            headers += "\n"
+        return ('Content-Type: message/external-body; access-type=%s; name="%s"; size=%d\n\n%s\n' %
+                (AccessType, digest, size, headers))
+
+def _encoded(path, encoding):
+    """Generator of the content of a file of the store in a transfer encoding"""
+    with open(path, "rb") as f:
+        if encoding == b"base64":
+            while True:
+                data = f.read(mimewriter.Base64Block)
+                if not data:
+                    break
+                yield mimewriter.Base64Lines(data)
+        elif encoding == b"quoted-printable":
+            data = binascii.b2a_qp(f.read(), istext=True)
+            # Never leave a "From " line that an MBOX reader would split on
+            yield re.sub(br"(?m)^From ", b"=46rom ", data)
+        else:
+            while True:
+                data = f.read(mimewriter.StreamChunk)
+                if not data:
+                    break
+                yield data
+
+def RehydrateFile(root, src, dst):
+    """Function to copy an EML or MBOX file, replacing the references to the
+    store by the attachments. A file ending with ".gz" is copied to a gzip
+    file. Returns the number of attachments restored"""
+    count = 0
+    opener = gzip.open if src.lower().endswith(".gz") else open
+    with opener(src, "rb") as fin, opener(dst, "wb") as fout:
+        lines = iter(fin)
+        for line in lines:
+            match = _REFERENCE.match(line)
+            if not match:
+                fout.write(line)
+                continue
+            # Skip the empty line after the external headers, and copy the
+            # headers of the attachment
+            next(lines, None)
+            encoding = b"7bit"
+            for line in lines:
+                fout.write(line)
+                if not line.strip():
+                    break
+                header = _ENCODING.match(line)
+                if header:
+                    encoding = header.group(1).lower()
+            last = b"\n"
+            for data in _encoded(BlobPath(root, match.group(1).decode("ascii")), encoding):
+                fout.write(data)
+                last = data[-1:] or last
+            if last != b"\n":
+                fout.write(b"\n")
+            count += 1
+    return count
+
+def _isMessage(dirpath, name):
+    """Function to test if a file of a directory tree holds messages"""
+    if name.lower().endswith((".eml", ".mbox", ".mbox.gz")):
+        return True
+    if name.startswith("."):
+        return False
+    (parent, sub) = os.path.split(dirpath)
+    if re.match(r"^[0-9a-f]{2}$", sub) and os.path.basename(parent) == "new":
+        # Fan-out sub-directory of a Maildir
+        return True
+    return sub in ("new", "cur") and os.path.isdir(os.path.join(parent, "tmp"))
+
+def Rehydrate(root, src, dst):
+    """Function to rebuild the messages of a file, or of all the files of a
+    directory tree, with the attachments of the store. Returns the number of
+    files and of attachments restored"""
+    if not os.path.isdir(src):
+        return 1, RehydrateFile(root, src, dst)
+    files = 0
+    count = 0
+    for dirpath, dummy_dirnames, filenames in os.walk(src):
+        outdir = os.path.join(dst, os.path.relpath(dirpath, src))
+        for name in filenames:
+            if _isMessage(dirpath, name):
+                if not os.path.isdir(outdir):
+                    os.makedirs(outdir)
+                files += 1
+                count += RehydrateFile(root, os.path.join(dirpath, name), os.path.join(outdir, name))
+    return files, count
+
+if __name__ == '__main__':
+    if len(sys.argv) < 4:
+        raise OSError("attachstore [store] [source] [destination]")
+    print("%d files rehydrated with %d attachments" % Rehydrate(sys.argv[1], sys.argv[2], sys.argv[3]))
@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+# Copyright (C) 2016 Free Software Foundation
+# Author : David Bateman <dbateman@free.fr>
+
+"""Catalog of the documents exported by NSF2X.
+
+Catalog records in an SQLite database, for each run of NSF2X, the documents
+treated with their NoteID, UNID, folder, location in the output, size,
+SHA-256 digest and status. The table runs holds one row per run, and the
+table exports one row per document, folder and run, as a document can be
+exported to several folders, so that the output of two runs
+can be compared, and a document found from its NoteID or UNID without
+reading the output. The locations are those of the journal, a file name,
+"<file>|<start>|<end>" for a message in an MBOX file or an archive, or a
+mailbox of the IMAP server or a folder of the PST file.
+
+The size and the digest are those of the message as written by NSF2X, before
+the escaping of the "From " lines of an MBOX file and the compression. They
+are computed by HashingFile as the message is written, so that it's never
+read again.
+
+The rows are inserted by a separate thread with sqlitewriter, in a
+transaction per batch of BatchRows documents. The catalog can be queried from the command line with
+
+  python catalog.py [catalog] runs
+  python catalog.py [catalog] find [NoteID or UNID]
+  python catalog.py [catalog] diff [run] [run]
+"""
+
+# Ignore variable/function/Method naming conventions of PEP8. I like my names
+# pylint: disable=C0103
+
+import hashlib
+import sqlite3
+import sys
+import time
+
+import sqlitewriter
+
+# Documents inserted in a single transaction
+BatchRows = sqlitewriter.BatchRows
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (id INTEGER PRIMARY KEY, started INTEGER, settings TEXT);
+CREATE TABLE IF NOT EXISTS exports (run INTEGER, mailbox TEXT, folder TEXT, noteid TEXT,
+  unid TEXT, location TEXT, size INTEGER, sha256 TEXT, status TEXT,
+  PRIMARY KEY (run, mailbox, folder, noteid)) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS exports_noteid ON exports (noteid);
+CREATE INDEX IF NOT EXISTS exports_unid ON exports (unid);
+"""
+
+class HashingFile(object):
+    """Wrapper of an output file computing the size and, if digest is True,
+    the SHA-256 digest of the data written to it. Seeking back to the start of
+    the message, as when it's rewritten after an error, discards the data
+    already counted"""
+    def __init__(self, f, digest=True):
+        """HashingFile initialisation method"""
+        self.f = f
+        self.start = f.tell()
+        self.digest = digest
+        self.sha = hashlib.sha256() if digest else None
+        self.size = 0
+
+    def write(self, data):
+        """Method to write data to the file and add it to the digest"""
+        if self.sha is not None:
+            self.sha.update(data)
+        self.size += len(data)
+        return self.f.write(data)
+
+    def seek(self, offset, whence=0):
+        """Method to change the position in the file"""
+        if whence == 0 and offset == self.start:
+            self.sha = hashlib.sha256() if self.digest else None
+            self.size = 0
+        return self.f.seek(offset, whence)
+
+    def Digest(self):
+        """Method returning the hexadecimal SHA-256 digest of the message, or
+        None if it isn't computed"""
+        return self.sha.hexdigest() if self.sha is not None else None
+
+    def __getattr__(self, name):
+        return getattr(self.f, name)
+
+class Catalog(sqlitewriter.SQLiteWriter):
+    """SQLite catalog of the documents exported by a run, written by a
+    separate thread"""
+    schema = _SCHEMA
+    kind = "catalog"
+    table = "exports"
+
+    def __init__(self, path, settings="", batch=BatchRows):
+        """Catalog initialisation method"""
+        self.settings = settings
+        self.run = None
+        sqlitewriter.SQLiteWriter.__init__(self, path, batch)
+
+    @property
+    def documents(self):
+        """Number of documents written to the catalog"""
+        return self.written
+
+    def _prepare(self, db):
+        with db:
+            self.run = db.execute("INSERT INTO runs (started, settings) VALUES (?, ?)",
+                                  (int(time.time()), self.settings)).lastrowid
+
+    def Add(self, mailbox, folder, noteid, unid, location, size, digest, status):
+        """Method to add a document of a folder to the catalog of the run. A
+        document added again to the same folder replaces the previous row"""
+        self._append((self.run, mailbox, folder, noteid, unid, location, size, digest, status))
+
+    def _move(self):
+        # The documents of the previous runs keep the locations they had
+        self.db.execute("UPDATE exports SET location = (SELECT new FROM moves WHERE old = location) "
+                        "WHERE run = ? AND location IN (SELECT old FROM moves)", (self.run,))
+
+    def _write(self, rows):
+        self.db.executemany("INSERT OR REPLACE INTO exports (run, mailbox, folder, noteid, unid, "
+                            "location, size, sha256, status) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+def Runs(path):
+    """Function returning the (run, started, settings, documents) of the runs
+    of a catalog"""
+    db = sqlite3.connect(path)
+    try:
+        return db.execute("SELECT r.id, r.started, r.settings, COUNT(e.noteid) FROM runs r "
+                          "LEFT JOIN exports e ON e.run = r.id GROUP BY r.id ORDER BY r.id").fetchall()
+    finally:
+        db.close()
+
+def Find(path, ident):
+    """Function returning the (run, mailbox, folder, noteid, unid, location,
+    size, sha256, status) of the documents with a NoteID or a UNID, latest
+    run first"""
+    ident = ident.upper()
+    if ident.startswith("0X"):
+        ident = ident[2:]
+    db = sqlite3.connect(path)
+    try:
+        return db.execute("SELECT run, mailbox, folder, noteid, unid, location, size, sha256, status "
+                          "FROM exports WHERE noteid = ?1 OR unid = ?1 ORDER BY run DESC",
+                          (ident,)).fetchall()
+    finally:
+        db.close()
+
+def Diff(path, old, new):
+    """Function comparing the documents of two runs. Returns the (change,
+    mailbox, folder, noteid, unid, location) of the documents added, removed
+    or changed in a folder by the run new, a document being changed if its digest or status
+    differs. Only compare complete runs, as a resumed run doesn't hold the
+    documents already exported"""
+    db = sqlite3.connect(path)
+    try:
+        return db.execute("SELECT 'added', n.mailbox, n.folder, n.noteid, n.unid, n.location FROM exports n "
+                          "LEFT JOIN exports o ON o.run = ?1 AND o.mailbox = n.mailbox AND o.folder = n.folder "
+                          "AND o.noteid = n.noteid "
+                          "WHERE n.run = ?2 AND o.noteid IS NULL "
+                          "UNION ALL "
+                          "SELECT 'removed', o.mailbox, o.folder, o.noteid, o.unid, o.location FROM exports o "
+                          "LEFT JOIN exports n ON n.run = ?2 AND n.mailbox = o.mailbox AND n.folder = o.folder "
+                          "AND n.noteid = o.noteid "
+                          "WHERE o.run = ?1 AND n.noteid IS NULL "
+                          "UNION ALL "
+                          "SELECT 'changed', n.mailbox, n.folder, n.noteid, n.unid, n.location FROM exports n "
+                          "JOIN exports o ON o.run = ?1 AND o.mailbox = n.mailbox AND o.folder = n.folder "
+                          "AND o.noteid = n.noteid "
+                          "WHERE n.run = ?2 AND (o.sha256 IS NOT n.sha256 OR o.status IS NOT n.status) "
+                          "ORDER BY 2, 3, 4", (old, new)).fetchall()
+    finally:
+        db.close()
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3 or sys.argv[2] not in ("runs", "find", "diff"):
+        raise OSError("catalog [catalog] runs|find [id]|diff [run] [run]")
+    start = time.time()
+    if sys.argv[2] == "runs":
+        for run, started, settings, count in Runs(sys.argv[1]):
+            print("%4d  %s  %7d documents  %s" % (run, time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(started)),
+                                                 count, settings))
+    elif sys.argv[2] == "find":
+        for run, mailbox, folder, noteid, unid, location, size, digest, status in Find(sys.argv[1], sys.argv[3]):
+            print("%4d  %s/%s  0x%s  %s  %s" % (run, mailbox, folder, noteid, unid, status))
+            print("      %s  %d bytes  %s" % (location, size or 0, digest or ""))
+    else:
+        results = Diff(sys.argv[1], int(sys.argv[3]), int(sys.argv[4]))
+        for change, mailbox, folder, noteid, unid, location in results:
+            print("%-8s %s/%s  0x%s  %s  %s" % (change, mailbox, folder, noteid, unid, location))
+        print("%d documents differ" % len(results))
+    print("%.1f ms" % (1000. * (time.time() - start)))
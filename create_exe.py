@@ -226,7 +226,11 @@ def main () :
           # data files to include
           data_files=[(".", ("README.txt", "LICENSE")),
                       ("src", ("create_exe.py", "create_helper.py", "eml2pst.py",
-                               "nsf2x.py", "mapiex.py", "testmapiex.py",
+                               "nsf2x.py", "mapiex.py", "fakenotes.py", "addressbook.py", "emlarchive.py",
+                               "mimewriter.py", "mboxwriter.py", "replay.py", "smime.py",
+                               "maildir.py", "attachstore.py", "imapwriter.py", "sqlitewriter.py",
+                               "searchindex.py", "catalog.py", "metadata.py",
+                               "testmapiex.py",
                                "nsf2x.nsi", "nsf2x_lang.nsi", "README.dev"))] +
                         find_all_files_in_dir('locale') +
                         find_all_files_in_dir('helper32') +
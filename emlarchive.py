@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+# Copyright (C) 2016 Free Software Foundation
+# Author : David Bateman <dbateman@free.fr>
+
+"""Archives of EML files.
+
+Rather than creating a file per message, the EML files of an NSF file can be
+stored in a single ZIP or tar archive, with the names "<folder>/<N>.eml".
+ZipArchive and TarArchive have the same methods : Add(name, f) adds the
+message read from the file f and returns the offsets of the start and the
+end of its entry in the archive, NextIndex(folder) returns the first unused
+number N of the folder, and Close() completes the archive.
+
+ZIP archives are always in the ZIP64 format, so that they can hold any
+number of messages, and the messages are optionally deflated. Their central
+directory lists the messages. The entries of a tar archive follow each other
+and the archive can be truncated after any of them, so that an interrupted
+conversion can be resumed. As a tar archive has no central directory, the
+file "<archive>.idx" lists the name, the offset of the content and the size
+of each message, separated by tabulations.
+"""
+
+# Ignore variable/function/Method naming conventions of PEP8. I like my names
+# pylint: disable=C0103
+
+import io
+import os
+import posixpath
+import shutil
+import tarfile
+import time
+import zipfile
+
+def ArchiveName(folder, n):
+    """Function returning the name of message n of a Notes folder in an archive"""
+    return posixpath.join(folder.replace("\\", "/"), "%d.eml" % n)
+
+def _nextIndex(names, folder):
+    prefix = folder.replace("\\", "/") + "/"
+    n = 0
+    for name in names:
+        if name.startswith(prefix) and name.lower().endswith(".eml"):
+            number = name[len(prefix):-4]
+            if number.isdigit():
+                n = max(n, int(number))
+    return n + 1
+
+class ZipArchive(object):
+    """ZIP64 archive of EML files. If append is True the messages are added to
+    an existing archive"""
+    def __init__(self, path, append=False, compress=False):
+        """ZipArchive initialisation method"""
+        self.path = path
+        append = append and os.path.exists(path)
+        # The central directory of an archive interrupted by a crash is missing
+        if append and not zipfile.is_zipfile(path):
+            raise zipfile.BadZipfile("%s is not a complete ZIP archive" % path)
+        self.f = open(path, "r+b" if append else "w+b")
+        self.zip = zipfile.ZipFile(self.f, "a" if append else "w",
+                                   zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED,
+                                   allowZip64=True)
+        self.names = set(self.zip.namelist())
+
+    def Add(self, name, f):
+        """Method to add a message read from f to the archive. Returns the
+        offsets of the start and the end of its entry"""
+        info = zipfile.ZipInfo(name, time.localtime()[:6])
+        info.compress_type = self.zip.compression
+        f.seek(0)
+        with self.zip.open(info, "w", force_zip64=True) as w:
+            shutil.copyfileobj(f, w)
+        self.names.add(name)
+        return info.header_offset, self.f.tell()
+
+    def NextIndex(self, folder):
+        """Method returning the first unused number of the messages of a folder"""
+        return _nextIndex(self.names, folder)
+
+    def Close(self):
+        """Method to write the central directory and close the archive"""
+        self.zip.close()
+        self.f.close()
+
+class TarArchive(object):
+    """Tar archive of EML files, with an index of its messages. If append is
+    True the messages are added to an existing archive, after the offset end
+    if it isn't None"""
+    def __init__(self, path, append=False, end=None):
+        """TarArchive initialisation method"""
+        self.path = path
+        self.entries = []
+        append = append and os.path.exists(path)
+        if append:
+            # Without an end, keep the entries whose content is complete
+            limit = end if end is not None else os.path.getsize(path)
+            with tarfile.open(path, "r") as tar:
+                try:
+                    for member in tar:
+                        if member.offset_data + member.size > limit:
+                            break
+                        self.entries.append((member.name, member.offset_data, member.size))
+                except tarfile.ReadError:
+                    # The last entry was truncated by a crash
+                    pass
+            if end is None:
+                end = 0
+                if self.entries:
+                    name, offset, size = self.entries[-1]
+                    end = offset + (size + tarfile.BLOCKSIZE - 1) // tarfile.BLOCKSIZE * tarfile.BLOCKSIZE
+        self.f = open(path, "r+b" if append else "wb")
+        self.f.truncate(end or 0)
+        self.f.seek(end or 0)
+        self.index = io.open(path + ".idx", "w", encoding="utf-8")
+        for entry in self.entries:
+            self.index.write("%s\t%d\t%d\n" % entry)
+        self.names = set(e[0] for e in self.entries)
+
+    def Add(self, name, f):
+        """Method to add a message read from f to the archive. Returns the
+        offsets of the start and the end of its entry"""
+        start = self.f.tell()
+        info = tarfile.TarInfo(name)
+        info.size = f.seek(0, io.SEEK_END)
+        info.mtime = int(time.time())
+        info.mode = 0o644
+        f.seek(0)
+        header = info.tobuf(tarfile.PAX_FORMAT, "utf-8")
+        self.f.write(header)
+        shutil.copyfileobj(f, self.f)
+        padding = -info.size % tarfile.BLOCKSIZE
+        if padding:
+            self.f.write(b"\0" * padding)
+        self.f.flush()
+        self.index.write("%s\t%d\t%d\n" % (name, start + len(header), info.size))
+        self.index.flush()
+        self.names.add(name)
+        return start, self.f.tell()
+
+    def NextIndex(self, folder):
+        """Method returning the first unused number of the messages of a folder"""
+        return _nextIndex(self.names, folder)
+
+    def Close(self):
+        """Method to write the end of the archive and close it"""
+        self.f.write(b"\0" * (2 * tarfile.BLOCKSIZE))
+        self.f.close()
+        self.index.close()
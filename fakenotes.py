@@ -0,0 +1,305 @@
+# -*- coding: utf-8 -*-
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+# Copyright (C) 2016 Free Software Foundation
+# Author : David Bateman <dbateman@free.fr>
+
+"""In-memory fakes of the Notes objects used by NSF2X, for the tests.
+
+The classes Database, View, Document, Item and MIMEEntity mimic the subset
+of the Notes COM interface (NotesDatabase, NotesView, NotesDocument, ...)
+used by the export code of NSF2X, so that they can be used in its place
+without a Notes client, for example by replay.py. The documents are taken
+from a "note source", an iterable of tuples (folder, noteid, rfc822) where
+rfc822 is the raw MIME message as bytes. NSF files themselves are only read
+through Notes.
+"""
+
+# Ignore variable/function/Method naming conventions of PEP8. I like my names
+# pylint: disable=C0103
+
+import datetime
+import email
+import email.encoders
+import os
+
+def _HeaderLines(msg, names, inclusive):
+    """Function returning the headers of msg whose names are (or aren't if
+    inclusive is False) in names, in the manner of GetSomeHeaders"""
+    names = [n.lower() for n in names]
+    lines = []
+    for key, value in msg.items():
+        if (key.lower() in names) == inclusive:
+            lines.append("%s: %s\n" % (key, value))
+    return "".join(lines)
+
+class MIMEEntity(object):
+    """Equivalent of NotesMIMEEntity for a part of a MIME message"""
+    # The MIMEEntity.ENC_* constants of the Notes COM interface
+    ENC_NONE, ENC_QUOTED_PRINTABLE, ENC_BASE64 = 1725, 1726, 1727
+    ENC_IDENTITY_7BIT, ENC_IDENTITY_8BIT, ENC_IDENTITY_BINARY = 1728, 1729, 1730
+    ENC_EXTENSION = 1731
+    ENCODINGS = {"quoted-printable" : ENC_QUOTED_PRINTABLE, "base64" : ENC_BASE64,
+                 "7bit" : ENC_IDENTITY_7BIT, "8bit" : ENC_IDENTITY_8BIT,
+                 "binary" : ENC_IDENTITY_BINARY}
+
+    def __init__(self, msg, parent=None, index=0):
+        """MIMEEntity initialisation method"""
+        self.msg = msg
+        self.parent = parent
+        self.index = index
+
+    @property
+    def Headers(self):
+        """All the headers of the entity"""
+        return _HeaderLines(self.msg, [], False)
+
+    @property
+    def ContentType(self):
+        """Main content type of the entity, for example 'multipart'"""
+        return self.msg.get_content_maintype()
+
+    @property
+    def ContentSubType(self):
+        """Content sub-type of the entity, for example 'mixed'"""
+        return self.msg.get_content_subtype()
+
+    @property
+    def Encoding(self):
+        """Content transfer encoding of the entity"""
+        cte = self.msg.get("Content-Transfer-Encoding")
+        if cte is None:
+            return self.ENC_NONE
+        return self.ENCODINGS.get(cte.strip().lower(), self.ENC_EXTENSION)
+
+    @property
+    def ContentAsText(self):
+        """Content of the entity in its transfer encoding. For multipart
+        entities this is the preamble"""
+        if self.msg.is_multipart():
+            return self.msg.preamble or ""
+        payload = self.msg.get_payload(decode=False)
+        if isinstance(payload, bytes):
+            return payload.decode("utf-8", "replace")
+        return payload
+
+    @property
+    def BoundaryStart(self):
+        """Boundary delimiter placed before the entity in its parent"""
+        if self.parent is None:
+            return ""
+        return "--%s\n" % self.parent.msg.get_boundary()
+
+    @property
+    def BoundaryEnd(self):
+        """Closing boundary placed after the last entity of its parent"""
+        if self.parent is None or self.index + 1 < len(self.parent.msg.get_payload()):
+            return ""
+        return "--%s--\n" % self.parent.msg.get_boundary()
+
+    def GetSomeHeaders(self, names, inclusive):
+        """Method returning the headers in (or not in) the list names"""
+        return _HeaderLines(self.msg, names, inclusive)
+
+    def GetFirstChildEntity(self):
+        """Method returning the first child entity of a multipart entity"""
+        if self.msg.is_multipart() and self.msg.get_payload():
+            return MIMEEntity(self.msg.get_payload()[0], self, 0)
+        return None
+
+    def GetNextSibling(self):
+        """Method returning the next entity of the parent entity"""
+        if self.parent is None:
+            return None
+        siblings = self.parent.msg.get_payload()
+        if self.index + 1 < len(siblings):
+            return MIMEEntity(siblings[self.index + 1], self.parent, self.index + 1)
+        return None
+
+    def DecodeContent(self):
+        """Method to remove the content transfer encoding of the entity"""
+        data = self.msg.get_payload(decode=True)
+        del self.msg["Content-Transfer-Encoding"]
+        self.msg["Content-Transfer-Encoding"] = "binary"
+        self.msg.set_payload(data)
+
+    def GetContentAsBytes(self, stream, decoded=True):
+        """Method to append the content of the entity to a Stream"""
+        if self.msg.is_multipart():
+            data = (self.msg.preamble or "").encode("utf-8")
+        else:
+            data = self.msg.get_payload(decode=decoded)
+            if isinstance(data, str):
+                data = data.encode("utf-8", "surrogateescape")
+        stream.Write(data)
+
+    def EncodeContent(self, encoding):
+        """Method to encode the content of the entity. Only base64 is supported"""
+        if encoding != self.ENC_BASE64:
+            raise ValueError("Unsupported MIME encoding %d" % encoding)
+        if self.Encoding == self.ENC_BASE64:
+            return
+        data = self.msg.get_payload(decode=True)
+        del self.msg["Content-Transfer-Encoding"]
+        self.msg.set_payload(data)
+        email.encoders.encode_base64(self.msg)
+
+class Stream(object):
+    """Equivalent of an in-memory NotesStream"""
+    def __init__(self):
+        """Stream initialisation method"""
+        self.data = bytearray()
+        self.Position = 0
+
+    @property
+    def Bytes(self):
+        """Size of the stream in bytes"""
+        return len(self.data)
+
+    @property
+    def IsEOS(self):
+        """True if the position is at the end of the stream"""
+        return self.Position >= len(self.data)
+
+    def Read(self, length=65535):
+        """Method to read bytes from the current position"""
+        data = bytes(self.data[self.Position:self.Position + length])
+        self.Position += len(data)
+        return data
+
+    def Write(self, data):
+        """Method to append bytes to the stream"""
+        self.data.extend(data)
+        self.Position = len(self.data)
+        return len(data)
+
+    def Truncate(self):
+        """Method to empty the stream"""
+        self.data = bytearray()
+        self.Position = 0
+
+    def Close(self):
+        """Method to close the stream"""
+        self.Truncate()
+
+class Item(object):
+    """Equivalent of NotesItem for a header of a message"""
+    # NotesItem.Type of the items, TEXT = 1280 and MIME_PART = 25
+    TEXT, MIME_PART = 1280, 25
+
+    def __init__(self, name, text, itype=TEXT):
+        """Item initialisation method"""
+        self.Name = name
+        self.Text = text
+        self.Type = itype
+        self.ValueLength = len(text)
+
+class Document(object):
+    """Equivalent of NotesDocument for a MIME note"""
+    def __init__(self, noteid, rfc822, modified=None):
+        """Document initialisation method"""
+        self.NoteID = noteid
+        self.rfc822 = rfc822
+        self.msg = email.message_from_bytes(rfc822)
+        self.LastModified = modified
+        self.IsDeleted = False
+        self.IsValid = True
+
+    @property
+    def UniversalID(self):
+        """Universal ID of the document, taken from the Message-ID if there is one"""
+        return self.msg.get("Message-ID", self.NoteID).strip("<> ")
+
+    def GetMIMEEntity(self, name="Body"):
+        """Method returning the top MIME entity of the Body"""
+        if name != "Body":
+            return None
+        return MIMEEntity(self.msg)
+
+    def GetFirstItem(self, name):
+        """Method returning an item of the document. The Body is a MIME_PART item
+        and the other items are taken from the headers of the message"""
+        if name == "Body":
+            return Item(name, self.msg.get_payload() if not self.msg.is_multipart() else "",
+                        Item.MIME_PART)
+        elif name == "Form":
+            return Item(name, "Memo")
+        value = self.msg.get(name)
+        if value is None:
+            return None
+        return Item(name, str(value))
+
+    def CreateMIMEEntity(self):
+        """Method to create an empty MIME Body. Every document already has one"""
+        return self.GetMIMEEntity()
+
+class View(object):
+    """Equivalent of NotesView for a folder of the database"""
+    def __init__(self, name, docs, isfolder=True):
+        """View initialisation method"""
+        self.Name = name
+        self.IsFolder = isfolder
+        self.docs = docs
+        self.position = None
+
+    @property
+    def EntryCount(self):
+        """Number of documents in the folder"""
+        return len(self.docs)
+
+    def GetFirstDocument(self):
+        """Method returning the first document of the folder"""
+        return self.docs[0] if self.docs else None
+
+    def GetNextDocument(self, doc):
+        """Method returning the document following doc in the folder"""
+        if self.position is None or len(self.position) != len(self.docs):
+            self.position = dict((id(d), i) for i, d in enumerate(self.docs))
+        i = self.position[id(doc)] + 1
+        return self.docs[i] if i < len(self.docs) else None
+
+class DocumentCollection(object):
+    """Equivalent of NotesDocumentCollection"""
+    def __init__(self, docs):
+        """DocumentCollection initialisation method"""
+        self.docs = docs
+
+    @property
+    def Count(self):
+        """Number of documents in the collection"""
+        return len(self.docs)
+
+class Database(object):
+    """Equivalent of NotesDatabase built from a note source"""
+    def __init__(self, path, notes):
+        """Database initialisation method"""
+        self.FilePath = path
+        self.Views = []
+        folders = {}
+        alldocs = []
+        modified = None
+        if os.path.exists(path):
+            modified = datetime.datetime.fromtimestamp(os.stat(path).st_mtime)
+        for folder, noteid, rfc822 in notes:
+            doc = Document(noteid, rfc822, modified)
+            if folder not in folders:
+                folders[folder] = View(folder, [], folder != "($Sent)")
+                self.Views.append(folders[folder])
+            folders[folder].docs.append(doc)
+            alldocs.append(doc)
+        self.AllDocuments = DocumentCollection(alldocs)
+        self.LastModified = modified
+        self.ReplicaID = None
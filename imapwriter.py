@@ -0,0 +1,449 @@
+# -*- coding: utf-8 -*-
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+# Copyright (C) 2016 Free Software Foundation
+# Author : David Bateman <dbateman@free.fr>
+
+"""Upload of the messages exported by NSF2X to an IMAP server.
+
+IMAPUploader appends the messages to the mailboxes of an IMAP server given by
+a URL "imap://user@host:port/prefix" or "imaps://...", the mailboxes being
+created under the optional prefix. The messages of a mailbox are grouped in
+batches, uploaded by a pool of threads each with its own connection. If the
+server supports LITERAL+ (RFC 7888), the messages of a batch are sent without
+waiting for the server : in a single APPEND command if it also supports
+MULTIAPPEND (RFC 3502), and otherwise as a series of pipelined APPEND
+commands. Otherwise each message is appended with imaplib in turn. The flags
+and the internal date of each message are given to APPEND.
+
+The result of each message is returned, in the order of the messages, by
+Done and Close, as its key and None or the error that prevented its upload.
+
+LocalServer is a minimal IMAP server, storing the messages in memory, against
+which the uploader can be tested without a real server. Running this module
+uploads synthetic messages to it
+
+  python imapwriter.py [messages] [size] [connections] [capabilities]
+"""
+
+# Ignore variable/function/Method naming conventions of PEP8. I like my names
+# pylint: disable=C0103
+
+import base64
+import concurrent.futures
+import imaplib
+import queue
+import re
+import socketserver
+import sys
+import threading
+import time
+import urllib.parse
+
+# Limits of the messages of a mailbox sent in a single batch
+BatchMessages = 50
+BatchSize = 8 << 20
+
+_NEWLINE = re.compile(br"\r?\n")
+
+def EncodeMailbox(name):
+    """Function returning a mailbox name in the modified UTF-7 of IMAP"""
+    out = []
+    pending = []
+    def flush():
+        if pending:
+            encoded = base64.b64encode("".join(pending).encode("utf-16-be")).decode("ascii")
+            out.append("&" + encoded.rstrip("=").replace("/", ",") + "-")
+            del pending[:]
+    for ch in name:
+        if 0x20 <= ord(ch) <= 0x7e:
+            flush()
+            out.append("&-" if ch == "&" else ch)
+        else:
+            pending.append(ch)
+    flush()
+    return "".join(out)
+
+def Quote(text):
+    """Function returning a quoted IMAP string"""
+    return '"' + text.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+class IMAPUploader(object):
+    """Upload of messages to the mailboxes of an IMAP server with a pool of
+    connections"""
+    def __init__(self, url, password, connections=4, timeout=60.):
+        """IMAPUploader initialisation method"""
+        parsed = urllib.parse.urlsplit(url)
+        if parsed.scheme not in ("imap", "imaps") or not parsed.hostname:
+            raise ValueError("Invalid IMAP URL '%s', expected imap://user@host/ or imaps://user@host/" % url)
+        self.ssl = parsed.scheme == "imaps"
+        self.host = parsed.hostname
+        self.port = parsed.port or (993 if self.ssl else 143)
+        self.user = urllib.parse.unquote(parsed.username or "")
+        self.password = password
+        self.prefix = urllib.parse.unquote(parsed.path).strip("/")
+        self.timeout = timeout
+        self.size = connections
+        self.idle = queue.Queue()
+        self.opened = []
+        self.lock = threading.Lock()
+        self.pool = concurrent.futures.ThreadPoolExecutor(connections)
+        self.pending = []
+        self.results = []
+        self.batch = []
+        self.batchsize = 0
+        self.created = set()
+        self.messages = 0
+        self.bytes = 0
+        self.failed = 0
+
+        conn = self._acquire()
+        self.capabilities = set(c.upper() for c in conn.capabilities)
+        self.delimiter = "/"
+        typ, data = conn.list('""', '""')
+        if typ == "OK" and data and data[0]:
+            match = re.match(br'\([^)]*\) "((?:[^"\\]|\\.)*)"', data[0])
+            if match:
+                self.delimiter = match.group(1).replace(b"\\\\", b"\\").decode("ascii")
+        self._release(conn)
+
+    def _connect(self):
+        try:
+            if self.ssl:
+                conn = imaplib.IMAP4_SSL(self.host, self.port)
+            else:
+                conn = imaplib.IMAP4(self.host, self.port)
+            if conn.sock is not None:
+                conn.sock.settimeout(self.timeout)
+            conn.login(self.user, self.password)
+        except imaplib.IMAP4.error as ex:
+            raise OSError("Can not log in to the IMAP server %s as %s : %s" % (self.host, self.user, ex))
+        return conn
+
+    def _acquire(self):
+        """Method returning an idle connection, opening a new one if there are
+        less than the size of the pool"""
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self.lock:
+            if len(self.opened) < self.size:
+                conn = self._connect()
+                self.opened.append(conn)
+                return conn
+        return self.idle.get()
+
+    def _release(self, conn, broken=False):
+        if not broken:
+            self.idle.put(conn)
+            return
+        with self.lock:
+            self.opened.remove(conn)
+        try:
+            conn.shutdown()
+        except (imaplib.IMAP4.error, OSError):
+            pass
+
+    def Mailbox(self, folder):
+        """Method returning the mailbox of a folder, where the empty folder is
+        the INBOX and the sub-folders are separated by "\\" """
+        if not folder and not self.prefix:
+            return "INBOX"
+        parts = [p for p in self.prefix.split("/") if p] + [p for p in folder.split("\\") if p]
+        return self.delimiter.join(EncodeMailbox(p) for p in parts)
+
+    def CreateFolder(self, folder):
+        """Method to create and subscribe to the mailbox of a folder if it
+        doesn't already exist"""
+        mailbox = self.Mailbox(folder)
+        if mailbox in self.created or mailbox.upper() == "INBOX":
+            return mailbox
+        conn = self._acquire()
+        broken = True
+        try:
+            # The parents are created before their sub-folders, and an existing
+            # mailbox gives a NO that is ignored
+            parts = mailbox.split(self.delimiter)
+            for i in range(1, len(parts) + 1):
+                name = self.delimiter.join(parts[:i])
+                if name not in self.created:
+                    conn.create(Quote(name))
+                    conn.subscribe(Quote(name))
+                    self.created.add(name)
+            broken = False
+        except imaplib.IMAP4.error as ex:
+            raise OSError("Can not create the IMAP mailbox %s : %s" % (mailbox, ex))
+        finally:
+            self._release(conn, broken)
+        return mailbox
+
+    def Count(self, folder):
+        """Method returning the number of messages in the mailbox of a folder,
+        0 if it doesn't exist"""
+        mailbox = self.Mailbox(folder)
+        conn = self._acquire()
+        broken = True
+        try:
+            # A mailbox that doesn't exist gives a NO
+            typ, data = conn.status(Quote(mailbox), "(MESSAGES)")
+            broken = False
+        except (imaplib.IMAP4.error, OSError) as ex:
+            raise OSError("Can not read the status of the IMAP mailbox %s : %s" % (mailbox, ex))
+        finally:
+            self._release(conn, broken)
+        if typ != "OK" or not data or not data[0]:
+            return 0
+        match = re.search(br"MESSAGES (\d+)", data[0])
+        return int(match.group(1)) if match else 0
+
+    def Append(self, folder, data, flags=(), date=0, key=None):
+        """Method to add a message to a mailbox, with its flags such as "\\Seen"
+        and its date in seconds since the epoch (0 for the time of the upload).
+        The message is uploaded later by the pool"""
+        mailbox = self.Mailbox(folder)
+        if self.batch and (self.batch[0][0] != mailbox or len(self.batch) >= BatchMessages or
+                           self.batchsize + len(data) > BatchSize):
+            self._submit()
+        data = _NEWLINE.sub(b"\r\n", data)
+        self.batch.append((mailbox, data, " ".join(flags),
+                           imaplib.Time2Internaldate(date) if date else None, key))
+        self.batchsize += len(data)
+
+    def _submit(self):
+        batch = self.batch
+        self.batch = []
+        self.batchsize = 0
+        self.pending.append(self.pool.submit(self._upload, batch))
+        # Keep at most two batches per connection in memory
+        while len(self.pending) > 2 * self.size:
+            self.results.extend(self.pending.pop(0).result())
+
+    def _upload(self, batch):
+        conn = self._acquire()
+        broken = False
+        try:
+            if "LITERAL+" in self.capabilities:
+                errors = self._pipeline(conn, batch)
+            else:
+                errors = []
+                for mailbox, data, flags, date, key in batch:
+                    typ, dat = conn.append(Quote(mailbox), "(%s)" % flags, date, data)
+                    errors.append(None if typ == "OK" else "%s %s" % (typ, dat))
+        except (imaplib.IMAP4.error, OSError) as ex:
+            broken = isinstance(ex, (imaplib.IMAP4.abort, OSError))
+            errors = [str(ex)] * len(batch)
+        finally:
+            self._release(conn, broken)
+        with self.lock:
+            for (mailbox, data, flags, date, key), error in zip(batch, errors):
+                if error is None:
+                    self.messages += 1
+                    self.bytes += len(data)
+                else:
+                    self.failed += 1
+        return [(b[4], error) for b, error in zip(batch, errors)]
+
+    def _pipeline(self, conn, batch):
+        """Method to send a batch with non-synchronizing literals, without
+        waiting for the server, and read the responses"""
+        def message(flags, date, data):
+            return (b" (" + flags.encode("ascii") + b")" +
+                    (b" " + date.encode("ascii") if date else b"") +
+                    b" {%d+}\r\n" % len(data) + data)
+        mailbox = Quote(batch[0][0]).encode("ascii")
+        if "MULTIAPPEND" in self.capabilities:
+            tag = conn._new_tag() # pylint: disable=W0212
+            conn.send(tag + b" APPEND " + mailbox +
+                      b"".join(message(b[2], b[3], b[1]) for b in batch) + b"\r\n")
+            typ, dat = conn._get_tagged_response(tag) # pylint: disable=W0212
+            return [None if typ == "OK" else "%s %s" % (typ, dat)] * len(batch)
+        tags = []
+        for dummy_mailbox, data, flags, date, dummy_key in batch:
+            tag = conn._new_tag() # pylint: disable=W0212
+            conn.send(tag + b" APPEND " + mailbox + message(flags, date, data) + b"\r\n")
+            tags.append(tag)
+        errors = []
+        for tag in tags:
+            typ, dat = conn._get_tagged_response(tag) # pylint: disable=W0212
+            errors.append(None if typ == "OK" else "%s %s" % (typ, dat))
+        return errors
+
+    def Done(self):
+        """Method returning the (key, error) of the messages uploaded since the
+        last call, stopping at the first batch still being uploaded"""
+        while self.pending and self.pending[0].done():
+            self.results.extend(self.pending.pop(0).result())
+        results = self.results
+        self.results = []
+        return results
+
+    def Flush(self):
+        """Method to wait for the upload of all the messages added. Returns the
+        (key, error) of the messages not yet returned by Done"""
+        if self.batch:
+            self._submit()
+        for future in self.pending:
+            self.results.extend(future.result())
+        self.pending = []
+        return self.Done()
+
+    def Close(self):
+        """Method to upload the remaining messages and log out. Returns the
+        (key, error) of the messages not yet returned by Done"""
+        results = self.Flush()
+        self.pool.shutdown()
+        for conn in self.opened:
+            try:
+                conn.logout()
+            except (imaplib.IMAP4.error, OSError):
+                pass
+        self.opened = []
+        return results
+
+class _Handler(socketserver.StreamRequestHandler):
+    """Session of a client of the LocalServer"""
+    def _command(self):
+        """Method reading a command, with its literals. Returns its text with
+        the literals replaced by "\\0", and the literals"""
+        text = b""
+        literals = []
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return None, None
+            line = line.rstrip(b"\r\n")
+            match = re.search(br"\{(\d+)(\+?)\}$", line)
+            if not match:
+                return text + line, literals
+            text += line[:match.start()] + b"\0"
+            if not match.group(2):
+                self.wfile.write(b"+ Ready for literal data\r\n")
+            literals.append(self.rfile.read(int(match.group(1))))
+
+    def handle(self):
+        server = self.server
+        self.wfile.write(b"* OK IMAP4rev1 NSF2X stand-in ready\r\n")
+        while True:
+            text, literals = self._command()
+            if text is None:
+                return
+            tag, dummy_space, rest = text.partition(b" ")
+            command, dummy_space, args = rest.partition(b" ")
+            command = command.upper()
+            tokens = [(t[0], t[1], t[2], t[3]) for t in
+                      re.findall(br'\(([^)]*)\)|"((?:[^"\\]|\\.)*)"|(\0)|([^\s()"\0]+)', args)]
+            strings = [re.sub(br"\\(.)", br"\1", t[1]) if t[1] else t[3] for t in tokens]
+            if command == b"CAPABILITY":
+                self.wfile.write(b"* CAPABILITY IMAP4rev1 " + server.capabilities.encode("ascii") + b"\r\n")
+            elif command == b"LIST":
+                self.wfile.write(b'* LIST (\\Noselect) "/" ""\r\n')
+            elif command == b"CREATE":
+                with server.lock:
+                    if strings[0] in server.mailboxes:
+                        self.wfile.write(tag + b" NO [ALREADYEXISTS] Mailbox exists\r\n")
+                        continue
+                    server.mailboxes[strings[0]] = []
+            elif command == b"APPEND":
+                mailbox = strings[0]
+                if mailbox.upper() == b"INBOX":
+                    mailbox = b"INBOX"
+                messages = []
+                flags, date = b"", None
+                literal = iter(literals)
+                for t in tokens[1:]:
+                    if t[2]:
+                        messages.append((flags, date, next(literal)))
+                        flags, date = b"", None
+                    elif t[1]:
+                        date = t[1]
+                    else:
+                        flags = t[0]
+                with server.lock:
+                    if mailbox not in server.mailboxes:
+                        self.wfile.write(tag + b" NO [TRYCREATE] No such mailbox\r\n")
+                        continue
+                    server.mailboxes[mailbox].extend(messages)
+            elif command == b"STATUS":
+                mailbox = b"INBOX" if strings[0].upper() == b"INBOX" else strings[0]
+                with server.lock:
+                    if mailbox not in server.mailboxes:
+                        self.wfile.write(tag + b" NO [NONEXISTENT] No such mailbox\r\n")
+                        continue
+                    self.wfile.write(b'* STATUS "' + mailbox + b'" (MESSAGES %d)\r\n' %
+                                     len(server.mailboxes[mailbox]))
+            elif command == b"LOGOUT":
+                self.wfile.write(b"* BYE Logging out\r\n" + tag + b" OK LOGOUT completed\r\n")
+                return
+            elif command not in (b"LOGIN", b"SUBSCRIBE", b"NOOP"):
+                self.wfile.write(tag + b" BAD Unknown command\r\n")
+                continue
+            self.wfile.write(tag + b" OK " + command + b" completed\r\n")
+
+class LocalServer(socketserver.ThreadingTCPServer):
+    """Minimal in-memory IMAP server for the tests of IMAPUploader, on a port
+    of localhost chosen by the system. mailboxes maps the name of each mailbox
+    to the (flags, date, message) appended to it"""
+    daemon_threads = True
+
+    def __init__(self, capabilities="LITERAL+ MULTIAPPEND"):
+        """LocalServer initialisation method"""
+        socketserver.ThreadingTCPServer.__init__(self, ("127.0.0.1", 0), _Handler)
+        self.capabilities = capabilities
+        self.mailboxes = {b"INBOX" : []}
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def URL(self):
+        """Method returning the URL of the server for IMAPUploader"""
+        return "imap://test@127.0.0.1:%d/" % self.server_address[1]
+
+    def Stop(self):
+        """Method to stop the server"""
+        self.shutdown()
+        self.server_close()
+
+def SyntheticBenchmark(messages=1000, size=20000, connections=4, capabilities="LITERAL+ MULTIAPPEND"):
+    """Function uploading synthetic messages to a LocalServer. Returns the
+    number of messages received by the server and the time taken"""
+    server = LocalServer(capabilities)
+    try:
+        body = b"\n".join([b"x" * 76] * (size // 77))
+        start = time.time()
+        uploader = IMAPUploader(server.URL(), "", connections)
+        for folder in ("", "Sent", "Archive\\2016"):
+            uploader.CreateFolder(folder)
+        for i in range(messages):
+            folder = ("", "Sent", "Archive\\2016")[i % 3]
+            uploader.Append(folder, b"Subject: Message %d\n\n" % i + body, ("\\Seen",),
+                            1500000000 + i, i)
+        results = uploader.Close()
+        elapsed = time.time() - start
+        errors = [r for r in results if r[1] is not None]
+        if errors:
+            raise OSError("%d messages not uploaded : %s" % (len(errors), errors[0][1]))
+        return sum(len(m) for m in server.mailboxes.values()), elapsed
+    finally:
+        server.Stop()
+
+if __name__ == '__main__':
+    received, seconds = SyntheticBenchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 1000,
+                                           int(sys.argv[2]) if len(sys.argv) > 2 else 20000,
+                                           int(sys.argv[3]) if len(sys.argv) > 3 else 4,
+                                           sys.argv[4] if len(sys.argv) > 4 else "LITERAL+ MULTIAPPEND")
+    print("%d messages uploaded in %.2fs (%.0f messages/s)" % (received, seconds, received / seconds))
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+# Copyright (C) 2016 Free Software Foundation
+# Author : David Bateman <dbateman@free.fr>
+
+"""Maildir output of NSF2X.
+
+The messages of an NSF file are written to a Maildir with the Maildir++
+layout used by Dovecot and Courier : the Inbox is the Maildir itself, and
+the other Notes folders are the sub-directories ".Folder", ".Folder.Sub" and
+so on. Each folder has the directories tmp, new and cur. A message is written
+to tmp under a unique name, and renamed to new once complete, so that a
+reader never sees a partial message. The unique names include the time, the
+process ID and a counter, so that several processes can write to the same
+Maildir.
+
+If fanout is True, the messages of new are placed in 256 sub-directories
+named after the first two hexadecimal digits of the MD5 of their name, to
+bound the size of the directories. Standard Maildir readers don't look in
+these sub-directories.
+"""
+
+# Ignore variable/function/Method naming conventions of PEP8. I like my names
+# pylint: disable=C0103
+
+import hashlib
+import itertools
+import os
+import socket
+import time
+
+def _hostname():
+    # "/" and ":" can't be used in the names of the messages
+    return socket.gethostname().replace("/", "\\057").replace(":", "\\072")
+
+class Maildir(object):
+    """Maildir++ directory of the messages of an NSF file"""
+    def __init__(self, path, fanout=False):
+        """Maildir initialisation method"""
+        self.path = path
+        self.fanout = fanout
+        self.host = _hostname()
+        self.counter = itertools.count(1)
+        self.CreateFolder("")
+
+    def FolderPath(self, name):
+        """Method returning the directory of a folder, the Maildir itself for the
+        empty name of the Inbox. The "\\" of the Notes folder hierarchy become
+        "." and the "." of the names "_" """
+        if not name:
+            return self.path
+        parts = [p.replace(".", "_") for p in name.split("\\")]
+        return os.path.join(self.path, "." + ".".join(parts))
+
+    def CreateFolder(self, name):
+        """Method to create the directories of a Notes folder"""
+        path = self.FolderPath(name)
+        for sub in ("tmp", "new", "cur"):
+            if not os.path.isdir(os.path.join(path, sub)):
+                os.makedirs(os.path.join(path, sub))
+        if path != self.path and not os.path.exists(os.path.join(path, "maildirfolder")):
+            open(os.path.join(path, "maildirfolder"), "wb").close()
+        return path
+
+    def UniqueName(self):
+        """Method returning a new unique name for a message"""
+        now = time.time()
+        return "%d.M%dP%dQ%d.%s" % (int(now), int((now % 1) * 1000000), os.getpid(),
+                                    next(self.counter), self.host)
+
+    def NewMessage(self, name):
+        """Method returning the temporary path of a new message of a Notes
+        folder, and the path to which it's renamed once complete"""
+        path = self.FolderPath(name)
+        unique = self.UniqueName()
+        new = os.path.join(path, "new")
+        if self.fanout:
+            new = os.path.join(new, hashlib.md5(unique.encode("utf-8")).hexdigest()[:2])
+            if not os.path.isdir(new):
+                os.makedirs(new, exist_ok=True)
+        return os.path.join(path, "tmp", unique), os.path.join(new, unique)
+
+    def Messages(self):
+        """Method returning the paths of the messages of all the folders, in
+        their directories new and cur and their fan-out sub-directories"""
+        folders = [self.path] + [os.path.join(self.path, d) for d in sorted(os.listdir(self.path))
+                                 if d.startswith(".") and os.path.isdir(os.path.join(self.path, d))]
+        for folder in folders:
+            for sub in ("new", "cur"):
+                for top, dirs, files in os.walk(os.path.join(folder, sub)):
+                    dirs.sort()
+                    for name in sorted(files):
+                        if not name.startswith("."):
+                            yield os.path.join(top, name)
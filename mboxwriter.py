@@ -0,0 +1,592 @@
+# -*- coding: utf-8 -*-
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+# Copyright (C) 2016 Free Software Foundation
+# Author : David Bateman <dbateman@free.fr>
+
+"""MBOX output of NSF2X.
+
+MBOXFile writes the messages to an MBOX file in the mboxrd format. The lines
+of a message starting with "From ", preceded by any number of ">", are
+escaped with one more ">", so that the file is split correctly into messages.
+The escaping is done with a single substitution on each buffer written, the
+start of the last line of the buffer being kept until the next one if it
+could still become a "From " line.
+
+An index of the messages is written alongside the MBOX file, in the file
+"<mbox>.idx". It starts with IndexMagic, followed by one IndexRecord per
+message with the offset and the length of the message in the MBOX file
+(including its "From " line but not the empty line separating it from the
+next message), its date in seconds since the epoch (0 if unknown) and its
+Notes NoteID. Message n is found with ReadIndexEntry without reading the
+rest of the index or the MBOX file.
+
+If compress is True, MBOXFile writes the MBOX file compressed in the BGZF
+format, as a series of gzip members holding at most BlockSize bytes each,
+that can be read by any gzip tool. The blocks are compressed by a pool of
+threads, zlib releasing the GIL. The messages fill the blocks one after the
+other, and a block is only ended early at a checkpoint, once CheckpointSize
+bytes have been written since the last one, or when the file is closed. The
+offsets of the index, and those given by tell, are offsets in the
+uncompressed data, as for an uncompressed file. The block holding an offset
+is found from the sizes in the headers and the trailers of the blocks, so a
+message is read by decompressing only its own blocks (see ReadMessage). The
+messages written since the last checkpoint are only on disk once the next
+one is reached (see MBOXFile.durable).
+
+SortMBOX rewrites an MBOX file with its messages in the order of their dates,
+in bounded memory. The messages are read in the order of the index, and
+each time SortMemory bytes of messages have been read they are sorted and
+written to a temporary run file. The runs are then merged into the new MBOX
+file, reading a message of each run at a time. The messages without a date
+come last, and the messages with the same date keep their order. As the
+offsets of the messages change, the old and new offsets of each message are
+given to a function, so that the locations recorded elsewhere can be
+updated.
+"""
+
+# Ignore variable/function/Method naming conventions of PEP8. I like my names
+# pylint: disable=C0103
+
+import calendar
+import concurrent.futures
+import email.utils
+import gzip
+import heapq
+import os
+import re
+import shutil
+import struct
+import sys
+import tempfile
+import zlib
+
+IndexMagic = b"NSF2XIDX"
+IndexRecord = struct.Struct("<QQqI")
+
+# The largest block of BGZF, such that an incompressible block still fits in
+# the 64 kB of a BGZF block once compressed, and the empty block ending a file
+BlockSize = 0xff00
+BlockEOF = b"\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00BC\x02\x00\x1b\x00\x03\x00\x00\x00\x00\x00\x00\x00\x00\x00"
+
+# Bytes of a compressed MBOX file written between two checkpoints, where the
+# current block is ended and the blocks are written to the file
+CheckpointSize = 16 * BlockSize
+
+# Bytes of messages sorted in memory by SortMBOX, and buffer of each run file
+SortMemory = 256 << 20
+RunBuffer = 1 << 20
+
+# Record of a message in a run file of SortMBOX : date, NoteID, start and end
+# in the MBOX file and length
+_RUN = struct.Struct("<qIQQQ")
+
+# Lines to escape, and the start of a line that might become one
+_FROM = re.compile(br"(?m)^(>*From )")
+_PARTIAL = re.compile(br">*(?:F(?:r(?:o(?:m)?)?)?)?\Z")
+
+def MessageDate(mime):
+    """Function returning the Date header of a MIME entity in seconds since the
+    epoch, or 0 if it is absent or can't be parsed"""
+    header = mime.GetSomeHeaders(["Date"], True) if mime != None else ""
+    parsed = email.utils.parsedate_tz(header.partition(":")[2].strip())
+    if parsed is None:
+        return 0
+    try:
+        return calendar.timegm(parsed[:9]) - (parsed[9] or 0)
+    except (OverflowError, ValueError):
+        return 0
+
+def CompressBlock(data, level=6):
+    """Function returning a BGZF block, a gzip member whose extra field BC
+    gives its size, with the compression of data"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    deflated = compressor.compress(data) + compressor.flush()
+    return (struct.pack("<4sIBBH2sHH", b"\x1f\x8b\x08\x04", 0, 0, 0xff, 6, b"BC", 2,
+                        len(deflated) + 25) +
+            deflated + struct.pack("<II", zlib.crc32(data) & 0xffffffff, len(data)))
+
+def _blocks(f):
+    """Generator of the (offset, size, length) of the BGZF blocks of a file,
+    where size is the compressed size of a block and length the size of its
+    data, read from its header and its trailer. A block truncated by a crash
+    ends the file"""
+    offset = 0
+    while True:
+        f.seek(offset)
+        header = f.read(18)
+        if len(header) < 18:
+            return
+        if header[:4] != b"\x1f\x8b\x08\x04" or header[12:14] != b"BC":
+            raise ValueError("%s has no BGZF block at offset %d" % (f.name, offset))
+        size = struct.unpack("<H", header[16:18])[0] + 1
+        f.seek(offset + size - 4)
+        trailer = f.read(4)
+        if len(trailer) < 4:
+            return
+        yield offset, size, struct.unpack("<I", trailer)[0]
+        offset += size
+
+def _readBlocks(f, offset, length):
+    """Function returning length bytes of the data of a BGZF file from offset,
+    decompressing only the blocks holding them"""
+    data = bytearray()
+    start = 0
+    for block, size, blocklength in _blocks(f):
+        if start + blocklength > offset:
+            f.seek(block)
+            data += gzip.decompress(f.read(size))
+            if start + len(data) >= offset + length:
+                break
+        else:
+            start += blocklength
+    return bytes(data[offset - start:offset - start + length])
+
+def ReadMessage(path, n):
+    """Function returning message n of an MBOX file, compressed or not, using
+    its index"""
+    offset, length = ReadIndexEntry(path, n)[:2]
+    with open(path, "rb") as f:
+        if f.read(2) == b"\x1f\x8b":
+            return _readBlocks(f, offset, length)
+        f.seek(offset)
+        return f.read(length)
+
+def ReadIndexEntry(path, n):
+    """Function returning the n-th (offset, length, date, noteid) of the index
+    of an MBOX file, where noteid is the NoteID in hexadecimal"""
+    with open(path + ".idx", "rb") as f:
+        if f.read(len(IndexMagic)) != IndexMagic:
+            raise ValueError("%s.idx is not an NSF2X MBOX index" % path)
+        f.seek(len(IndexMagic) + n * IndexRecord.size)
+        data = f.read(IndexRecord.size)
+        if len(data) < IndexRecord.size:
+            raise IndexError("No message %d in %s" % (n, path))
+        offset, length, date, noteid = IndexRecord.unpack(data)
+        return offset, length, date, "%X" % noteid
+
+def ReadIndex(path):
+    """Generator of the (offset, length, date, noteid) of the index of an MBOX
+    file"""
+    with open(path + ".idx", "rb") as f:
+        if f.read(len(IndexMagic)) != IndexMagic:
+            raise ValueError("%s.idx is not an NSF2X MBOX index" % path)
+        while True:
+            data = f.read(IndexRecord.size)
+            if len(data) < IndexRecord.size:
+                break
+            offset, length, date, noteid = IndexRecord.unpack(data)
+            yield offset, length, date, "%X" % noteid
+
+def _skip(f, start, end, path):
+    """Function checking that the bytes of a file between two messages, or
+    after the last one if end is None, hold no message. Files written by older
+    versions of NSF2X can have empty lines there"""
+    f.seek(start)
+    gap = f.read(end - start) if end is not None else f.read()
+    if gap.strip(b"\n"):
+        raise ValueError("%s has data at offset %d that isn't in its index" % (path, start))
+
+def _messages(path, compress=False):
+    """Generator of the (date, noteid, start, end, data) of the messages of an
+    MBOX file, compressed or not, in the order of its index, where end is the
+    offset after the separator of the message. A compressed file is read as a
+    single stream. The index must cover the whole file"""
+    with (gzip.open if compress else open)(path, "rb") as f:
+        pos = 0
+        for offset, length, date, noteid in ReadIndex(path):
+            if offset != pos:
+                _skip(f, pos, offset, path)
+            f.seek(offset)
+            data = f.read(length)
+            if len(data) < length:
+                raise ValueError("%s is shorter than its index" % path)
+            pos = offset + length + 1
+            yield date, int(noteid, 16), offset, pos, data
+        _skip(f, pos, None, path)
+
+def _key(message):
+    """Function returning the sort key of a message, the undated last"""
+    return message[0] if message[0] != 0 else sys.maxsize
+
+def _writeRun(path, messages):
+    """Function writing sorted messages to a run file. Returns its size"""
+    with open(path, "wb", RunBuffer) as f:
+        for date, noteid, start, end, data in messages:
+            f.write(_RUN.pack(date, noteid, start, end, len(data)))
+            f.write(data)
+        return f.tell()
+
+def _readRun(path):
+    """Generator of the (date, noteid, start, end, data) of the messages of a
+    run file"""
+    with open(path, "rb", RunBuffer) as f:
+        while True:
+            header = f.read(_RUN.size)
+            if len(header) < _RUN.size:
+                break
+            date, noteid, start, end, length = _RUN.unpack(header)
+            yield date, noteid, start, end, f.read(length)
+
+def SortMBOX(path, memory=SortMemory, tmpdir=None, moved=None):
+    """Function to sort the messages of an MBOX file and of its index by date,
+    with at most memory bytes of messages in memory. The run files are
+    written to a temporary directory of tmpdir, by default the directory of
+    the MBOX file, and the sorted file replaces the MBOX file once complete.
+    If moved isn't None, it is called with the old and the new (start, end)
+    of each message before the file is replaced. Returns the number of
+    messages, the number of runs and the size of the run files"""
+    with open(path, "rb") as f:
+        compress = f.read(2) == b"\x1f\x8b"
+    tmpdir = tempfile.mkdtemp(prefix="nsf2x-sort-", dir=tmpdir or os.path.dirname(os.path.abspath(path)))
+    sorted_path = path + ".sorted"
+    try:
+        runs = []
+        temp = 0
+        batch = []
+        size = 0
+        count = 0
+        for message in _messages(path, compress):
+            batch.append(message)
+            size += len(message[4])
+            count += 1
+            if size >= memory:
+                batch.sort(key=_key)
+                runs.append(os.path.join(tmpdir, "run%d" % len(runs)))
+                temp += _writeRun(runs[-1], batch)
+                batch = []
+                size = 0
+        batch.sort(key=_key)
+        if runs and batch:
+            runs.append(os.path.join(tmpdir, "run%d" % len(runs)))
+            temp += _writeRun(runs[-1], batch)
+            batch = []
+
+        # The messages of a single run are written directly from memory. The
+        # merge is stable, the runs being in the order of the file
+        messages = heapq.merge(*[_readRun(run) for run in runs], key=_key) if runs else batch
+        out = MBOXFile(sorted_path, False, compress)
+        try:
+            written = 0
+            for date, noteid, start, end, data in messages:
+                offsets = out.WriteMessage(data, "%X" % noteid, date)
+                if moved is not None:
+                    moved((start, end), offsets)
+                written += 1
+        finally:
+            out.close()
+        if written != count:
+            raise ValueError("%d messages of %s lost by the sort" % (count - written, path))
+        os.replace(sorted_path + ".idx", path + ".idx")
+        os.replace(sorted_path, path)
+        return count, len(runs), temp
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+        for name in (sorted_path, sorted_path + ".idx"):
+            if os.path.exists(name):
+                os.remove(name)
+
+class BGZFWriter(object):
+    """Writer of BGZF blocks to a file, compressing the blocks with a pool of
+    threads. The data is written in full blocks, and Discard returns to the
+    position of the last Mark or Sync, even if some of the blocks after it
+    were already written to the file"""
+    def __init__(self, f, workers=None, level=6):
+        """BGZFWriter initialisation method"""
+        self.f = f
+        self.level = level
+        self.workers = workers or os.cpu_count() or 1
+        self.pool = concurrent.futures.ThreadPoolExecutor(self.workers)
+        self.buf = bytearray()
+        self.pending = []
+        self.size = 0
+        self.blocks = 0
+        self.written = 0
+        # Size of the data at the mark, with the number of blocks before it
+        # and the start of the block holding it
+        self.marked = 0
+        self.mark = (0, b"")
+        self.markOffset = None
+
+    def _submit(self, data):
+        self.pending.append(self.pool.submit(CompressBlock, bytes(data), self.level))
+        self.blocks += 1
+        # Keep at most two blocks per thread in memory, writing them in order
+        while len(self.pending) > 2 * self.workers:
+            self._writeBlock()
+
+    def _writeBlock(self):
+        if self.written == self.mark[0]:
+            self.markOffset = self.f.tell()
+        self.f.write(self.pending.pop(0).result())
+        self.written += 1
+
+    def Mark(self):
+        """Method to mark the current position, that Discard returns to"""
+        self.marked = self.size
+        self.mark = (self.blocks, bytes(self.buf))
+        self.markOffset = None
+
+    def write(self, data):
+        """Method to add data, compressing each full block"""
+        self.buf += data
+        self.size += len(data)
+        if len(self.buf) >= BlockSize:
+            for i in range(0, len(self.buf) - BlockSize + 1, BlockSize):
+                self._submit(self.buf[i:i + BlockSize])
+            del self.buf[:len(self.buf) - len(self.buf) % BlockSize]
+
+    def Sync(self):
+        """Method to end the current block and write all the blocks"""
+        if self.buf:
+            self._submit(self.buf)
+            self.buf = bytearray()
+        while self.pending:
+            self._writeBlock()
+        self.Mark()
+
+    def Discard(self):
+        """Method to drop the data written since the last Mark or Sync"""
+        blocks, start = self.mark
+        # The blocks before the mark are kept, and those after it removed from
+        # the file if they were already written
+        while self.written < blocks:
+            self._writeBlock()
+        for future in self.pending:
+            future.cancel()
+        self.pending = []
+        if self.markOffset is not None:
+            self.f.seek(self.markOffset)
+            self.f.truncate()
+        self.blocks = self.written = blocks
+        self.buf = bytearray(start)
+        self.size = self.marked
+        self.markOffset = None
+
+    def Close(self):
+        """Method to write the remaining blocks and the end of file block"""
+        self.Sync()
+        self.f.write(BlockEOF)
+        self.pool.shutdown()
+
+class MBOXFile(object):
+    """MBOX file with "From " escaping and an index of its messages. If append
+    is True the messages are added to an existing file, and if compress is True
+    the file is compressed in the BGZF format. The messages before the offset
+    durable are on disk, those after it only once flush is called for an
+    uncompressed file, or the next checkpoint is reached for a compressed one"""
+    def __init__(self, path, append=False, compress=False):
+        """MBOXFile initialisation method"""
+        self.path = path
+        self.f = open(path, "ab" if append else "wb")
+        self.out = BGZFWriter(self.f) if compress else self.f
+        self.pending = b""
+        if compress and self.f.tell() > 0:
+            self._openBlocks()
+        self.index = open(path + ".idx", "r+b" if append and os.path.exists(path + ".idx") else "w+b")
+        if self.index.read(len(IndexMagic)) != IndexMagic:
+            self.index.seek(0)
+            self.index.truncate(0)
+            self.index.write(IndexMagic)
+        self._trimIndex(self.tell())
+        self.bol = True
+        self.start = None
+        self.date = 0
+        self.noteid = 0
+        self.durable = self.tell()
+
+    def _openBlocks(self):
+        # Continue a compressed file after its last block holding data, dropping
+        # the end of file block and any block truncated by a crash
+        size = 0
+        end = 0
+        with open(self.path, "rb") as f:
+            for offset, blocksize, length in _blocks(f):
+                size += length
+                if length > 0:
+                    end = offset + blocksize
+        self.f.truncate(end)
+        self.out.size = size
+        self.out.Mark()
+
+    def _truncateBlocks(self, size):
+        # Cut a compressed file in the block holding the offset size, and write
+        # the start of this block again
+        self.out.Sync()
+        self.f.flush()
+        start = 0
+        with open(self.path, "rb") as f:
+            for offset, blocksize, length in _blocks(f):
+                if start + length > size:
+                    f.seek(offset)
+                    data = gzip.decompress(f.read(blocksize))[:size - start]
+                    break
+                start += length
+            else:
+                offset = f.seek(0, os.SEEK_END)
+                data = b""
+        self.f.truncate(offset)
+        self.out.size = start
+        self.out.write(data)
+        self.out.Mark()
+
+    def _trimIndex(self, size):
+        # Drop the index records of the messages beyond the end of the MBOX file
+        self.index.seek(0, os.SEEK_END)
+        end = self.index.tell()
+        count = (end - len(IndexMagic)) // IndexRecord.size
+        while count > 0:
+            self.index.seek(len(IndexMagic) + (count - 1) * IndexRecord.size)
+            offset, length = IndexRecord.unpack(self.index.read(IndexRecord.size))[:2]
+            if offset + length <= size:
+                break
+            count -= 1
+        self.index.seek(len(IndexMagic) + count * IndexRecord.size)
+        self.index.truncate()
+
+    def BeginMessage(self, noteid, date=0):
+        """Method to start a message. Its first line is the MBOX "From " line
+        and isn't escaped"""
+        self.Flush()
+        if self.out is not self.f:
+            # A failed message is discarded back to its start
+            self.out.Mark()
+        self.start = self.tell()
+        self.noteid = int(noteid, 16)
+        self.date = date
+        self.bol = False
+
+    def EndMessage(self):
+        """Method to end a message, writing the separator of the messages and
+        the index record of the message"""
+        self.Flush()
+        if self.start is not None:
+            length = self.tell() - self.start
+            self.index.write(IndexRecord.pack(self.start, length, self.date, self.noteid))
+            self.start = None
+        self.out.write(b"\n")
+        self.bol = True
+        if self.out is not self.f and self.out.size - self.durable >= CheckpointSize:
+            self.Checkpoint()
+
+    def WriteMessage(self, data, noteid, date=0):
+        """Method to write a message already escaped, starting with its "From "
+        line, as read from another MBOX file. Returns the offsets of its start
+        and of the end of its separator"""
+        self.BeginMessage(noteid, date)
+        start = self.start
+        self.out.write(data)
+        self.EndMessage()
+        return start, self.tell()
+
+    def write(self, data):
+        """Method to write a buffer of the message, escaping its "From " lines"""
+        if self.pending:
+            data = self.pending + data
+            self.pending = b""
+        last = data.rfind(b"\n") + 1
+        if (last > 0 or self.bol) and _PARTIAL.match(data, last):
+            self.pending = data[last:]
+            data = data[:last]
+        if not data:
+            return
+        if self.bol:
+            self.out.write(_FROM.sub(br">\1", data))
+        else:
+            # The first line continues a line already written
+            first = data.find(b"\n") + 1 or len(data)
+            self.out.write(data[:first])
+            self.out.write(_FROM.sub(br">\1", data[first:]))
+        self.bol = data.endswith(b"\n")
+
+    def Flush(self):
+        """Method to write the end of the last line"""
+        if self.pending:
+            self.out.write(self.pending)
+            self.bol = self.pending.endswith(b"\n")
+            self.pending = b""
+
+    def Checkpoint(self):
+        """Method to write all the messages to the disk, ending the current block
+        of a compressed file"""
+        self.Flush()
+        if self.out is not self.f:
+            self.out.Sync()
+        self.f.flush()
+        self.index.flush()
+        self.durable = self.tell()
+
+    def flush(self):
+        """Method to flush the MBOX file and its index. The blocks of a compressed
+        file are only ended at the checkpoints, so that small messages share
+        their blocks"""
+        if self.out is not self.f:
+            self.Flush()
+            self.f.flush()
+            self.index.flush()
+        else:
+            self.Checkpoint()
+
+    def tell(self):
+        """Method returning the position in the MBOX file, in the uncompressed
+        data for a compressed file"""
+        if self.out is not self.f:
+            return self.out.size + len(self.pending)
+        return self.f.tell() + len(self.pending)
+
+    def _drop(self, size):
+        # Drop the data of a compressed file after size, in general the data
+        # written since the start of the current message
+        self.pending = b""
+        if size == self.out.size:
+            return
+        if size == self.out.marked:
+            self.out.Discard()
+        else:
+            self._truncateBlocks(size)
+        self.durable = min(self.durable, size)
+
+    def seek(self, offset):
+        """Method to return to the start of a message, discarding anything
+        written after it"""
+        self.pending = b""
+        if self.out is not self.f:
+            self._drop(offset)
+        else:
+            self.f.seek(offset)
+        self.bol = offset != self.start
+
+    def truncate(self, size):
+        """Method to truncate the MBOX file and its index"""
+        self.pending = b""
+        if self.out is not self.f:
+            self._drop(size)
+        else:
+            self.f.truncate(size)
+            self.durable = min(self.durable, size)
+        self._trimIndex(size)
+
+    def close(self):
+        """Method to close the MBOX file and its index. Closing it again has no
+        effect"""
+        if self.f.closed:
+            return
+        self.Flush()
+        self.durable = self.tell()
+        if self.out is not self.f:
+            self.out.Close()
+        self.f.close()
+        self.index.close()
@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+# Copyright (C) 2016 Free Software Foundation
+# Author : David Bateman <dbateman@free.fr>
+
+"""JSON lines metadata of the messages exported by NSF2X.
+
+MetadataWriter writes a JSON object per line for each message exported from
+an NSF file, optionally compressed with gzip, so that the metadata can be
+loaded into a database without parsing the messages again. The records are
+built from the MIME headers and structure of the Notes document :
+
+  {"mailbox": "jsmith", "folder": "Inbox", "noteid": "8FA", "unid": "...",
+   "message_id": "<...>", "in_reply_to": null, "date": "2016-03-01T09:30:00Z",
+   "subject": "Budget", "from": [{"name": "John Smith", "address": "..."}],
+   "to": [...], "cc": [...], "bcc": [...], "size": 18327, "parts": 3,
+   "attachments": 1, "attachment_names": ["budget.xls"],
+   "location": "jsmith.mbox|1024|19351"}
+
+The size is that of the message as written by NSF2X, and the location that
+of the journal. Relocate updates the locations of the messages moved in the
+output, as when an MBOX file is sorted.
+"""
+
+# Ignore variable/function/Method naming conventions of PEP8. I like my names
+# pylint: disable=C0103
+
+import email
+import email.errors
+import email.header
+import email.utils
+import gzip
+import io
+import json
+import os
+import re
+import time
+
+import searchindex
+
+# Size of the buffer of the output
+BufferSize = 1 << 20
+
+# The location, last field of a record
+_LOCATION = re.compile(br',"location":("(?:[^"\\]|\\.)*")\}$')
+
+def _decode(value):
+    """Function returning the decoded value of a header with encoded words"""
+    try:
+        return str(email.header.make_header(email.header.decode_header(value)))
+    except (LookupError, UnicodeError, ValueError, email.errors.HeaderParseError):
+        return value
+
+def Addresses(mime, names, resolver=None):
+    """Function returning the names and addresses of the address headers names
+    of a MIME entity. The names are decoded after the addresses are split, as
+    they can contain commas. If resolver isn't None the Notes names are
+    replaced by their SMTP address"""
+    values = [" ".join(line.partition(":")[2].split())
+              for line in re.split(r"\n(?![ \t])", mime.GetSomeHeaders(names, True))]
+    value = ", ".join(v for v in values if v)
+    if resolver and value:
+        value = resolver.RewriteAddresses(value) or value
+    return [{"name" : _decode(realname), "address" : address}
+            for realname, address in email.utils.getaddresses([value]) if address]
+
+def _filename(mime):
+    """Function returning the file name of a MIME part, from its
+    Content-Disposition or Content-Type headers"""
+    headers = mime.GetSomeHeaders(["Content-Disposition", "Content-Type"], True)
+    return email.message_from_string(headers).get_filename()
+
+def Structure(mime):
+    """Function returning the number of parts of a MIME message, and the names
+    of its attachments. As in the attachment store, the parts that aren't the
+    body and aren't text, multipart or message are attachments, as well as
+    the parts with the disposition attachment"""
+    parts = 0
+    names = []
+    stack = [(mime, True)]
+    while stack:
+        (mime, first) = stack.pop()
+        if mime is None:
+            continue
+        if mime.ContentType == "multipart":
+            children = []
+            child = mime.GetFirstChildEntity()
+            while child is not None:
+                children.append((child, False))
+                child = child.GetNextSibling()
+            stack.extend(reversed(children))
+            continue
+        parts += 1
+        if not first and (mime.ContentType not in ("text", "message") or
+                          "attachment" in mime.GetSomeHeaders(["Content-Disposition"], True).lower()):
+            names.append(_filename(mime) or "")
+    return parts, names
+
+def _iso(date):
+    """Function returning a date in seconds since the epoch in ISO 8601"""
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(date)) if date else None
+
+def Record(mime, mailbox, folder, noteid, unid, date, size, location, resolver=None):
+    """Function returning the metadata of an exported message"""
+    (parts, names) = Structure(mime)
+    return {"mailbox" : mailbox,
+            "folder" : folder,
+            "noteid" : noteid,
+            "unid" : unid,
+            "message_id" : searchindex.Header(mime, ["Message-ID"]) or None,
+            "in_reply_to" : searchindex.Header(mime, ["In-Reply-To"]) or None,
+            "date" : _iso(date),
+            "subject" : searchindex.Header(mime, ["Subject"]),
+            "from" : Addresses(mime, ["From"], resolver),
+            "to" : Addresses(mime, ["To"], resolver),
+            "cc" : Addresses(mime, ["Cc"], resolver),
+            "bcc" : Addresses(mime, ["Bcc"], resolver),
+            "size" : size,
+            "parts" : parts,
+            "attachments" : len(names),
+            "attachment_names" : [n for n in names if n],
+            "location" : location}
+
+def _trim(path):
+    """Function to remove a line truncated by a crash at the end of a file"""
+    with open(path, "r+b") as f:
+        end = f.seek(0, io.SEEK_END)
+        pos = end
+        while pos > 0:
+            size = min(pos, 65536)
+            f.seek(pos - size)
+            data = f.read(size)
+            last = data.rfind(b"\n")
+            if last >= 0:
+                pos = pos - size + last + 1
+                break
+            pos -= size
+        if pos != end:
+            f.truncate(pos)
+
+class MetadataWriter(object):
+    """Buffered JSON lines file of the metadata of the messages, compressed
+    with gzip if compress is True. With append, the records are added to an
+    existing file, a new gzip member being started"""
+    def __init__(self, path, compress=False, append=False):
+        """MetadataWriter initialisation method"""
+        self.path = path
+        self.compress = compress
+        self.records = 0
+        self.f = self._open(append)
+
+    def _open(self, append):
+        if self.compress:
+            return io.BufferedWriter(gzip.open(self.path, "ab" if append else "wb", 6), BufferSize)
+        if append and os.path.exists(self.path):
+            _trim(self.path)
+        return open(self.path, "ab" if append else "wb", BufferSize)
+
+    def Write(self, record):
+        """Method to write the metadata of a message"""
+        self.f.write(json.dumps(record, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n")
+        self.records += 1
+
+    def Relocate(self, locations):
+        """Method to replace the locations of messages moved in the output,
+        given by a dictionary of the old and the new locations. The file is
+        rewritten, only the locations of the records being decoded"""
+        self.f.close()
+        tmp = self.path + ".tmp"
+        try:
+            with (gzip.open(self.path, "rb") if self.compress else open(self.path, "rb")) as fin, \
+                 (gzip.open(tmp, "wb", 6) if self.compress else open(tmp, "wb", BufferSize)) as fout:
+                for line in fin:
+                    match = _LOCATION.search(line.rstrip(b"\n"))
+                    if match:
+                        new = locations.get(json.loads(match.group(1).decode("utf-8")))
+                        if new is not None:
+                            line = (line[:match.start(1)] +
+                                    json.dumps(new, ensure_ascii=False).encode("utf-8") + b"}\n")
+                    fout.write(line)
+            os.replace(tmp, self.path)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            self.f = self._open(True)
+
+    def Flush(self):
+        """Method to write the buffered records to the file"""
+        self.f.flush()
+
+    def Close(self):
+        """Method to write the buffered records and close the file"""
+        self.f.close()
@@ -0,0 +1,404 @@
+# -*- coding: utf-8 -*-
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+# Copyright (C) 2016 Free Software Foundation
+# Author : David Bateman <dbateman@free.fr>
+
+"""Writing of the Notes MIME entities of a message to a file.
+
+These functions only use the NotesMIMEEntity interface, and so can be used
+with the COM objects of Notes as well as the objects of fakenotes.py or the
+objects replayed by replay.py.
+"""
+
+# Ignore variable/function/Method naming conventions of PEP8. I like my names
+# pylint: disable=C0103
+
+import binascii
+import ctypes
+import re
+import sys
+
+# Parts larger than StreamThreshold bytes are copied to the output in chunks of
+# StreamChunk bytes rather than read in memory
+StreamThreshold = 1 << 20
+StreamChunk = 1 << 16
+
+# A line of base64 encodes 57 bytes in 76 characters. Large binary parts are
+# encoded in blocks of Base64Block bytes as they are read
+Base64Line = 57
+Base64Block = Base64Line * 1150
+
+def IsBinary(encoding):
+    """Function to test if a MIMEEntity.Encoding is ENC_IDENTITY_8BIT (1729)
+    or ENC_IDENTITY_BINARY (1730), that are converted to base64"""
+    return encoding == 1730 or encoding == 1729
+
+def Base64Lines(data):
+    """Function returning the base64 encoding of data in lines of 76 characters.
+    The length of data should be a multiple of 57, except for the last block"""
+    encoded = binascii.b2a_base64(data, newline=False)
+    return b"\n".join([encoded[i:i + 76] for i in range(0, len(encoded), 76)]) + b"\n"
+
+def EncodingHeader(headers, encoding):
+    """Function to replace the Content-Transfer-Encoding in a block of headers"""
+    return re.sub(r"(?im)^(Content-Transfer-Encoding:)[^\r\n]*", r"\1 " + encoding, headers)
+
+# Bytes that are written as is in 7bit and quoted-printable content
+_ASCII = bytes(bytearray(range(1, 128)))
+_QPSAFE = bytes(bytearray([9, 10, 13] + list(range(32, 61)) + list(range(62, 127))))
+
+def BestEncoding(data, istext=True):
+    """Function returning the Content-Transfer-Encoding among 7bit,
+    quoted-printable and base64 giving the smallest encoding of data, with the
+    encoded data. The size of the quoted-printable encoding is estimated from
+    the number of bytes to escape. Binary content (istext False) is only
+    considered for 7bit and quoted-printable if it has no line breaks, as
+    these encodings don't keep the CR and LF bytes of a line break"""
+    size = len(data)
+    base64size = (size + Base64Line - 1) // Base64Line * (Base64Line * 4 // 3 + 1)
+    lines = istext or (b"\n" not in data and b"\r" not in data)
+    if lines and not data.translate(None, _ASCII) and b"\r" not in data.replace(b"\r\n", b""):
+        # Pure ASCII without NUL or bare CR. 7bit if the lines are short enough
+        if max(len(l) for l in data.split(b"\n")) <= 998:
+            return "7bit", data
+    if lines:
+        escapes = len(data.translate(None, _QPSAFE))
+        # Each escape takes 3 bytes and each line of 76 characters ends with a soft break
+        qpsize = size + 2 * escapes
+        qpsize += 2 * (qpsize // 75)
+        if qpsize < base64size:
+            return "quoted-printable", binascii.b2a_qp(data, istext=istext)
+    return "base64", Base64Lines(data)
+
+def _append(pieces, text):
+    """Function to add a piece of text or bytes to a message, ending with a newline"""
+    if text.endswith(b'\n' if isinstance(text, bytes) else '\n'):
+        pieces.append(text)
+    else:
+        pieces.extend((text, b'\n' if isinstance(text, bytes) else '\n'))
+
+def PeakMemory():
+    """Function returning the peak memory used by the process in bytes, or None
+    if it is unknown"""
+    if sys.platform == "win32":
+        class PROCESS_MEMORY_COUNTERS(ctypes.Structure): # pylint: disable=R0903
+            """Structure filled by GetProcessMemoryInfo"""
+            _fields_ = [("cb", ctypes.c_ulong), ("PageFaultCount", ctypes.c_ulong),
+                        ("PeakWorkingSetSize", ctypes.c_size_t),
+                        ("WorkingSetSize", ctypes.c_size_t),
+                        ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+                        ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                        ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+                        ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                        ("PagefileUsage", ctypes.c_size_t),
+                        ("PeakPagefileUsage", ctypes.c_size_t)]
+        counters = PROCESS_MEMORY_COUNTERS()
+        counters.cb = ctypes.sizeof(counters)
+        if ctypes.windll.psapi.GetProcessMemoryInfo(ctypes.windll.kernel32.GetCurrentProcess(),
+                                                    ctypes.byref(counters), counters.cb):
+            return counters.PeakWorkingSetSize
+        return None
+    try:
+        import resource
+    except ImportError:
+        return None
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+class Streamer(object):
+    """Copy of the content of large MIME parts to the output in chunks. The
+    content is obtained with GetContentAsBytes in a NotesStream returned by the
+    function create, for example a stream opened on a temporary file, so that
+    it is never completely in memory"""
+    def __init__(self, create, threshold=StreamThreshold, chunk=StreamChunk):
+        """Streamer initialisation method"""
+        self.create = create
+        self.threshold = threshold
+        self.chunk = chunk
+        self.parts = 0
+        self.size = 0
+        self.saved = 0
+        self.recoded = None
+        self.store = None
+
+    def Store(self, mime):
+        """Method to add the decoded content of a part to the AttachmentStore
+        store. Returns its digest and size, or None if the part is too small
+        to be stored"""
+        content = self.Content(mime, True)
+        if isinstance(content, bytes):
+            if len(content) < self.store.minsize:
+                return None
+            return self.store.Add(lambda: [content])
+        def chunks():
+            content.Position = 0
+            return self._chunks(content)
+        try:
+            return self.store.Add(chunks)
+        finally:
+            content.Close()
+
+    def Recode(self, mime):
+        """Method returning the Content-Transfer-Encoding chosen for a binary
+        part, and its encoded content as bytes or, for a large part to encode
+        in base64, as a NotesStream. The result is kept until the content is
+        used, so that the headers of the part can be written first"""
+        if self.recoded is not None and self.recoded[0] is mime:
+            return self.recoded[1], self.recoded[2]
+        content = self.Content(mime, True)
+        if isinstance(content, bytes):
+            encoding, encoded = BestEncoding(content, mime.ContentType == "text")
+            # Count the bytes saved with respect to base64
+            self.saved += (len(content) + Base64Line - 1) // Base64Line * 77 - len(encoded)
+        else:
+            encoding, encoded = "base64", content
+        self.recoded = (mime, encoding, encoded)
+        return encoding, encoded
+
+    def RecodedContent(self, mime):
+        """Method returning the encoded content of a part given by Recode"""
+        dummy_encoding, content = self.Recode(mime)
+        self.recoded = None
+        return content
+
+    def Content(self, mime, decoded=False):
+        """Method returning the content of a part, in its transfer encoding or
+        decoded, as bytes if it is smaller than the threshold, and otherwise as
+        a NotesStream positioned at its start"""
+        stream = self.create()
+        try:
+            mime.GetContentAsBytes(stream, decoded)
+            size = stream.Bytes
+            stream.Position = 0
+            if size > self.threshold:
+                return stream
+            content = b"".join(self._chunks(stream))
+        except:
+            stream.Close()
+            raise
+        stream.Close()
+        return content
+
+    def _chunks(self, stream, size=None):
+        """Generator of the chunks of bytes of a NotesStream, of size bytes
+        except for the last one if size isn't None"""
+        rest = b""
+        while not stream.IsEOS:
+            data = bytes(stream.Read(size or self.chunk))
+            if not data:
+                break
+            if size is None:
+                yield data
+                continue
+            rest += data
+            while len(rest) >= size:
+                yield rest[:size]
+                rest = rest[size:]
+        if rest:
+            yield rest
+
+    def _base64(self, stream):
+        """Generator of the base64 encoding of the chunks of a NotesStream. The
+        chunks are encoded as they are read, as b2a_base64 holds the GIL and a
+        pool of threads wouldn't encode them faster"""
+        for data in self._chunks(stream, Base64Block):
+            yield Base64Lines(data)
+
+    def Copy(self, f, stream, encode=False):
+        """Method to copy a NotesStream returned by Content to the file f,
+        encoding it in base64 if encode is True"""
+        size = stream.Bytes
+        last = b""
+        try:
+            for data in (self._base64(stream) if encode else self._chunks(stream)):
+                f.write(data)
+                last = data[-1:]
+        finally:
+            stream.Close()
+        if last != b'\n':
+            f.write(b'\n')
+        self.parts += 1
+        self.size += size
+
+def MIMEHeader(pieces, mime, mbox=False, resolver=None, streamer=None):
+    """Function to add the MIME headers of a message to the list of text pieces.
+    If mbox is True the MBOX "From " line is added first, and if resolver isn't
+    None the Notes names of the address headers are replaced by SMTP addresses.
+    If streamer isn't None binary content is encoded by MIMEChildren in the
+    smallest of 7bit, quoted-printable and base64, otherwise it is encoded in
+    base64 by Notes"""
+    if mime != None:
+        headers = mime.Headers
+        encoding = mime.Encoding
+
+        # if it's a binary part, force it to b64
+        recode = IsBinary(encoding) and streamer is not None and mime.ContentType != "multipart"
+        if IsBinary(encoding) and streamer is None:
+            # MIMEEntity.ENC_IDENTITY_BINARY and MIMEEntity.ENC_IDENTITY_8BIT
+            mime.EncodeContent(1727)  # MIMEEntity.ENC_BASE64
+            headers = mime.Headers
+
+        # Place the From and Date fields first to simplify conversion to MBOX format
+        if mbox:
+            content = mime.GetSomeHeaders(['From'], True)
+            if content.startswith('From: '):
+                _from = content[6:]
+            elif content.startswith('From:'):
+                _from = content[5:]
+            else:
+                _from = content
+            if _from.endswith('\n'):
+                _from = _from[:-1]
+            if resolver:
+                _from = resolver.RewriteAddresses(_from) or _from
+            content = mime.GetSomeHeaders(['Date'], True)
+            if content.startswith('Date: '):
+                _date = content[6:]
+            elif content.startswith('Date:'):
+                _date = content[5:]
+            else:
+                _date = content
+            if _date.endswith('\n'):
+                _date = _date[:-1]
+            pieces.append('From ' + _from + ' ' + _date + '\n')
+
+        # message envelope. If no MIME-Version header, add one
+        if "MIME-Version:" not in headers:
+            pieces.append("MIME-Version: 1.0\n")
+
+        # Add the rest of the headers, but exclude the MIME content-type to be placed last
+        content = mime.GetSomeHeaders(["Content-type"], False)
+        if resolver:
+            content = resolver.RewriteHeaders(content)
+        if recode:
+            content = EncodingHeader(content, streamer.Recode(mime)[0])
+        _append(pieces, content)
+
+# Actions of the traversal of a MIME tree in MIMEChildren
+_ENTITY, _CHILD, _END = list(range(3))
+
+def MIMEChildren(pieces, mime, first, f, streamer=None):
+    """Function to add a MIME entity and all its children to the list of text
+    pieces. The tree is traversed with an explicit stack rather than by
+    recursion, each child being preceded by its start boundary and followed by
+    its end boundary. If streamer isn't None, the content of the parts that
+    aren't text is obtained with the Streamer and the binary parts are encoded
+    in base64 without modifying the Notes document. The large parts are then
+    copied directly to the file f, after the pieces before them. If the
+    streamer has a store, these parts are replaced by references to the
+    store"""
+    stack = [(_ENTITY, mime, first)]
+    while stack:
+        action, mime, first = stack.pop()
+        if mime is None:
+            continue
+
+        if action == _CHILD:
+            _append(pieces, mime.BoundaryStart)
+            stack.append((_END, mime, False))
+            stack.append((_ENTITY, mime, False))
+            continue
+
+        if action == _END:
+            _append(pieces, mime.BoundaryEnd)
+            child = mime.GetNextSibling()
+            if child != None:
+                stack.append((_CHILD, child, False))
+            continue
+
+        contentType = mime.ContentType
+        headers = mime.Headers
+        encoding = mime.Encoding
+
+        if (streamer is not None and streamer.store is not None and not first and
+                contentType not in ("text", "multipart", "message")):
+            stored = streamer.Store(mime)
+            if stored is not None:
+                pieces.append(streamer.store.Reference(headers, stored[0], stored[1],
+                                                       IsBinary(encoding)))
+                continue
+
+        # if it's a binary part, force it to b64
+        recode = IsBinary(encoding) and streamer is not None and contentType != "multipart"
+        if IsBinary(encoding) and streamer is None:
+            # MIMEEntity.ENC_IDENTITY_BINARY and MIMEEntity.ENC_IDENTITY_8BIT
+            mime.DecodeContent()
+            mime.EncodeContent(1727)  # MIMEEntity.ENC_BASE64
+            headers = mime.Headers
+        elif recode:
+            headers = EncodingHeader(headers, streamer.Recode(mime)[0])
+
+        if first:
+            _append(pieces, mime.GetSomeHeaders(["Content-type"], True))
+        else:
+            _append(pieces, headers)
+
+        pieces.append('\n')
+        if streamer is not None and (recode or contentType not in ("text", "multipart", "message")):
+            content = streamer.RecodedContent(mime) if recode else streamer.Content(mime)
+            if isinstance(content, bytes):
+                _append(pieces, content)
+            else:
+                _write(f, pieces)
+                del pieces[:]
+                streamer.Copy(f, content, recode)
+        else:
+            content = mime.ContentAsText
+            if content != None:
+                _append(pieces, content)
+
+        if contentType.startswith("multipart"):
+            try:
+                # The preamble attribute might not exist
+                content = mime.preamble
+                if content != "":
+                    _append(pieces, content)
+            except AttributeError:
+                pass
+
+            child = mime.GetFirstChildEntity()
+            if child != None:
+                stack.append((_CHILD, child, False))
+
+def _write(f, pieces):
+    """Function to write the pieces of a message with a single write. Some
+    of the text might be in utf-8 so give it special treatment"""
+    if all(isinstance(p, str) for p in pieces):
+        f.write("".join(pieces).encode('utf-8'))
+    else:
+        f.write(b"".join(p if isinstance(p, bytes) else p.encode('utf-8') for p in pieces))
+
+def WriteMIMEHeader(f, mime, mbox=False, resolver=None, streamer=None):
+    """Function to write the MIME headers of a message"""
+    pieces = []
+    MIMEHeader(pieces, mime, mbox, resolver, streamer)
+    _write(f, pieces)
+
+def WriteMIMEChildren(f, mime, first, streamer=None):
+    """Function to write a MIME entity and all its children"""
+    pieces = []
+    MIMEChildren(pieces, mime, first, f, streamer)
+    _write(f, pieces)
+
+def WriteMIMEMessage(f, mime, mbox=False, resolver=None, streamer=None):
+    """Function to write a whole MIME message, headers and children, with a
+    single write, unless large parts are copied with the Streamer"""
+    pieces = []
+    MIMEHeader(pieces, mime, mbox, resolver, streamer)
+    MIMEChildren(pieces, mime, True, f, streamer)
+    _write(f, pieces)
@@ -37,13 +37,15 @@ import locale
 import traceback
 import tempfile
 import datetime
-import codecs
+import json
 import os
 import sys
 import io
 import platform
 import subprocess
 import shutil
+import time
+import zipfile
 import pywintypes
 import win32crypt
 import win32cryptcon
@@ -61,6 +63,18 @@ except ImportError:
     import ttk
 
 import mapiex
+import addressbook
+import attachstore
+import catalog as exportcatalog
+import emlarchive
+import imapwriter
+import mimewriter
+import maildir as maildirs
+import metadata
+import mboxwriter
+import replay
+import searchindex
+import smime
 
 # This list should be extended to match regular install paths
 notesDllPathList = [r'c:/notes', r'd:/notes', r'c:/program files/notes', r'd:/program files/notes',
@@ -86,6 +100,10 @@ class EncryptionType: # pylint: disable=R0903
     """Enum for re-encryption type"""
     NONE, RC2CBC, DES, AES128, AES256 = list(range(5))
 
+# Names of the encryption algorithms in smime.Algorithms
+EncryptionAlgorithms = {EncryptionType.RC2CBC : "rc2", EncryptionType.DES : "3des",
+                        EncryptionType.AES128 : "aes128", EncryptionType.AES256 : "aes256"}
+
 class SubdirectoryMBOX: # pylint: disable=R0903
     """Enum for the treatment of subfolder for the MBOX format"""
     NO, YES = list(range(2))
@@ -102,6 +120,330 @@ class Helper: # pylint: disable=R0903
     """Enum to flag whether the use of an external PST import is to be forced"""
     NO, YES = list(range(2))
 
+class Delta: # pylint: disable=R0903
+    """Enum to flag whether only the documents modified since the last conversion are exported"""
+    NO, YES = list(range(2))
+
+class Reconvert: # pylint: disable=R0903
+    """Enum to flag whether NSF files that are unchanged since their last conversion are reconverted"""
+    NO, YES = list(range(2))
+
+class Resume: # pylint: disable=R0903
+    """Enum for the treatment of an interrupted conversion"""
+    NO, YES, FAILED = list(range(3))
+
+class Retry: # pylint: disable=R0903
+    """Enum to flag whether documents are retried after transient errors"""
+    NO, YES = list(range(2))
+
+class Archive: # pylint: disable=R0903
+    """Enum for the archive, Maildir or IMAP server the EML files are written to"""
+    NONE, ZIP, ZIPDEFLATED, TAR, MAILDIR, MAILDIRFANOUT, IMAP = list(range(7))
+
+class Compress: # pylint: disable=R0903
+    """Enum to flag whether MBOX files are compressed"""
+    NO, YES = list(range(2))
+
+class Dedup: # pylint: disable=R0903
+    """Enum to flag whether the attachments are stored once in a store"""
+    NO, YES = list(range(2))
+
+class Index: # pylint: disable=R0903
+    """Enum to flag whether the messages are added to a full-text index"""
+    NO, YES = list(range(2))
+
+class ExportCatalog: # pylint: disable=R0903
+    """Enum to flag whether the exported documents are recorded in a catalog"""
+    NO, YES = list(range(2))
+
+class Metadata: # pylint: disable=R0903
+    """Enum for the JSON lines file of the metadata of the messages"""
+    NO, JSONL, JSONLGZ = list(range(3))
+
+class SortByDate: # pylint: disable=R0903
+    """Enum to flag whether the messages of the MBOX files are sorted by date"""
+    NO, YES = list(range(2))
+
+class Directory: # pylint: disable=R0903
+    """Enum for the directory used to replace Notes names by SMTP addresses"""
+    NONE, NOTES, FILE = list(range(3))
+
+# Forms of documents that are found in mail databases but that are clearly not
+# messages, and so can be safely ignored
+NonMailForms = ("Appointment", "Task", "Notice", "Return Receipt", "Trace Report",
+                "Delivery Report")
+
+# Errors that are known to be transient, after which a document is retried up
+# to RetryAttempts times, waiting RetryDelay seconds doubled at each attempt.
+# TransientStatus are status codes of the Notes C API, where 259 "File does not
+# exist" is returned by MIMEConvertCDParts after MAPI has been used.
+# TransientHRESULT are COM and MAPI errors : RPC_E_CALL_REJECTED,
+# RPC_E_DISCONNECTED, RPC_E_SERVERCALL_RETRYLATER, RPC_S_SERVER_UNAVAILABLE,
+# RPC_S_CALL_FAILED, MAPI_E_BUSY, MAPI_E_NETWORK_ERROR and MAPI_E_TIMEOUT
+RetryAttempts = 3
+RetryDelay = 1
+TransientStatus = (259,)
+TransientHRESULT = (-2147418111, -2147417848, -2147417846, -2147023174, -2147023170,
+                    -2147221237, -2147221227, -2147220479)
+
+def IsTransient(error):
+    """Function to test if a Notes status code or a COM exception is a transient error"""
+    if isinstance(error, int):
+        return error in TransientStatus
+    if isinstance(error, pywintypes.com_error): # pylint: disable=E1101
+        if error.hresult in TransientHRESULT:
+            return True
+        # The error of a Notes or MAPI method might only be in the exception info
+        excepinfo = error.excepinfo
+        return bool(excepinfo) and len(excepinfo) > 5 and excepinfo[5] in TransientHRESULT
+    return False
+
+def FolderName(name):
+    """Function giving the name used for the output of a Notes folder"""
+    if name == "($Sent)":
+        return _("Sent")
+    elif name == "($Inbox)":
+        return _("Inbox")
+    return name
+
+def MaildirFolder(name):
+    """Function giving the name of the Maildir folder of a Notes folder, empty
+    for the Inbox that is the Maildir itself. Also used for the IMAP mailboxes,
+    the empty name being the INBOX"""
+    if name == "($Inbox)":
+        return ""
+    return FolderName(name)
+
+def IMAPFlags(name, doc, unread=None):
+    """Function returning the IMAP flags of a document of a Notes folder, given
+    the set of the NoteIDs of the unread documents if it is known"""
+    flags = []
+    if unread is None or doc.NoteID not in unread:
+        flags.append("\\Seen")
+    if name == "($Drafts)":
+        flags.append("\\Draft")
+    return flags
+
+def SplitList(text):
+    """Function to split a comma or semi-colon separated list of names"""
+    return [n.strip() for n in text.replace(';', ',').split(',') if n.strip() != ""]
+
+def ParseDate(text):
+    """Function to parse a YYYY-MM-DD date, returning None if the text is empty"""
+    text = text.strip()
+    if text == "":
+        return None
+    try:
+        return datetime.datetime.strptime(text, "%Y-%m-%d").date()
+    except ValueError:
+        raise ValueError(_("Invalid date '%s', expected YYYY-MM-DD") % text)
+
+def ParseLimit(text):
+    """Function to parse a positive integer limit, returning None if the text is
+    empty"""
+    text = text.strip()
+    if text == "":
+        return None
+    try:
+        limit = int(text)
+    except ValueError:
+        limit = 0
+    if limit <= 0:
+        raise ValueError(_("Invalid limit '%s', expected a positive integer") % text)
+    return limit
+
+def SelectionFormula(after=None, before=None, forms=(), noforms=()):
+    """Function to compile the document filters into a Notes selection formula
+    for NotesDatabase.Search. Returns None if there is nothing to filter"""
+    conds = []
+    if after or before:
+        # Received mail has a DeliveredDate, sent mail only a PostedDate and
+        # drafts neither, so fall back to the creation date
+        conds.append("_d := @If(@IsAvailable(DeliveredDate); DeliveredDate; " +
+                     "@IsAvailable(PostedDate); PostedDate; @Created)")
+        if after:
+            conds.append("_d >= @Date(%d; %d; %d)" % (after.year, after.month, after.day))
+        if before:
+            # The end date is inclusive, so compare with the following day
+            before = before + datetime.timedelta(days=1)
+            conds.append("_d < @Date(%d; %d; %d)" % (before.year, before.month, before.day))
+    if forms:
+        conds.append("@IsMember(Form; %s)" % ":".join(['"%s"' % f.replace('"', '\\"')
+                                                       for f in forms]))
+    if noforms:
+        conds.append("!@IsMember(Form; %s)" % ":".join(['"%s"' % f.replace('"', '\\"')
+                                                        for f in noforms]))
+    if not conds:
+        return None
+    if after or before:
+        # The temporary variable assignment must be a separate statement
+        return conds[0] + ";\nSELECT " + " & ".join(conds[1:])
+    return "SELECT " + " & ".join(conds)
+
+def LoadState(path):
+    """Function to load the persistent state of the conversion of a database"""
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def SaveState(path, state):
+    """Function to save the persistent state of the conversion of a database.
+    The state is written to a temporary file that then replaces the old one, so
+    that a crash never leaves a partially written state"""
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(state, f, indent=1, sort_keys=True)
+    os.replace(tmp, path)
+
+def NextIndex(path, ext=".eml"):
+    """Function returning the first unused number for the files N.ext in path"""
+    n = 0
+    try:
+        for name in os.listdir(path):
+            if name.lower().endswith(ext) and name[:-len(ext)].isdigit():
+                n = max(n, int(name[:-len(ext)]))
+    except OSError:
+        pass
+    return n + 1
+
+class Journal(object):
+    """Append-only journal of the documents exported from a database. Each line
+    records the folder, NoteID, status and output location of a document, so
+    that an interrupted conversion can be resumed. The first line holds the
+    settings of the conversion, and a journal written with other settings
+    is discarded rather than resumed. The entries of the documents that are
+    not yet on disk can be deferred until they are"""
+    OK, FAILED, SKIPPED, OPEN = "ok", "failed", "skipped", "open"
+
+    def __init__(self, path, mode=Resume.NO, settings=None):
+        self.path = path
+        self.mode = mode
+        self.entries = {}
+        self.deferred = []
+        self.discarded = False
+        header = "#\t%s\n" % json.dumps(settings, sort_keys=True)
+        if mode != Resume.NO:
+            try:
+                with io.open(path, "r", encoding="utf-8") as f:
+                    if f.readline() != header:
+                        self.discarded = True
+                    else:
+                        for line in f:
+                            fields = line[:-1].split("\t")
+                            # A line truncated by a crash is ignored
+                            if line.endswith("\n") and len(fields) == 4:
+                                self.entries[(fields[0], fields[1])] = (fields[2], fields[3])
+            except OSError:
+                pass
+        if self.discarded:
+            self.mode = Resume.NO
+        self.f = io.open(path, "a" if self.mode != Resume.NO else "w", encoding="utf-8")
+        if self.f.tell() > 0:
+            # Terminate any line truncated by a crash
+            self.f.write("\n")
+        else:
+            self.f.write(header)
+            self.f.flush()
+
+    def Resuming(self):
+        """Method to test if the conversion resumes a previous one"""
+        return len(self.entries) > 0
+
+    def Done(self, folder, noteid):
+        """Method to test if a document can be skipped as already treated"""
+        status = self.entries.get((folder, noteid), (None, None))[0]
+        if self.mode == Resume.YES:
+            return status in (self.OK, self.SKIPPED)
+        elif self.mode == Resume.FAILED and self.Resuming():
+            return status != self.FAILED
+        return False
+
+    def Record(self, folder, noteid, status, location=""):
+        """Method to add an entry to the journal"""
+        self.entries[(folder, noteid)] = (status, location)
+        self.f.write("%s\t%s\t%s\t%s\n" % (folder, noteid, status, location))
+        self.f.flush()
+
+    def Defer(self, folder, noteid, status, location=""):
+        """Method to add an entry to the journal once Commit is called"""
+        self.deferred.append((folder, noteid, status, location))
+
+    def Commit(self):
+        """Method to add the deferred entries to the journal"""
+        for entry in self.deferred:
+            self.Record(*entry)
+        self.deferred = []
+
+    def End(self, mbox):
+        """Method returning the offset of the end of the last message committed to
+        an MBOX file, or None if the file wasn't opened in the journal"""
+        end = None
+        for status, location in self.entries.values():
+            if status in (self.OK, self.OPEN):
+                fields = location.rsplit("|", 2)
+                if len(fields) == 3 and fields[0] == mbox:
+                    end = max(end or 0, int(fields[2]))
+        return end
+
+    def Forget(self, path):
+        """Method to forget the documents written to an output file that was
+        lost, so that they are exported again"""
+        for key, (dummy_status, location) in list(self.entries.items()):
+            if location.rsplit("|", 2)[0] == path:
+                del self.entries[key]
+
+    def Close(self, remove=False):
+        """Method to close the journal, removing it if the conversion is complete.
+        Closing it again has no effect"""
+        self.f.close()
+        if remove:
+            os.remove(self.path)
+
+def PSTName(dest, n):
+    """Function returning the name of the n-th PST file of a conversion, that is
+    also the display name of its message store"""
+    return dest if n <= 1 else "%s-%d" % (dest, n)
+
+class PSTManifest(object):
+    """Manifest of the PST files of a conversion, listing for each PST file the
+    folders imported into it, with the number of messages and the range of
+    their dates"""
+    def __init__(self, path, append=False):
+        self.path = path
+        self.manifest = LoadState(path) if append else {}
+        self.psts = self.manifest.setdefault("psts", [])
+
+    def Count(self):
+        """Method returning the number of PST files of the conversion"""
+        return len(self.psts)
+
+    def Messages(self):
+        """Method returning the number of messages of the last PST file"""
+        return self.psts[-1]["messages"] if self.psts else 0
+
+    def Add(self, pst, store):
+        """Method to add a new PST file, to which the following messages go"""
+        self.psts.append({"path" : pst, "store" : store, "messages" : 0, "folders" : {}})
+        self.Save()
+
+    def Record(self, folder, date=0):
+        """Method to record a message imported into a folder of the last PST
+        file, with its date in seconds since the epoch (0 if unknown)"""
+        entry = self.psts[-1]
+        entry["messages"] += 1
+        fld = entry["folders"].setdefault(folder, {"messages" : 0})
+        fld["messages"] += 1
+        if date:
+            date = datetime.datetime.utcfromtimestamp(date).strftime("%Y-%m-%d %H:%M:%S")
+            fld["first"] = min(fld.get("first", date), date)
+            fld["last"] = max(fld.get("last", date), date)
+
+    def Save(self):
+        """Method to save the manifest"""
+        SaveState(self.path, self.manifest)
+
 def OutlookPath():
     """Function to retrieve the path to Outlook from the registry"""
     aReg = winreg.ConnectRegistry(None, winreg.HKEY_LOCAL_MACHINE)
@@ -310,6 +652,7 @@ class Gui(tkinter.Frame):
         self.dialog = None
         self.certificate = None
         self.hCryptoProv = None
+        self.NotesStatus = None
         self.EML2PST = None
 
         # Initialize the default values of the Radio buttons
@@ -326,6 +669,53 @@ class Gui(tkinter.Frame):
         self.Helper = tkinter.IntVar()
         self.Helper.set(Helper.NO)
 
+        # Initialize the document filters. Empty values mean no filtering
+        self.FilterAfter = tkinter.StringVar()
+        self.FilterBefore = tkinter.StringVar()
+        self.FolderInclude = tkinter.StringVar()
+        self.FolderExclude = tkinter.StringVar()
+        self.FormInclude = tkinter.StringVar()
+        self.FormExclude = tkinter.StringVar()
+        self.formula = None
+        self.Delta = tkinter.IntVar()
+        self.Delta.set(Delta.NO)
+        self.Reconvert = tkinter.IntVar()
+        self.Reconvert.set(Reconvert.NO)
+        self.Resume = tkinter.IntVar()
+        self.Resume.set(Resume.YES)
+        self.Retry = tkinter.IntVar()
+        self.Retry.set(Retry.YES)
+        self.Compress = tkinter.IntVar()
+        self.Compress.set(Compress.NO)
+        self.Archive = tkinter.IntVar()
+        self.Archive.set(Archive.NONE)
+        self.Dedup = tkinter.IntVar()
+        self.Dedup.set(Dedup.NO)
+        self.Directory = tkinter.IntVar()
+        self.Directory.set(Directory.NONE)
+        self.DirectoryFile = tkinter.StringVar()
+        self.PSTMaxSize = tkinter.StringVar()
+        self.PSTMaxMessages = tkinter.StringVar()
+        self.pstlimits = (None, None)
+        self.IMAPServer = tkinter.StringVar()
+        self.IMAPServer.set("imaps://user@host/")
+        self.IMAPPassword = tkinter.StringVar()
+        self.imap = None
+        self.Index = tkinter.IntVar()
+        self.Index.set(Index.NO)
+        self.index = None
+        self.ExportCatalog = tkinter.IntVar()
+        self.ExportCatalog.set(ExportCatalog.NO)
+        self.exports = None
+        self.Metadata = tkinter.IntVar()
+        self.Metadata.set(Metadata.NO)
+        self.SortByDate = tkinter.IntVar()
+        self.SortByDate.set(SortByDate.NO)
+        self.resolver = None
+        self.streamer = None
+        self.streamfile = None
+        self.encryptor = None
+
         # Lotus Password
         self.entryPassword = tkinter.Entry(self.master, relief=tkinter.GROOVE)
         self.entryPassword.insert(0, _("Enter Lotus Notes password"))
@@ -587,9 +977,274 @@ class Gui(tkinter.Frame):
                                   value=Helper.YES)
         R16.grid(row=15, column=3, columnspan=2, sticky=tkinter.W)
 
+        ttk.Separator(self.dialog, orient=tkinter.HORIZONTAL).grid(row=16, columnspan=5,
+                                                                   sticky=tkinter.E+tkinter.W)
+
+        L6 = tkinter.Label(self.dialog, text=_("Only export documents dated (YYYY-MM-DD) :"))
+        L6.grid(row=17, column=1, columnspan=4, sticky=tkinter.W)
+
+        L7 = tkinter.Label(self.dialog, text=_("From"))
+        L7.grid(row=18, column=1, sticky=tkinter.W)
+        E1 = tkinter.Entry(self.dialog, textvariable=self.FilterAfter, relief=tkinter.GROOVE)
+        E1.grid(row=18, column=2, sticky=tkinter.E+tkinter.W)
+
+        L8 = tkinter.Label(self.dialog, text=_("To"))
+        L8.grid(row=18, column=3, sticky=tkinter.W)
+        E2 = tkinter.Entry(self.dialog, textvariable=self.FilterBefore, relief=tkinter.GROOVE)
+        E2.grid(row=18, column=4, sticky=tkinter.E+tkinter.W)
+
+        L9 = tkinter.Label(self.dialog, text=_("Folders and forms to include or exclude (comma separated) :"))
+        L9.grid(row=19, column=1, columnspan=4, sticky=tkinter.W)
+
+        L10 = tkinter.Label(self.dialog, text=_("Folders"))
+        L10.grid(row=20, column=1, sticky=tkinter.W)
+        E3 = tkinter.Entry(self.dialog, textvariable=self.FolderInclude, relief=tkinter.GROOVE)
+        E3.grid(row=20, column=2, sticky=tkinter.E+tkinter.W)
+
+        L11 = tkinter.Label(self.dialog, text=_("Not folders"))
+        L11.grid(row=20, column=3, sticky=tkinter.W)
+        E4 = tkinter.Entry(self.dialog, textvariable=self.FolderExclude, relief=tkinter.GROOVE)
+        E4.grid(row=20, column=4, sticky=tkinter.E+tkinter.W)
+
+        L12 = tkinter.Label(self.dialog, text=_("Forms"))
+        L12.grid(row=21, column=1, sticky=tkinter.W)
+        E5 = tkinter.Entry(self.dialog, textvariable=self.FormInclude, relief=tkinter.GROOVE)
+        E5.grid(row=21, column=2, sticky=tkinter.E+tkinter.W)
+
+        L13 = tkinter.Label(self.dialog, text=_("Not forms"))
+        L13.grid(row=21, column=3, sticky=tkinter.W)
+        E6 = tkinter.Entry(self.dialog, textvariable=self.FormExclude, relief=tkinter.GROOVE)
+        E6.grid(row=21, column=4, sticky=tkinter.E+tkinter.W)
+
+        ttk.Separator(self.dialog, orient=tkinter.HORIZONTAL).grid(row=22, columnspan=5,
+                                                                   sticky=tkinter.E+tkinter.W)
+
+        L14 = tkinter.Label(self.dialog, text=_("Only export documents modified since the last conversion :"))
+        L14.grid(row=23, column=1, columnspan=4, sticky=tkinter.W)
+
+        R17 = tkinter.Radiobutton(self.dialog, text=_("No"), variable=self.Delta,
+                                  value=Delta.NO)
+        R17.grid(row=24, column=1, columnspan=2, sticky=tkinter.W)
+
+        R18 = tkinter.Radiobutton(self.dialog, text=_("Yes"), variable=self.Delta,
+                                  value=Delta.YES)
+        R18.grid(row=24, column=3, columnspan=2, sticky=tkinter.W)
+
+        ttk.Separator(self.dialog, orient=tkinter.HORIZONTAL).grid(row=25, columnspan=5,
+                                                                   sticky=tkinter.E+tkinter.W)
+
+        L15 = tkinter.Label(self.dialog, text=_("Reconvert NSF files unchanged since their last conversion :"))
+        L15.grid(row=26, column=1, columnspan=4, sticky=tkinter.W)
+
+        R19 = tkinter.Radiobutton(self.dialog, text=_("No"), variable=self.Reconvert,
+                                  value=Reconvert.NO)
+        R19.grid(row=27, column=1, columnspan=2, sticky=tkinter.W)
+
+        R20 = tkinter.Radiobutton(self.dialog, text=_("Yes"), variable=self.Reconvert,
+                                  value=Reconvert.YES)
+        R20.grid(row=27, column=3, columnspan=2, sticky=tkinter.W)
+
+        ttk.Separator(self.dialog, orient=tkinter.HORIZONTAL).grid(row=28, columnspan=5,
+                                                                   sticky=tkinter.E+tkinter.W)
+
+        L16 = tkinter.Label(self.dialog, text=_("Resume interrupted conversions :"))
+        L16.grid(row=29, column=1, columnspan=4, sticky=tkinter.W)
+
+        R21 = tkinter.Radiobutton(self.dialog, text=_("No"), variable=self.Resume,
+                                  value=Resume.NO)
+        R21.grid(row=30, column=1, sticky=tkinter.W)
+
+        R22 = tkinter.Radiobutton(self.dialog, text=_("Yes"), variable=self.Resume,
+                                  value=Resume.YES)
+        R22.grid(row=30, column=2, sticky=tkinter.W)
+
+        R23 = tkinter.Radiobutton(self.dialog, text=_("Failed documents only"),
+                                  variable=self.Resume, value=Resume.FAILED)
+        R23.grid(row=30, column=3, columnspan=2, sticky=tkinter.W)
+
+        ttk.Separator(self.dialog, orient=tkinter.HORIZONTAL).grid(row=31, columnspan=5,
+                                                                   sticky=tkinter.E+tkinter.W)
+
+        L17 = tkinter.Label(self.dialog, text=_("Replace Notes names by SMTP addresses using :"))
+        L17.grid(row=32, column=1, columnspan=4, sticky=tkinter.W)
+
+        R24 = tkinter.Radiobutton(self.dialog, text=_("None"), variable=self.Directory,
+                                  value=Directory.NONE)
+        R24.grid(row=33, column=1, sticky=tkinter.W)
+
+        R25 = tkinter.Radiobutton(self.dialog, text=_("Address books"),
+                                  variable=self.Directory, value=Directory.NOTES)
+        R25.grid(row=33, column=2, sticky=tkinter.W)
+
+        R26 = tkinter.Radiobutton(self.dialog, text=_("CSV/LDIF file"),
+                                  variable=self.Directory, value=Directory.FILE)
+        R26.grid(row=33, column=3, sticky=tkinter.W)
+        E7 = tkinter.Entry(self.dialog, textvariable=self.DirectoryFile, relief=tkinter.GROOVE)
+        E7.grid(row=33, column=4, sticky=tkinter.E+tkinter.W)
+
+        ttk.Separator(self.dialog, orient=tkinter.HORIZONTAL).grid(row=34, columnspan=5,
+                                                                   sticky=tkinter.E+tkinter.W)
+
+        L18 = tkinter.Label(self.dialog, text=_("Retry documents after transient Notes or MAPI errors :"))
+        L18.grid(row=35, column=1, columnspan=4, sticky=tkinter.W)
+
+        R27 = tkinter.Radiobutton(self.dialog, text=_("No"), variable=self.Retry,
+                                  value=Retry.NO)
+        R27.grid(row=36, column=1, columnspan=2, sticky=tkinter.W)
+
+        R28 = tkinter.Radiobutton(self.dialog, text=_("Yes"), variable=self.Retry,
+                                  value=Retry.YES)
+        R28.grid(row=36, column=3, columnspan=2, sticky=tkinter.W)
+
+        ttk.Separator(self.dialog, orient=tkinter.HORIZONTAL).grid(row=37, columnspan=5,
+                                                                   sticky=tkinter.E+tkinter.W)
+
+        L19 = tkinter.Label(self.dialog, text=_("Compress the MBOX files (.mbox.gz) :"))
+        L19.grid(row=38, column=1, columnspan=4, sticky=tkinter.W)
+
+        R29 = tkinter.Radiobutton(self.dialog, text=_("No"), variable=self.Compress,
+                                  value=Compress.NO)
+        R29.grid(row=39, column=1, columnspan=2, sticky=tkinter.W)
+
+        R30 = tkinter.Radiobutton(self.dialog, text=_("Yes"), variable=self.Compress,
+                                  value=Compress.YES)
+        R30.grid(row=39, column=3, columnspan=2, sticky=tkinter.W)
+
+        ttk.Separator(self.dialog, orient=tkinter.HORIZONTAL).grid(row=40, columnspan=5,
+                                                                   sticky=tkinter.E+tkinter.W)
+
+        L20 = tkinter.Label(self.dialog, text=_("Write the EML files to :"))
+        L20.grid(row=41, column=1, columnspan=4, sticky=tkinter.W)
+
+        R31 = tkinter.Radiobutton(self.dialog, text=_("Files"), variable=self.Archive,
+                                  value=Archive.NONE)
+        R31.grid(row=42, column=1, sticky=tkinter.W)
+
+        R32 = tkinter.Radiobutton(self.dialog, text=_("ZIP"), variable=self.Archive,
+                                  value=Archive.ZIP)
+        R32.grid(row=42, column=2, sticky=tkinter.W)
+
+        R33 = tkinter.Radiobutton(self.dialog, text=_("Compressed ZIP"), variable=self.Archive,
+                                  value=Archive.ZIPDEFLATED)
+        R33.grid(row=42, column=3, sticky=tkinter.W)
+
+        R34 = tkinter.Radiobutton(self.dialog, text=_("tar"), variable=self.Archive,
+                                  value=Archive.TAR)
+        R34.grid(row=42, column=4, sticky=tkinter.W)
+
+        R35 = tkinter.Radiobutton(self.dialog, text=_("Maildir"), variable=self.Archive,
+                                  value=Archive.MAILDIR)
+        R35.grid(row=43, column=1, columnspan=2, sticky=tkinter.W)
+
+        R36 = tkinter.Radiobutton(self.dialog, text=_("Maildir with sub-directories"),
+                                  variable=self.Archive, value=Archive.MAILDIRFANOUT)
+        R36.grid(row=43, column=3, columnspan=2, sticky=tkinter.W)
+
+        R39 = tkinter.Radiobutton(self.dialog, text=_("IMAP server"), variable=self.Archive,
+                                  value=Archive.IMAP)
+        R39.grid(row=44, column=1, sticky=tkinter.W)
+        E10 = tkinter.Entry(self.dialog, textvariable=self.IMAPServer, relief=tkinter.GROOVE)
+        E10.grid(row=44, column=2, sticky=tkinter.E+tkinter.W)
+
+        L25 = tkinter.Label(self.dialog, text=_("Password"))
+        L25.grid(row=44, column=3, sticky=tkinter.W)
+        E11 = tkinter.Entry(self.dialog, textvariable=self.IMAPPassword, show="*",
+                            relief=tkinter.GROOVE)
+        E11.grid(row=44, column=4, sticky=tkinter.E+tkinter.W)
+
+        ttk.Separator(self.dialog, orient=tkinter.HORIZONTAL).grid(row=45, columnspan=5,
+                                                                   sticky=tkinter.E+tkinter.W)
+
+        L21 = tkinter.Label(self.dialog, text=_("Store each attachment once (not PST, archives or IMAP) :"))
+        L21.grid(row=46, column=1, columnspan=4, sticky=tkinter.W)
+
+        R37 = tkinter.Radiobutton(self.dialog, text=_("No"), variable=self.Dedup,
+                                  value=Dedup.NO)
+        R37.grid(row=47, column=1, columnspan=2, sticky=tkinter.W)
+
+        R38 = tkinter.Radiobutton(self.dialog, text=_("Yes"), variable=self.Dedup,
+                                  value=Dedup.YES)
+        R38.grid(row=47, column=3, columnspan=2, sticky=tkinter.W)
+
+        ttk.Separator(self.dialog, orient=tkinter.HORIZONTAL).grid(row=48, columnspan=5,
+                                                                   sticky=tkinter.E+tkinter.W)
+
+        L22 = tkinter.Label(self.dialog, text=_("Start a new PST file after (empty for no limit) :"))
+        L22.grid(row=49, column=1, columnspan=4, sticky=tkinter.W)
+
+        L23 = tkinter.Label(self.dialog, text=_("MB"))
+        L23.grid(row=50, column=1, sticky=tkinter.W)
+        E8 = tkinter.Entry(self.dialog, textvariable=self.PSTMaxSize, relief=tkinter.GROOVE)
+        E8.grid(row=50, column=2, sticky=tkinter.E+tkinter.W)
+
+        L24 = tkinter.Label(self.dialog, text=_("Messages"))
+        L24.grid(row=50, column=3, sticky=tkinter.W)
+        E9 = tkinter.Entry(self.dialog, textvariable=self.PSTMaxMessages, relief=tkinter.GROOVE)
+        E9.grid(row=50, column=4, sticky=tkinter.E+tkinter.W)
+
+        ttk.Separator(self.dialog, orient=tkinter.HORIZONTAL).grid(row=51, columnspan=5,
+                                                                   sticky=tkinter.E+tkinter.W)
+
+        L26 = tkinter.Label(self.dialog, text=_("Index the messages for full-text search (nsf2x.sqlite) :"))
+        L26.grid(row=52, column=1, columnspan=4, sticky=tkinter.W)
+
+        R40 = tkinter.Radiobutton(self.dialog, text=_("No"), variable=self.Index,
+                                  value=Index.NO)
+        R40.grid(row=53, column=1, columnspan=2, sticky=tkinter.W)
+
+        R41 = tkinter.Radiobutton(self.dialog, text=_("Yes"), variable=self.Index,
+                                  value=Index.YES)
+        R41.grid(row=53, column=3, columnspan=2, sticky=tkinter.W)
+
+        ttk.Separator(self.dialog, orient=tkinter.HORIZONTAL).grid(row=54, columnspan=5,
+                                                                   sticky=tkinter.E+tkinter.W)
+
+        L27 = tkinter.Label(self.dialog, text=_("Catalog the exported documents and their SHA-256 (nsf2x.exports.sqlite) :"))
+        L27.grid(row=55, column=1, columnspan=4, sticky=tkinter.W)
+
+        R42 = tkinter.Radiobutton(self.dialog, text=_("No"), variable=self.ExportCatalog,
+                                  value=ExportCatalog.NO)
+        R42.grid(row=56, column=1, columnspan=2, sticky=tkinter.W)
+
+        R43 = tkinter.Radiobutton(self.dialog, text=_("Yes"), variable=self.ExportCatalog,
+                                  value=ExportCatalog.YES)
+        R43.grid(row=56, column=3, columnspan=2, sticky=tkinter.W)
+
+        ttk.Separator(self.dialog, orient=tkinter.HORIZONTAL).grid(row=57, columnspan=5,
+                                                                   sticky=tkinter.E+tkinter.W)
+
+        L28 = tkinter.Label(self.dialog, text=_("Write the metadata of the messages as JSON lines (<name>.jsonl) :"))
+        L28.grid(row=58, column=1, columnspan=4, sticky=tkinter.W)
+
+        R44 = tkinter.Radiobutton(self.dialog, text=_("No"), variable=self.Metadata,
+                                  value=Metadata.NO)
+        R44.grid(row=59, column=1, sticky=tkinter.W)
+
+        R45 = tkinter.Radiobutton(self.dialog, text=_("Yes"), variable=self.Metadata,
+                                  value=Metadata.JSONL)
+        R45.grid(row=59, column=2, sticky=tkinter.W)
+
+        R46 = tkinter.Radiobutton(self.dialog, text=_("Compressed"), variable=self.Metadata,
+                                  value=Metadata.JSONLGZ)
+        R46.grid(row=59, column=3, sticky=tkinter.W)
+
+        ttk.Separator(self.dialog, orient=tkinter.HORIZONTAL).grid(row=60, columnspan=5,
+                                                                   sticky=tkinter.E+tkinter.W)
+
+        L29 = tkinter.Label(self.dialog, text=_("Sort the messages of the MBOX files by date :"))
+        L29.grid(row=61, column=1, columnspan=4, sticky=tkinter.W)
+
+        R47 = tkinter.Radiobutton(self.dialog, text=_("No"), variable=self.SortByDate,
+                                  value=SortByDate.NO)
+        R47.grid(row=62, column=1, columnspan=2, sticky=tkinter.W)
+
+        R48 = tkinter.Radiobutton(self.dialog, text=_("Yes"), variable=self.SortByDate,
+                                  value=SortByDate.YES)
+        R48.grid(row=62, column=3, columnspan=2, sticky=tkinter.W)
+
         B1 = tkinter.Button(self.dialog, text=_("Close"), command=self.closeOptions,
                             relief=tkinter.GROOVE)
-        B1.grid(row=16, column=2, columnspan=2, sticky=tkinter.E+tkinter.W)
+        B1.grid(row=63, column=2, columnspan=2, sticky=tkinter.E+tkinter.W)
 
         self.dialog.focus_force()
 
@@ -639,6 +1294,70 @@ class Gui(tkinter.Frame):
         if self.Format.get() == Format.MBOX  and self.MBOXType.get() == SubdirectoryMBOX.NO:
             self.log(ErrorLevel.WARN, _("The MBOX file will not have the directory hierarchies present in NSF file\n"))
 
+        try:
+            self.formula = SelectionFormula(ParseDate(self.FilterAfter.get()),
+                                            ParseDate(self.FilterBefore.get()),
+                                            SplitList(self.FormInclude.get()),
+                                            SplitList(self.FormExclude.get()))
+        except ValueError as ex:
+            self.log(ErrorLevel.ERROR, "%s" % ex)
+            self.formula = None
+            self.running = False
+        if self.formula:
+            self.log(ErrorLevel.INFO, _("Selecting documents with the formula : %s") % self.formula)
+
+        try:
+            maxsize = ParseLimit(self.PSTMaxSize.get())
+            self.pstlimits = (maxsize * 1048576 if maxsize else None,
+                              ParseLimit(self.PSTMaxMessages.get()))
+        except ValueError as ex:
+            self.log(ErrorLevel.ERROR, "%s" % ex)
+            self.pstlimits = (None, None)
+            self.running = False
+
+        self.resolver = None
+        try:
+            if self.Directory.get() == Directory.NOTES:
+                self.resolver = addressbook.Resolver(addressbook.NotesDirectory(self.Lotus))
+            elif self.Directory.get() == Directory.FILE:
+                self.resolver = addressbook.Resolver(addressbook.OpenDirectory(self.DirectoryFile.get()))
+        except (pywintypes.com_error, OSError, ValueError) as ex: # pylint: disable=E1101
+            self.log(ErrorLevel.ERROR, _("Can not open the directory of SMTP addresses"))
+            self.log(ErrorLevel.ERROR, _("Exception %s :") % ex)
+            self.running = False
+
+        self.index = None
+        if self.Index.get() == Index.YES and self.running:
+            try:
+                self.index = searchindex.SearchIndex(os.path.join(self.destPath, "nsf2x.sqlite"))
+            except OSError as ex:
+                self.log(ErrorLevel.ERROR, "%s" % ex)
+                self.running = False
+
+        self.exports = None
+        if self.ExportCatalog.get() == ExportCatalog.YES and self.running:
+            try:
+                settings = json.dumps({"source": self.nsfPath, "format": self.Format.get(),
+                                       "archive": self.Archive.get(), "formula": self.formula})
+                self.exports = exportcatalog.Catalog(os.path.join(self.destPath, "nsf2x.exports.sqlite"),
+                                                     settings)
+                self.log(ErrorLevel.INFO, _("Recording the exported documents as run %d of %s") %
+                         (self.exports.run, self.exports.path))
+            except OSError as ex:
+                self.log(ErrorLevel.ERROR, "%s" % ex)
+                self.running = False
+
+        self.imap = None
+        if self.IMAPOutput() and self.running:
+            try:
+                self.imap = imapwriter.IMAPUploader(self.IMAPServer.get().strip(), self.IMAPPassword.get())
+                self.log(ErrorLevel.NORMAL, _("Uploading the messages to %s:%d with %d connections") %
+                         (self.imap.host, self.imap.port, self.imap.size))
+            except (OSError, ValueError) as ex:
+                self.log(ErrorLevel.ERROR, _("Can not connect to the IMAP server"))
+                self.log(ErrorLevel.ERROR, _("Exception %s :") % ex)
+                self.running = False
+
         if self.Format.get() == Format.PST:
             # Check if our Outlook is 64bit, and adapt the importation
             # strategy accoridngly. The MAPI interface must have the
@@ -667,6 +1386,20 @@ class Gui(tkinter.Frame):
 
             if self.EML2PST:
                 self.log(ErrorLevel.NORMAL, _("Using external helper function '%s' for importation of the EML files") % self.EML2PST)
+                if self.pstlimits != (None, None):
+                    self.log(ErrorLevel.WARN, _("The external helper function writes a single PST file, ignoring the limits of the PST files"))
+
+        # Large MIME parts are copied to the output through a NotesStream on
+        # this temporary file, so that they are never completely in memory
+        (fd, self.streamfile) = tempfile.mkstemp(suffix=".part")
+        os.close(fd)
+        self.streamer = mimewriter.Streamer(self.CreateStream)
+        if self.StoreAttachments():
+            self.streamer.store = attachstore.AttachmentStore(os.path.join(self.destPath, "attachments"))
+
+        # The catalog of the NSF files already converted to the destination
+        catalogfile = os.path.join(self.destPath, "nsf2x.catalog")
+        catalog = LoadState(catalogfile)
 
         for src in os.listdir(self.nsfPath):
             if not self.running:
@@ -675,21 +1408,344 @@ class Gui(tkinter.Frame):
             abssrc = os.path.join(self.nsfPath, src)
             if os.path.isfile(abssrc) and src.lower().endswith('.nsf'):
                 dest = src[:-4]
+                key = os.path.normcase(os.path.abspath(abssrc))
                 try:
-                    self.realConvert(src, dest)
+                    if self.Reconvert.get() == Reconvert.NO and self.Unchanged(catalog.get(key), abssrc, dest):
+                        self.log(ErrorLevel.NORMAL, _("Skipping %s, unchanged since its last conversion") % src)
+                        SaveState(catalogfile, catalog)
+                        continue
+
+                    catalog.pop(key, None)
+                    if self.realConvert(src, dest):
+                        # Only a complete conversion without exceptions is
+                        # added to the catalog
+                        catalog[key] = self.Fingerprint(abssrc, dest)
+                    SaveState(catalogfile, catalog)
                 except (pywintypes.com_error, OSError) as ex: # pylint: disable=E1101
                     self.log(ErrorLevel.ERROR, _("Error converting database %s") % src)
                     self.log(ErrorLevel.ERROR, _("Exception %s :") % ex)
                     self.log(ErrorLevel.ERROR, "%s" % traceback.format_exc())
 
+        if self.resolver:
+            self.log(ErrorLevel.NORMAL, _("Notes names resolved : %d from the cache, %d from the directory (%.1f%% hit rate)") %
+                     (self.resolver.hits, self.resolver.misses, 100. * self.resolver.HitRate()))
+
+        if self.streamer.parts > 0:
+            self.log(ErrorLevel.NORMAL, _("%d large MIME parts (%.1f MB) streamed to the output") %
+                     (self.streamer.parts, self.streamer.size / 1048576.))
+        if self.streamer.saved > 0:
+            self.log(ErrorLevel.NORMAL, _("%.1f MB saved by the choice of the Content-Transfer-Encoding") %
+                     (self.streamer.saved / 1048576.))
+        if self.streamer.store is not None and self.streamer.store.parts > 0:
+            store = self.streamer.store
+            self.log(ErrorLevel.NORMAL, _("%d attachments (%.1f MB) with %.1f MB of distinct contents, deduplication ratio %.1f") %
+                     (store.parts, store.size / 1048576., store.distinct / 1048576., store.Ratio()))
+            self.log(ErrorLevel.NORMAL, _("%d new files (%.1f MB) written to the attachment store") %
+                     (store.unique, store.stored / 1048576.))
+        if self.index is not None:
+            try:
+                self.index.Close()
+            except OSError as ex:
+                self.log(ErrorLevel.ERROR, "%s" % ex)
+            self.log(ErrorLevel.NORMAL, _("%d messages added to the full-text index %s (%.1fs in SQLite)") %
+                     (self.index.messages, self.index.path, self.index.elapsed))
+            self.index = None
+        if self.exports is not None:
+            try:
+                self.exports.Close()
+            except OSError as ex:
+                self.log(ErrorLevel.ERROR, "%s" % ex)
+            self.log(ErrorLevel.NORMAL, _("%d documents recorded in run %d of the catalog %s (%.1fs in SQLite)") %
+                     (self.exports.documents, self.exports.run, self.exports.path, self.exports.elapsed))
+            self.exports = None
+        if self.imap is not None:
+            self.imap.Close()
+            self.log(ErrorLevel.NORMAL, _("%d messages (%.1f MB) uploaded to the IMAP server, %d failed") %
+                     (self.imap.messages, self.imap.bytes / 1048576., self.imap.failed))
+            self.imap = None
+        if self.encryptor is not None:
+            self.log(ErrorLevel.NORMAL, _("%d messages encrypted (%.1f MB of S/MIME envelopes)") %
+                     (self.encryptor.messages, self.encryptor.size / 1048576.))
+            self.encryptor.Close()
+            self.encryptor = None
+        peak = mimewriter.PeakMemory()
+        if peak is not None:
+            self.log(ErrorLevel.NORMAL, _("Peak memory used : %.1f MB") % (peak / 1048576.))
+        try:
+            os.remove(self.streamfile)
+        except OSError:
+            pass
+
         self.log(ErrorLevel.NORMAL, _("End of convert : %s\n") % datetime.datetime.now())
         tl.title(_("Lotus Notes Converter"))
         self.update()
         self.running = False
         self.configDirectoryEntry(False)
 
+    def CreateStream(self):
+        """Method returning an empty NotesStream on the temporary file of the
+        conversion, for the Streamer"""
+        stream = self.Lotus.CreateStream()
+        if not stream.Open(self.streamfile, "binary"):
+            raise OSError(_("Can not open the temporary file %s") % self.streamfile)
+        stream.Truncate()
+        return stream
+
+    def ConversionSettings(self, dest):
+        """Method returning the settings that change the output of a conversion"""
+        settings = [self.Format.get(), self.MBOXType.get(), self.Encrypt.get(), self.formula,
+                    os.path.normcase(os.path.abspath(os.path.join(self.destPath, dest))),
+                    SplitList(self.FolderInclude.get()), SplitList(self.FolderExclude.get())]
+        if self.Directory.get() == Directory.NOTES:
+            settings.append("names")
+        elif self.Directory.get() == Directory.FILE:
+            # An edited address book changes the addresses of the messages
+            path = os.path.abspath(self.DirectoryFile.get())
+            settings.append(["directory", os.path.normcase(path),
+                             os.path.getmtime(path) if os.path.exists(path) else None])
+        if self.Format.get() == Format.PST:
+            settings.append(["pst", self.Helper.get(), list(self.pstlimits)])
+        if self.Format.get() == Format.MBOX and self.Compress.get() == Compress.YES:
+            settings.append("bgzf")
+        if self.Format.get() == Format.MBOX and self.SortByDate.get() == SortByDate.YES:
+            settings.append("sorted")
+        if self.Format.get() == Format.EML and self.Archive.get() != Archive.NONE:
+            settings.append(["zip", "zip", "tar", "maildir", "maildir", "imap"][self.Archive.get() - 1])
+            if self.Archive.get() == Archive.IMAP:
+                settings.append(self.IMAPServer.get())
+        if self.StoreAttachments():
+            settings.append("dedup")
+        if self.Index.get() == Index.YES:
+            settings.append("index")
+        if self.ExportCatalog.get() == ExportCatalog.YES:
+            settings.append("exports")
+        if self.Metadata.get() != Metadata.NO:
+            settings.append(["metadata", self.Metadata.get()])
+        return settings
+
+    def ArchivePath(self, dest):
+        """Method returning the path of the archive of the EML files, or None if
+        they are written to separate files"""
+        if self.Format.get() != Format.EML or self.Archive.get() in (Archive.NONE, Archive.MAILDIR,
+                                                                     Archive.MAILDIRFANOUT, Archive.IMAP):
+            return None
+        return os.path.join(self.destPath, dest + (".tar" if self.Archive.get() == Archive.TAR else ".zip"))
+
+    def OpenArchive(self, path, append, journal):
+        """Method to open the archive of the EML files. If the journal of an
+        interrupted conversion has already written to a tar archive, anything
+        written after the last committed message is discarded. An incomplete
+        ZIP archive can't be appended to, so it is rewritten"""
+        if self.Archive.get() == Archive.TAR:
+            end = journal.End(path)
+            archive = emlarchive.TarArchive(path, append or end is not None, end)
+            if end is None:
+                journal.Record("", path, Journal.OPEN, "%s|%d|%d" % (path, archive.f.tell(), archive.f.tell()))
+            return archive
+        try:
+            return emlarchive.ZipArchive(path, append, self.Archive.get() == Archive.ZIPDEFLATED)
+        except zipfile.BadZipfile as ex:
+            self.log(ErrorLevel.WARN, _("%s. Rewriting it") % ex)
+            journal.Forget(path)
+            return emlarchive.ZipArchive(path, False, self.Archive.get() == Archive.ZIPDEFLATED)
+
+    def IMAPOutput(self):
+        """Method to test if the messages are uploaded to an IMAP server"""
+        return self.Format.get() == Format.EML and self.Archive.get() == Archive.IMAP
+
+    def StoreAttachments(self):
+        """Method to test if the attachments are written to the attachment
+        store. Outlook and the IMAP server need the attachments in the
+        messages, as neither can rehydrate them, and so do the messages of the
+        ZIP and tar archives that attachstore.py doesn't read"""
+        return (self.Dedup.get() == Dedup.YES and self.Format.get() != Format.PST and
+                not self.IMAPOutput() and self.ArchivePath("") is None)
+
+    def RecordUploads(self, journal, results):
+        """Method to record in the journal the messages uploaded to the IMAP
+        server. Returns the number of messages that failed"""
+        failed = 0
+        for (folder, noteid, mailbox, entry), error in results:
+            if error is None:
+                status = Journal.OK
+            else:
+                failed += 1
+                status = Journal.FAILED
+                self.log(ErrorLevel.ERROR, _("Can not upload message 0x%s to %s : %s") % (noteid, mailbox, error))
+            journal.Record(folder, noteid, status, mailbox)
+            if entry is not None:
+                (dest, unid, size, digest) = entry
+                self.CatalogDocument(dest, folder, noteid, unid, status, mailbox, size, digest)
+        return failed
+
+    def IndexMessage(self, dest, fld, doc, location):
+        """Method to add an exported message to the full-text index"""
+        try:
+            mime = doc.GetMIMEEntity("Body")
+            self.index.Add(dest, FolderName(fld.Name), doc.NoteID, doc.UniversalID,
+                           mboxwriter.MessageDate(mime), searchindex.Header(mime, ["Subject"]),
+                           searchindex.Header(mime, ["From"]), searchindex.Header(mime, ["To", "Cc", "Bcc"]),
+                           location, searchindex.BodyText(mime))
+        except (pywintypes.com_error, OSError) as ex: # pylint: disable=E1101
+            self.log(ErrorLevel.WARN, _("Can not index message 0x%s : %s") % (doc.NoteID, ex))
+
+    def WriteMetadata(self, meta, dest, fld, doc, location, size):
+        """Method to write the metadata of an exported message"""
+        try:
+            mime = doc.GetMIMEEntity("Body")
+            meta.Write(metadata.Record(mime, dest, FolderName(fld.Name), doc.NoteID, doc.UniversalID,
+                                       mboxwriter.MessageDate(mime), size, location, self.resolver))
+        except (pywintypes.com_error, OSError) as ex: # pylint: disable=E1101
+            self.log(ErrorLevel.WARN, _("Can not write the metadata of message 0x%s : %s") % (doc.NoteID, ex))
+
+    def CatalogDocument(self, dest, folder, noteid, unid, status, location, size=None, digest=None):
+        """Method to add a treated document to the catalog of the exports. The
+        size and the digest are only recorded for the exported messages"""
+        if status != Journal.OK:
+            (size, digest) = (None, None)
+        try:
+            self.exports.Add(dest, FolderName(folder), noteid, unid, location, size, digest, status)
+        except OSError as ex:
+            self.log(ErrorLevel.WARN, _("Can not catalog document 0x%s : %s") % (noteid, ex))
+
+    def MBOXName(self, name):
+        """Method returning the name of an MBOX file, compressed or not"""
+        return name + (".mbox.gz" if self.Compress.get() == Compress.YES else ".mbox")
+
+    def Fingerprint(self, abssrc, dest):
+        """Method returning the fingerprint of an NSF file for the catalog"""
+        st = os.stat(abssrc)
+        dBNotes = self.Lotus.GetDatabase("", abssrc)
+        return {"size" : st.st_size, "mtime" : st.st_mtime, "replica" : dBNotes.ReplicaID,
+                "modified" : dBNotes.LastModified.LocalTime,
+                "settings" : self.ConversionSettings(dest)}
+
+    def Unchanged(self, entry, abssrc, dest):
+        """Method to test if an NSF file is unchanged since its conversion recorded
+        in the catalog entry, and if the output of this conversion still exists"""
+        if not entry or entry["settings"] != self.ConversionSettings(dest):
+            return False
+
+        if self.Format.get() == Format.PST:
+            output = os.path.join(self.destPath, dest + ".pst")
+        elif self.Format.get() == Format.MBOX and self.MBOXType.get() == SubdirectoryMBOX.NO:
+            output = os.path.join(self.destPath, self.MBOXName(dest))
+        elif self.ArchivePath(dest):
+            output = self.ArchivePath(dest)
+        elif self.IMAPOutput():
+            # The messages are on the server, only the state is in the destination
+            output = os.path.join(self.destPath, dest + ".nsf2x")
+        else:
+            output = os.path.join(self.destPath, dest)
+        if not os.path.exists(output):
+            return False
+
+        # The size and modification time of the file are enough in general. If
+        # they differ, the file might only have been copied, so compare the
+        # replica ID and modification time of the Notes database as well
+        st = os.stat(abssrc)
+        if st.st_size == entry["size"] and st.st_mtime == entry["mtime"]:
+            return True
+        if st.st_size != entry["size"]:
+            return False
+        dBNotes = self.Lotus.GetDatabase("", abssrc)
+        if dBNotes.ReplicaID == entry["replica"] and dBNotes.LastModified.LocalTime == entry["modified"]:
+            entry["mtime"] = st.st_mtime
+            return True
+        return False
+
+    def OpenMBOX(self, mbox, append, journal):
+        """Method to open an MBOX file. If the journal of an interrupted conversion
+        has already written to the file, anything written after the last
+        committed message is discarded"""
+        end = journal.End(mbox)
+        if end is not None:
+            f = mboxwriter.MBOXFile(mbox, True, self.Compress.get() == Compress.YES)
+            f.truncate(end)
+            f.seek(end)
+        else:
+            f = mboxwriter.MBOXFile(mbox, append, self.Compress.get() == Compress.YES)
+            journal.Record("", mbox, Journal.OPEN, "%s|%d|%d" % (mbox, f.tell(), f.tell()))
+        return f
+
+    def SortMBOX(self, mbox):
+        """Method to sort the messages of a complete MBOX file by date. A file
+        that can't be sorted is left as it is. Returns a dictionary of the old
+        and the new locations of the messages moved"""
+        self.log(ErrorLevel.NORMAL, _("Sorting the messages of %s by date") % mbox)
+        start = time.time()
+        moves = {}
+        def moved(old, new):
+            if old != new:
+                moves["%s|%d|%d" % ((mbox,) + old)] = "%s|%d|%d" % ((mbox,) + new)
+        try:
+            (messages, runs, temp) = mboxwriter.SortMBOX(mbox, moved=moved)
+        except (OSError, ValueError) as ex:
+            self.log(ErrorLevel.ERROR, _("Can not sort %s : %s") % (mbox, ex))
+            return {}
+        self.log(ErrorLevel.NORMAL, _("%d messages sorted in %.1fs, with %d runs and %.1f MB of temporary files") %
+                 (messages, time.time() - start, runs, temp / 1048576.))
+        return moves
+
+    def FolderSelected(self, fld):
+        """Method to test if a Notes view is a folder that should be exported"""
+        if not (fld.Name == "($Sent)" or fld.IsFolder) or fld.EntryCount <= 0:
+            return False
+
+        # Match the folder and its sub-folders against the Notes and output names
+        names = (fld.Name.lower(), FolderName(fld.Name).lower())
+        def matches(patterns):
+            for p in patterns:
+                p = p.lower()
+                for n in names:
+                    if n == p or n.startswith(p + "\\"):
+                        return True
+            return False
+
+        include = SplitList(self.FolderInclude.get())
+        if include and not matches(include):
+            return False
+        return not matches(SplitList(self.FolderExclude.get()))
+
+    def FolderDocuments(self, fld, coll=None):
+        """Generator over the documents of a Notes folder. If coll isn't None
+        only the documents of the folder that are also in the NotesDocumentCollection
+        coll are returned, without touching the other documents"""
+        if coll is None:
+            doc = fld.GetFirstDocument()
+            while doc:
+                yield doc
+                doc = fld.GetNextDocument(doc)
+        else:
+            entries = fld.AllEntries
+            entries.Intersect(coll)
+            entry = entries.GetFirstEntry()
+            while entry:
+                doc = entry.Document
+                entry = entries.GetNextEntry(entry)
+                if doc:
+                    yield doc
+
+    def RecordDeletions(self, coll, dest):
+        """Method to write the deletion stubs in a collection of modified
+        documents to the deletion report of the database"""
+        n = 0
+        report = os.path.join(self.destPath, dest + "-deleted.txt")
+        now = datetime.datetime.now()
+        with open(report, "a") as f:
+            doc = coll.GetFirstDocument()
+            while doc:
+                if doc.IsDeleted:
+                    f.write("%s\t0x%s\t%s\n" % (now, doc.NoteID, doc.UniversalID))
+                    n += 1
+                doc = coll.GetNextDocument(doc)
+        if n > 0:
+            self.log(ErrorLevel.NORMAL, _("%d deleted documents recorded in %s") % (n, report))
+        return n
+
     def realConvert(self, src, dest):
-        """Method to perform the translation from NSF to X on a single file"""
+        """Method to perform the translation from NSF to X on a single file.
+        Returns True if the conversion is complete and without exceptions"""
         c = 0 #document counter
         e = 0 #exception counter
         ac = 0 # all message count, though only an upper bounds as some documents not in folders
@@ -713,9 +1769,14 @@ class Gui(tkinter.Frame):
         path = os.path.join(self.nsfPath, src)
         self.log(ErrorLevel.NORMAL, _("Converting : %s ") % path)
 
+        # For the profiling of NSF2X without Notes, the use of the database can
+        # be recorded to a trace in the directory NSF2X_RECORD. See replay.py
+        record = os.environ.get("NSF2X_RECORD")
         if self.Lotus != None:
             try:
                 dBNotes = self.Lotus.GetDatabase("", path)
+                if record:
+                    dBNotes = replay.Recorder(dBNotes)
                 ac = dBNotes.AllDocuments.Count
             except pywintypes.com_error as ex: # pylint: disable=E1101
                 self.log(ErrorLevel.ERROR, _("Error connecting to Lotus !"))
@@ -726,6 +1787,41 @@ class Gui(tkinter.Frame):
         if ac <= 0:
             raise ValueError(_("The database %s appears to be empty. Returning") % src)
 
+        # Let Notes select the documents matching the filters, so that the
+        # other documents are never touched
+        coll = None
+        if self.formula:
+            coll = dBNotes.Search(self.formula, None, 0)
+            ac = coll.Count
+            self.log(ErrorLevel.NORMAL, _("%d documents match the filters") % ac)
+            if ac <= 0:
+                return True
+
+        # In delta mode only the documents modified since the previous conversion
+        # are exported, and they are appended to the existing output
+        statefile = os.path.join(self.destPath, dest + ".nsf2x")
+        state = LoadState(statefile)
+        append = False
+        if self.Delta.get() == Delta.YES and state.get("until"):
+            if state.get("format") != self.Format.get():
+                self.log(ErrorLevel.WARN, _("Previous conversion of %s was to a different format. Converting all documents") % src)
+            else:
+                append = True
+                # DBMOD_DOC_DATA = 1
+                modified = dBNotes.GetModifiedDocuments(self.Lotus.CreateDateTime(state["until"]), 1)
+                self.log(ErrorLevel.NORMAL, _("%d documents modified since %s") %
+                         (modified.Count, state["until"]))
+                self.RecordDeletions(modified, dest)
+                if coll is None:
+                    coll = modified
+                else:
+                    coll.Intersect(modified)
+                ac = coll.Count
+                if ac <= 0:
+                    state["until"] = modified.UntilTime.LocalTime
+                    SaveState(statefile, state)
+                    return True
+
         # Preconvert all messages to MIME before writing EML files as the
         # C DLL might not be finished saving the message before the COM
         # interface tries to access the MIME body. Also the call to mapiex.mapi()
@@ -749,352 +1845,630 @@ class Gui(tkinter.Frame):
             raise ValueError(_("Can not open Lotus database %s with C API (ErrorID %d)") %
                              (path, stat))
 
-        self.log(ErrorLevel.NORMAL, _("Starting MIME encoding of messages"))
-        for fld in dBNotes.Views:
-            if  not (fld.Name == "($Sent)" or fld.IsFolder) or fld.EntryCount <= 0:
-                if fld.EntryCount > 0:
-                    tl.title(_("Lotus Notes Converter - Phase 1/%d Converting MIME (%.1f%%)") %
-                             (ph, float(10.*c/ac)))
-                    self.update()
-                if not self.running:
-                    return False
-                continue
-            doc = fld.GetFirstDocument()
+        # The journal of an interrupted conversion allows the documents already
+        # exported to be skipped, and the output to be appended to
+        f = None
+        journal = Journal(os.path.join(self.destPath, dest + ".journal"), self.Resume.get(),
+                          self.ConversionSettings(dest))
+        try:
+            if journal.discarded:
+                self.log(ErrorLevel.WARN, _("The interrupted conversion of %s used other settings, "
+                                            "converting it again") % src)
+            if journal.Resuming():
+                self.log(ErrorLevel.NORMAL, _("Resuming the previous conversion of %s") % src)
+                append = True
+            resumed = 0
+
+            # Cache of the documents known to already be in MIME, with the time of
+            # their last modification, so that a rerun doesn't need to open them
+            # with the C API. Reset the cache if the NSF file is a different database
+            mimecache = state.get("mime", {})
+            if mimecache.get("replica") != dBNotes.ReplicaID:
+                mimecache = {"replica" : dBNotes.ReplicaID, "notes" : {}}
+            state["mime"] = mimecache
+            cached = 0
+
+            # The distinct Notes names of the documents, looked up in the directory
+            # in a single batch before the headers are written
+            names = set()
+
+            self.log(ErrorLevel.NORMAL, _("Starting MIME encoding of messages"))
+            for fld in dBNotes.Views:
+                if not self.FolderSelected(fld):
+                    if fld.EntryCount > 0:
+                        tl.title(_("Lotus Notes Converter - Phase 1/%d Converting MIME (%.1f%%)") %
+                                 (ph, float(10.*c/ac)))
+                        self.update()
+                    if not self.running:
+                        return False
+                    continue
 
-            while doc and (nex < 0 or e < nex): #stop after XXX exceptions...
-                if not self.running:
-                    return False
+                for doc in self.FolderDocuments(fld, coll):
+                    if 0 <= nex <= e: #stop after XXX exceptions...
+                        break
+                    if not self.running:
+                        return False
 
-                subject = doc.GetFirstItem("Subject")
-                try:
-                    if not self.ConvertToMIME(doc, _NotesEntries):
+                    if journal.Done(fld.Name, doc.NoteID):
+                        c += 1
+                        continue
+
+                    if mimecache["notes"].get(doc.NoteID) == str(doc.LastModified):
+                        c += 1
+                        cached += 1
+                        continue
+
+                    if self.resolver:
+                        try:
+                            for item in ("From", "Principal", "SendTo", "CopyTo", "BlindCopyTo"):
+                                names.update(doc.GetItemValue(item))
+                        except pywintypes.com_error: # pylint: disable=E1101
+                            pass
+
+                    subject = doc.GetFirstItem("Subject")
+                    try:
+                        ok, _NotesEntries = self.RetryConvertToMIME(doc, _NotesEntries, path)
+                        if not ok:
+                            e += 1
+                            journal.Record(fld.Name, doc.NoteID, Journal.FAILED)
+                            self.log(ErrorLevel.ERROR, _("Can not convert message %d to MIME") % c)
+                            if subject:
+                                self.log(ErrorLevel.ERROR, _("#### Subject : %s") % subject.Text)
+                    except (pywintypes.com_error, OSError) as ex: # pylint: disable=E1101
                         e += 1
-                        self.log(ErrorLevel.ERROR, _("Can not convert message %d to MIME") % c)
+                        journal.Record(fld.Name, doc.NoteID, Journal.FAILED)
+                        self.log(ErrorLevel.ERROR, _("Exception converting message %d to MIME : %s") %
+                                 (c, ex))
                         if subject:
                             self.log(ErrorLevel.ERROR, _("#### Subject : %s") % subject.Text)
-                except (pywintypes.com_error, OSError) as ex: # pylint: disable=E1101
-                    e += 1
-                    self.log(ErrorLevel.ERROR, _("Exception converting message %d to MIME : %s") %
-                             (c, ex))
-                    if subject:
-                        self.log(ErrorLevel.ERROR, _("#### Subject : %s") % subject.Text)
-
-                doc = fld.GetNextDocument(doc)
-                c += 1
-                if (c % 20) == 0:
-                    tl.title(_("Lotus Notes Converter - Phase 1/%d Converting MIME (%.1f%%)") %
-                             (ph, float(10.*c/ac)))
-                    self.update()
-
-        if e == nex:
-            self.log(ErrorLevel.ERROR, _("Too many exceptions during MIME conversion. Stopping\n"))
-            return False
-
-        if c <= 0:
-            raise ValueError(_("The database %s appears to be empty. Returning") % src)
 
-        f = None
-        MAPIrootFolder = None
-
-        if self.Format.get() == Format.MBOX and self.MBOXType.get() == SubdirectoryMBOX.NO:
-            mbox = os.path.join(self.destPath, (dest + ".mbox"))
-            self.log(ErrorLevel.NORMAL, _("Opening MBOX file - %s") % mbox)
-            f = open(mbox, "wb")
-        elif self.Format.get() == Format.PST and not self.EML2PST:
-            pst = os.path.join(self.destPath, (dest + ".pst"))
-
-            # Can't guarantee that MAPISVC.INF contains the service "MSPST MS" and so
-            # can't use MAPI to create PST. This is now the only place the Outlook
-            # Object Model is used, and it would be great to get rid of it.
-            try:
-                Outlook = win32com.client.Dispatch(r'Outlook.Application')
-            except pywintypes.com_error as ex: # pylint: disable=E1101
-                self.log(ErrorLevel.ERROR, _("Could not connect to Outlook !"))
-                self.log(ErrorLevel.ERROR, _("Exception %s :") % ex)
-                Outlook = None
-            ns = Outlook.GetNamespace(r'MAPI')
-            self.log(ErrorLevel.NORMAL, _("Opening PST file - %s") % pst)
-            ns.AddStore(pst)
-            rootFolder = ns.Folders.GetLast()
-            rootFolder.Name = dest
-
-            # Reopen the message store created with OOM and only use MAPI from here
-            # on out.
-            try:
-                MAPI = mapiex.mapi()
-                MAPI.OpenMessageStore(dest)
-                MAPIrootFolder = MAPI.OpenRootFolder()
-            except Exception as ex:
-                self.log(ErrorLevel.ERROR, _("Could not connect to MAPI !"))
-                self.log(ErrorLevel.ERROR, _("Exception %s :") % ex)
-                raise
+                    c += 1
+                    if (c % 20) == 0:
+                        tl.title(_("Lotus Notes Converter - Phase 1/%d Converting MIME (%.1f%%)") %
+                                 (ph, float(10.*c/ac)))
+                        self.update()
 
-        if self.Format.get() == Format.PST and self.EML2PST:
-            self.log(ErrorLevel.NORMAL, _("Starting exportation to temporary EML messages"))
-        else:
-            self.log(ErrorLevel.NORMAL, _("Starting importation of EML messages into mailbox"))
-        ac = c # Update all message count
-        c = 0
-        e = 0
-        for fld in dBNotes.Views:
-            if  not (fld.Name == "($Sent)" or fld.IsFolder) or fld.EntryCount <= 0:
-                if fld.EntryCount > 0:
-                    if ph == 3:
-                        tl.title(_("Lotus Notes Converter - Phase 2/3 Export Message %d of %d (%.1f%%)") %
-                                 (c, ac, float(10.*(ac + 6.*c)/ac)))
-                    else:
-                        tl.title(_("Lotus Notes Converter - Phase 2/2 Import Message %d of %d (%.1f%%)") %
-                                 (c, ac, float(10.*(ac + 9.*c)/ac)))
-                    self.update()
-                if not self.running:
-                    return False
-                continue
-
-            pstfld = None
-            if self.Format.get() == Format.EML or (self.Format.get() == Format.PST
-                                                   and self.EML2PST):
-                if fld.Name == "($Sent)":
-                    path = os.path.join(self.destPath, dest, _("Sent"))
-                elif fld.Name == "($Inbox)":
-                    path = os.path.join(self.destPath, dest, _("Inbox"))
-                else:
-                    path = os.path.join(self.destPath, dest, fld.Name)
+            if cached > 0:
+                self.log(ErrorLevel.NORMAL, _("%d documents already in MIME from a previous conversion") % cached)
+
+            if e == nex:
+                self.log(ErrorLevel.ERROR, _("Too many exceptions during MIME conversion. Stopping\n"))
+                return False
+
+            if self.resolver and names:
+                self.log(ErrorLevel.INFO, _("Looking up %d Notes names in the directory") %
+                         self.resolver.Prefetch(names))
+
+            # The MIME conversion modifies the documents, so the time of the
+            # database after the conversion is taken as the start of the next delta
+            if self.Delta.get() == Delta.YES:
+                until = dBNotes.GetModifiedDocuments(dBNotes.LastModified, 1).UntilTime.LocalTime
+
+            if c <= 0:
+                if coll is not None:
+                    # None of the selected documents are in the folders, so nothing to do
+                    if self.Delta.get() == Delta.YES:
+                        state["until"] = until
+                        state["format"] = self.Format.get()
+                        SaveState(statefile, state)
+                    return True
+                raise ValueError(_("The database %s appears to be empty. Returning") % src)
+
+            MAPIrootFolder = None
+            archive = None
+            maildir = None
+            manifest = None
+            meta = None
+            mboxes = []
+
+            # The documents not yet read in Notes are uploaded without the \Seen flag
+            unread = None
+            if self.imap is not None:
                 try:
-                    if not os.path.exists(path):
-                        os.makedirs(path, 0x755)
-                        self.log(ErrorLevel.NORMAL, _("Creating directory %s") % path)
-                except OSError as ex:
-                    self.log(ErrorLevel.ERROR, _("Can not create directory %s") % path)
-                    self.log(ErrorLevel.ERROR, "%s :" % ex)
-                    continue
+                    unread = set()
+                    unreadcoll = dBNotes.GetAllUnreadDocuments()
+                    doc = unreadcoll.GetFirstDocument()
+                    while doc:
+                        unread.add(doc.NoteID)
+                        doc = unreadcoll.GetNextDocument(doc)
+                except (pywintypes.com_error, AttributeError): # pylint: disable=E1101
+                    # Only available from Notes 8
+                    unread = None
+
+            if self.Format.get() == Format.EML and self.Archive.get() in (Archive.MAILDIR, Archive.MAILDIRFANOUT):
+                maildir = maildirs.Maildir(os.path.join(self.destPath, dest),
+                                           self.Archive.get() == Archive.MAILDIRFANOUT)
+            elif self.ArchivePath(dest):
+                self.log(ErrorLevel.NORMAL, _("Opening archive - %s") % self.ArchivePath(dest))
+                archive = self.OpenArchive(self.ArchivePath(dest), append, journal)
+            elif self.Format.get() == Format.MBOX and self.MBOXType.get() == SubdirectoryMBOX.NO:
+                mbox = os.path.join(self.destPath, self.MBOXName(dest))
+                self.log(ErrorLevel.NORMAL, _("Opening MBOX file - %s") % mbox)
+                f = self.OpenMBOX(mbox, append, journal)
+                mboxes.append(mbox)
             elif self.Format.get() == Format.PST and not self.EML2PST:
-                if fld.Name == "($Sent)":
-                    pstfld = MAPIrootFolder.CreateSubFolder(_("Sent"))
-                elif fld.Name == "($Inbox)":
-                    pstfld = MAPIrootFolder.CreateSubFolder(_("Inbox"))
-                else:
-                    pstfld = MAPIrootFolder.CreateSubFolder(fld.Name)
-
-                if not pstfld:
-                    self.log(ErrorLevel.ERROR, _("Could not open folder : %s") % fld.Name)
+                # The messages go on to the last PST file of an interrupted conversion
+                manifest = PSTManifest(os.path.join(self.destPath, dest + ".pst.json"), append)
+                (pst, store, MAPIrootFolder) = self.OpenPST(dest, max(manifest.Count(), 1))
+                if manifest.Count() == 0:
+                    manifest.Add(pst, store)
+
+            # The messages of a new conversion would be added next to those of
+            # a previous one, so a Maildir or IMAP mailboxes already holding
+            # messages are only written by a resumed or delta conversion
+            if not append and maildir is not None and next(maildir.Messages(), None) is not None:
+                raise OSError(_("The Maildir %s already holds messages. Use an empty destination, "
+                                "or resume or delta mode") % maildir.path)
+            if not append and self.imap is not None:
+                for fld in dBNotes.Views:
+                    if self.FolderSelected(fld) and self.imap.Count(MaildirFolder(fld.Name)) > 0:
+                        raise OSError(_("The IMAP mailbox %s already holds messages. Use empty mailboxes, "
+                                        "or resume or delta mode") % self.imap.Mailbox(MaildirFolder(fld.Name)))
+
+            if self.Metadata.get() != Metadata.NO:
+                metapath = os.path.join(self.destPath, dest + (".jsonl.gz" if self.Metadata.get() == Metadata.JSONLGZ
+                                                               else ".jsonl"))
+                self.log(ErrorLevel.NORMAL, _("Writing the metadata of the messages to %s") % metapath)
+                meta = metadata.MetadataWriter(metapath, self.Metadata.get() == Metadata.JSONLGZ, append)
+
+            if self.Format.get() == Format.PST and self.EML2PST:
+                self.log(ErrorLevel.NORMAL, _("Starting exportation to temporary EML messages"))
+            else:
+                self.log(ErrorLevel.NORMAL, _("Starting importation of EML messages into mailbox"))
+            ac = c # Update all message count
+            c = 0
+            e = 0
+            for fld in dBNotes.Views:
+                if not self.FolderSelected(fld):
+                    if fld.EntryCount > 0:
+                        if ph == 3:
+                            tl.title(_("Lotus Notes Converter - Phase 2/3 Export Message %d of %d (%.1f%%)") %
+                                     (c, ac, float(10.*(ac + 6.*c)/ac)))
+                        else:
+                            tl.title(_("Lotus Notes Converter - Phase 2/2 Import Message %d of %d (%.1f%%)") %
+                                     (c, ac, float(10.*(ac + 9.*c)/ac)))
+                        self.update()
+                    if not self.running:
+                        if archive is not None:
+                            archive.Close()
+                        if manifest is not None:
+                            manifest.Save()
+                        if self.imap is not None:
+                            self.RecordUploads(journal, self.imap.Flush())
+                        if meta is not None:
+                            meta.Close()
+                        return False
                     continue
 
-            elif self.Format.get() == Format.MBOX and self.MBOXType.get() == SubdirectoryMBOX.YES:
-                if fld.Name == "($Sent)":
-                    mbox = os.path.join(self.destPath, dest, (_("Sent") + ".mbox"))
-                elif fld.Name == "($Inbox)":
-                    mbox = os.path.join(self.destPath, dest, (_("Inbox") + ".mbox"))
+                pstfld = None
+                if self.imap is not None:
+                    try:
+                        self.imap.CreateFolder(MaildirFolder(fld.Name))
+                    except OSError as ex:
+                        self.log(ErrorLevel.ERROR, _("Can not create the IMAP folder %s") % fld.Name)
+                        self.log(ErrorLevel.ERROR, "%s :" % ex)
+                        continue
+                elif maildir is not None:
+                    try:
+                        maildir.CreateFolder(MaildirFolder(fld.Name))
+                    except OSError as ex:
+                        self.log(ErrorLevel.ERROR, _("Can not create directory %s") %
+                                 maildir.FolderPath(MaildirFolder(fld.Name)))
+                        self.log(ErrorLevel.ERROR, "%s :" % ex)
+                        continue
+                elif archive is None and (self.Format.get() == Format.EML or (self.Format.get() == Format.PST
+                                                                              and self.EML2PST)):
+                    path = os.path.join(self.destPath, dest, FolderName(fld.Name))
+                    try:
+                        if not os.path.exists(path):
+                            os.makedirs(path, 0x755)
+                            self.log(ErrorLevel.NORMAL, _("Creating directory %s") % path)
+                    except OSError as ex:
+                        self.log(ErrorLevel.ERROR, _("Can not create directory %s") % path)
+                        self.log(ErrorLevel.ERROR, "%s :" % ex)
+                        continue
+                elif self.Format.get() == Format.PST and not self.EML2PST:
+                    pstfld = MAPIrootFolder.CreateSubFolder(FolderName(fld.Name))
+
+                    if not pstfld:
+                        self.log(ErrorLevel.ERROR, _("Could not open folder : %s") % fld.Name)
+                        continue
+
+                elif self.Format.get() == Format.MBOX and self.MBOXType.get() == SubdirectoryMBOX.YES:
+                    mbox = os.path.join(self.destPath, dest, self.MBOXName(FolderName(fld.Name)))
+
+                    try:
+                        mboxdir = os.path.dirname(mbox)
+                        if not os.path.exists(mboxdir):
+                            os.makedirs(mboxdir, 0x755)
+                            self.log(ErrorLevel.NORMAL, _("Creating directory %s") % mboxdir)
+                    except OSError as ex:
+                        self.log(ErrorLevel.ERROR, _("Can not create directory %s") % mboxdir)
+                        self.log(ErrorLevel.ERROR, "%s :" % ex)
+
+                    self.log(ErrorLevel.NORMAL, _("Opening MBOX file - %s") % mbox)
+                    f = self.OpenMBOX(mbox, append, journal)
+                    mboxes.append(mbox)
+
+                if append and archive is not None:
+                    d = archive.NextIndex(FolderName(fld.Name))
+                elif append and maildir is None and self.imap is None and (
+                        self.Format.get() == Format.EML or (self.Format.get() == Format.PST and self.EML2PST)):
+                    d = NextIndex(path)
                 else:
-                    mbox = os.path.join(self.destPath, dest, (fld.Name + ".mbox"))
-
-                try:
-                    mboxdir = os.path.dirname(mbox)
-                    if not os.path.exists(mboxdir):
-                        os.makedirs(mboxdir, 0x755)
-                        self.log(ErrorLevel.NORMAL, _("Creating directory %s") % mboxdir)
-                except OSError as ex:
-                    self.log(ErrorLevel.ERROR, _("Can not create directory %s") % mboxdir)
-                    self.log(ErrorLevel.ERROR, "%s :" % ex)
-
-                self.log(ErrorLevel.NORMAL, _("Opening MBOX file - %s") % mbox)
-                f = open(mbox, "wb")
-
-            doc = fld.GetFirstDocument()
-            d = 1
-            while doc and (nex < 0 or e < nex): #stop after XXX exceptions...
-                if not self.running:
-                    return False
-
-                try:
-                    eml = None
-
-                    if doc.GetFirstItem("Body") is None and doc.GetFirstItem("Body") is None:
-                        # This allows the export of message that contain no
-                        # body, as the subject, date and recipients contain
-                        # useful information
-                        self.log(ErrorLevel.INFO, _("Creating Body in message %d") % c)
-                        doc.CreateMIMEEntity()
-
-                    if doc.GetMIMEEntity("Body") is None:
-                        subject = doc.GetFirstItem("Subject")
-                        form = doc.GetFirstItem("Form")
-                        if not form:
-                            form = "None"
-                        else:
-                            form = form.Text
-                        empty = False
-                        if form in ("Appointment", "Task", "Notice", "Return Receipt",
-                                    "Trace Report", "Delivery Report"):
-                            # These are clearly not messages, so ok to ignore them
-                            errlvl = ErrorLevel.WARN
-                        else:
-                            body = doc.GetFirstItem("Body")
-                            if not body or body.ValueLength <= 0:
-                                # This shouldn't be possible after creation of body above
+                    d = 1
+                for doc in self.FolderDocuments(fld, coll):
+                    if 0 <= nex <= e: #stop after XXX exceptions...
+                        break
+                    if not self.running:
+                        if archive is not None:
+                            archive.Close()
+                        if manifest is not None:
+                            manifest.Save()
+                        if self.imap is not None:
+                            self.RecordUploads(journal, self.imap.Flush())
+                        if meta is not None:
+                            meta.Close()
+                        return False
+
+                    noteid = doc.NoteID
+                    if journal.Done(fld.Name, noteid):
+                        c += 1
+                        resumed += 1
+                        continue
+
+                    status = Journal.FAILED
+                    location = ""
+                    out = None
+                    unid = ""
+                    if self.Format.get() == Format.MBOX:
+                        start = f.tell()
+                    try:
+                        eml = None
+                        if self.exports is not None:
+                            unid = doc.UniversalID
+
+                        if doc.GetFirstItem("Body") is None and doc.GetFirstItem("Body") is None:
+                            # This allows the export of message that contain no
+                            # body, as the subject, date and recipients contain
+                            # useful information
+                            self.log(ErrorLevel.INFO, _("Creating Body in message %d") % c)
+                            doc.CreateMIMEEntity()
+
+                        if doc.GetMIMEEntity("Body") is None:
+                            subject = doc.GetFirstItem("Subject")
+                            form = doc.GetFirstItem("Form")
+                            if not form:
+                                form = "None"
+                            else:
+                                form = form.Text
+                            empty = False
+                            if form in NonMailForms:
+                                # These are clearly not messages, so ok to ignore them
                                 errlvl = ErrorLevel.WARN
-                                empty = True
                             else:
-                                errlvl = ErrorLevel.ERROR
-                                e += 1
-
-                        if empty:
-                            self.log(errlvl, _("Ignoring message %d of form '%s' with empty body") % (c, form))
-                        else:
-                            self.log(errlvl, _("Ignoring message %d of form '%s' without MIME body") % (c, form))
-
-                        if subject:
-                            self.log(errlvl, _("#### Subject : %s") % subject.Text)
-
-                        if errlvl == ErrorLevel.WARN:
-                            self.log(errlvl, _("Skipping as probably not a message"))
-                    else:
-                        if self.Format.get() != Format.MBOX:
-                            if self.Format.get() == Format.EML or (self.Format.get() == Format.PST
-                                                                   and self.EML2PST):
-                                if fld.Name == "($Sent)":
-                                    eml = os.path.join(self.destPath, dest, _("Sent"),
-                                                       (str(d) + ".eml"))
-                                elif fld.Name == "($Inbox)":
-                                    eml = os.path.join(self.destPath, dest, _("Inbox"),
-                                                       (str(d) + ".eml"))
+                                body = doc.GetFirstItem("Body")
+                                if not body or body.ValueLength <= 0:
+                                    # This shouldn't be possible after creation of body above
+                                    errlvl = ErrorLevel.WARN
+                                    empty = True
                                 else:
-                                    eml = os.path.join(self.destPath, dest, fld.Name,
-                                                       (str(d) + ".eml"))
+                                    errlvl = ErrorLevel.ERROR
+                                    e += 1
 
-                                # Need to treat as binary so that windows doesn't convert
-                                # \n\r to \n\n\r
-                                f = open(eml, "wb")
-                            elif self.Format.get() == Format.PST and not self.EML2PST:
-                                (fd, eml) = tempfile.mkstemp(suffix=".eml")
-                                f = os.fdopen(fd, "wb")
-
-                        if self.WriteMIMEOutput(f, doc):
-                            d += 1
-                            if self.Format.get() == Format.PST and not self.EML2PST:
-                                f.close()
-                                pstfld.ImportEML(eml)
+                            if empty:
+                                self.log(errlvl, _("Ignoring message %d of form '%s' with empty body") % (c, form))
+                            else:
+                                self.log(errlvl, _("Ignoring message %d of form '%s' without MIME body") % (c, form))
 
-                                # Done with the temporary EML file. Remove it
-                                if eml != None:
-                                    os.remove(eml)
+                            if subject:
+                                self.log(errlvl, _("#### Subject : %s") % subject.Text)
 
-                            elif self.Format.get() == Format.EML or (self.Format.get() == Format.PST
-                                                                     and self.EML2PST):
-                                f.close()
+                            if errlvl == ErrorLevel.WARN:
+                                self.log(errlvl, _("Skipping as probably not a message"))
+                                status = Journal.SKIPPED
                         else:
-                            raise NameError(_("Can not write Lotus MIME message to a file"))
+                            if archive is not None or self.imap is not None:
+                                # Keep the message in memory, or on disk if it's large,
+                                # until it is complete and can be added to the archive
+                                # or uploaded
+                                f = tempfile.SpooledTemporaryFile(mimewriter.StreamThreshold)
+                            elif maildir is not None:
+                                # Written to tmp and moved to new once complete
+                                (eml, delivered) = maildir.NewMessage(MaildirFolder(fld.Name))
+                                f = open(eml, "wb")
+                            elif self.Format.get() != Format.MBOX:
+                                if self.Format.get() == Format.EML or (self.Format.get() == Format.PST
+                                                                       and self.EML2PST):
+                                    eml = os.path.join(self.destPath, dest, FolderName(fld.Name),
+                                                       (str(d) + ".eml"))
 
-                except (pywintypes.com_error, OSError) as ex: # pylint: disable=E1101
-                    e += 1 #count the exceptions
-                    if eml != None and self.Format.get() != Format.MBOX:
-                        # File might already be closed and/or removed. So failure is ok
-                        try:
+                                    # Need to treat as binary so that windows doesn't convert
+                                    # \n\r to \n\n\r. Write to a temporary file renamed
+                                    # once complete, so that a crash never leaves a partial
+                                    # EML file
+                                    f = open(eml + ".tmp", "wb")
+                                elif self.Format.get() == Format.PST and not self.EML2PST:
+                                    (fd, eml) = tempfile.mkstemp(suffix=".eml")
+                                    f = os.fdopen(fd, "wb")
+                            else:
+                                f.BeginMessage(noteid, mboxwriter.MessageDate(doc.GetMIMEEntity("Body")))
+
+                            parts = self.streamer.parts
+                            # Hash the message as it's written for the catalog, or
+                            # only count its size for the metadata
+                            out = f
+                            if self.exports is not None or meta is not None:
+                                out = exportcatalog.HashingFile(f, self.exports is not None)
+                            if self.RetryWriteMIMEOutput(out, doc):
+                                d += 1
+                                if self.streamer.parts > parts:
+                                    peak = mimewriter.PeakMemory()
+                                    self.log(ErrorLevel.INFO, _("Streamed %d large MIME parts of message %d, peak memory %.1f MB") %
+                                             (self.streamer.parts - parts, c, (peak or 0) / 1048576.))
+                                if self.Format.get() == Format.PST and not self.EML2PST:
+                                    f.close()
+                                    if self.PSTFull(pst, eml, manifest.Messages()):
+                                        self.log(ErrorLevel.NORMAL, _("PST file %s is full") % pst)
+                                        (pst, store, MAPIrootFolder) = self.OpenPST(dest, manifest.Count() + 1)
+                                        manifest.Add(pst, store)
+                                        pstfld = MAPIrootFolder.CreateSubFolder(FolderName(fld.Name))
+                                    pstfld = self.RetryImportEML(pstfld, eml, store, FolderName(fld.Name))
+                                    manifest.Record(FolderName(fld.Name),
+                                                    mboxwriter.MessageDate(doc.GetMIMEEntity("Body")))
+                                    location = FolderName(fld.Name)
+
+                                    # Done with the temporary EML file. Remove it
+                                    if eml != None:
+                                        os.remove(eml)
+
+                                elif archive is not None:
+                                    start, end = archive.Add(emlarchive.ArchiveName(FolderName(fld.Name), d - 1), f)
+                                    f.close()
+                                    location = "%s|%d|%d" % (archive.path, start, end)
+                                elif maildir is not None:
+                                    f.close()
+                                    os.replace(eml, delivered)
+                                    location = delivered
+                                elif self.imap is not None:
+                                    # Recorded in the journal once uploaded
+                                    f.seek(0)
+                                    folder = MaildirFolder(fld.Name)
+                                    entry = None
+                                    if self.exports is not None:
+                                        entry = (dest, unid, out.size, out.Digest())
+                                    self.imap.Append(folder, f.read(), IMAPFlags(fld.Name, doc, unread),
+                                                     mboxwriter.MessageDate(doc.GetMIMEEntity("Body")),
+                                                     (fld.Name, noteid, self.imap.Mailbox(folder), entry))
+                                    f.close()
+                                    location = self.imap.Mailbox(folder)
+                                    status = None
+                                elif self.Format.get() == Format.EML or (self.Format.get() == Format.PST
+                                                                         and self.EML2PST):
+                                    f.close()
+                                    os.replace(eml + ".tmp", eml)
+                                    location = eml
+                                status = Journal.OK
+                                mimecache["notes"][noteid] = str(doc.LastModified)
+                            else:
+                                raise NameError(_("Can not write Lotus MIME message to a file"))
+
+                    except (pywintypes.com_error, OSError) as ex: # pylint: disable=E1101
+                        e += 1 #count the exceptions
+                        if (archive is not None or self.imap is not None) and f is not None:
                             f.close()
-                        except OSError:
-                            pass
-                        try:
-                            os.remove(eml)
-                        except OSError:
-                            pass
-                    self.log(ErrorLevel.ERROR, _("Exception for message %d (%s) :") % (c, ex))
-                    self.log(ErrorLevel.ERROR, "%s" % traceback.format_exc())
-                    subject = doc.GetFirstItem("Subject")
-                    if subject:
-                        self.log(ErrorLevel.ERROR, _("#### Subject : %s") % subject.Text)
+                        if eml != None and self.Format.get() != Format.MBOX:
+                            # File might already be closed and/or removed. So failure is ok
+                            try:
+                                f.close()
+                            except OSError:
+                                pass
+                            try:
+                                os.remove(eml)
+                            except OSError:
+                                pass
+                            try:
+                                os.remove(eml + ".tmp")
+                            except OSError:
+                                pass
+                        self.log(ErrorLevel.ERROR, _("Exception for message %d (%s) :") % (c, ex))
+                        self.log(ErrorLevel.ERROR, "%s" % traceback.format_exc())
+                        subject = doc.GetFirstItem("Subject")
+                        if subject:
+                            self.log(ErrorLevel.ERROR, _("#### Subject : %s") % subject.Text)
 
-                finally:
-                    c += 1
-                    doc = fld.GetNextDocument(doc)
+                    finally:
+                        c += 1
+
+                        if self.Format.get() == Format.MBOX:
+                            if status == Journal.FAILED:
+                                # Remove any partially written message
+                                f.truncate(start)
+                                f.seek(start)
+                            elif status == Journal.SKIPPED:
+                                # Nothing was written, as BeginMessage wasn't called
+                                location = "%s|%d|%d" % (mbox, start, start)
+                            else:
+                                # MBOX is recognized by "\nFrom " string. So add a trailing \n
+                                # to each message to ensure this format
+                                f.EndMessage()
+                                f.flush()
+                                location = "%s|%d|%d" % (mbox, start, f.tell())
+
+                        if status is not None and self.Format.get() == Format.MBOX:
+                            # The messages of a compressed MBOX file are only on
+                            # disk once a checkpoint of the file is reached
+                            journal.Defer(fld.Name, noteid, status, location)
+                            if f.durable == f.tell():
+                                journal.Commit()
+                        elif status is not None:
+                            journal.Record(fld.Name, noteid, status, location)
+                        if self.index is not None and status in (Journal.OK, None):
+                            self.IndexMessage(dest, fld, doc, location)
+                        hashed = out is not None and out is not f
+                        if meta is not None and status in (Journal.OK, None):
+                            self.WriteMetadata(meta, dest, fld, doc, location, out.size if hashed else None)
+                        if self.exports is not None and status is not None:
+                            self.CatalogDocument(dest, fld.Name, noteid, unid, status, location,
+                                                 out.size if hashed else None, out.Digest() if hashed else None)
+                        if self.imap is not None:
+                            e += self.RecordUploads(journal, self.imap.Done())
+                        if (c % 1000) == 0:
+                            # Don't lose the whole MIME cache if NSF2X crashes
+                            SaveState(statefile, state)
+                            if manifest is not None:
+                                manifest.Save()
+                            if self.index is not None:
+                                self.index.Flush()
+                            if self.exports is not None:
+                                self.exports.Flush()
+                            if meta is not None:
+                                meta.Flush()
+
+                        if (c % 20) == 0:
+                            if ph == 3:
+                                tl.title(_("Lotus Notes Converter - Phase 2/3 Export Message %d of %d (%.1f%%)") %
+                                         (c, ac, float(10.*(ac + 6.*c)/ac)))
+                            else:
+                                tl.title(_("Lotus Notes Converter - Phase 2/2 Import Message %d of %d (%.1f%%)") % (c, ac, float(10.*(ac + 9.*c)/ac)))
+                            self.update()
 
-                    if self.Format.get() == Format.MBOX:
-                        # MBOX is recognized by "\nFrom " string. So add a trailing \n
-                        # to each message to ensure this format
-                        f.write(b"\n")
+                if self.Format.get() == Format.MBOX and self.MBOXType.get() == SubdirectoryMBOX.YES:
+                    f.close()
+                    journal.Commit()
+
+            # If need to call EML2PST helper function run Phase 3
+            if self.Format.get() == Format.PST and self.EML2PST:
+                self.log(ErrorLevel.NORMAL, _("Starting importation of EML files into PST file"))
+                # Force Popen to not create a CMD windows. Don't use "Shell=True" as although
+                # not a security risk here (the user of NSF2X already has console access), but
+                # its use is discouraged.
+                CREATE_NO_WINDOW = 0x08000000
+                process = subprocess.Popen([self.EML2PST,
+                                            os.path.join(self.destPath, dest),
+                                            os.path.join(self.destPath, (dest + ".pst"))],
+                                           stdout=subprocess.PIPE,
+                                           stderr=subprocess.PIPE,
+                                           universal_newlines=True,
+                                           creationflags=CREATE_NO_WINDOW)
+
+                terminating = False
+                while process.returncode is None:
+                    if not terminating:
+                        # handle output by direct access to stdout and stderr
+                        for line in process.stdout:
+                            if line.endswith('\n'):
+                                line = line[:-1]
+
+                            # Interpret the stdout line, allowing for translated strings
+                            if line[:18] == "Importing message ":
+                                c = int(line[18:])
+                                tl.title(_("Lotus Notes Converter - Phase 3/3 Import Message %d of %d (%.1f%%)") % (c, ac, float(10.*(7*ac + 3.*c)/ac)))
+                                self.update()
+                            elif line[:23] == "Importing EML files in ":
+                                self.log(ErrorLevel.NORMAL, _("Importing EML files in %s") % line[23:])
+                            elif line[:19] == "Opening PST file - ":
+                                self.log(ErrorLevel.NORMAL, _("Importing EML files in %s") % line[19:])
+                            else:
+                                self.log(ErrorLevel.NORMAL, line)
 
-                    if (c % 20) == 0:
-                        if ph == 3:
-                            tl.title(_("Lotus Notes Converter - Phase 2/3 Export Message %d of %d (%.1f%%)") %
-                                     (c, ac, float(10.*(ac + 6.*c)/ac)))
-                        else:
-                            tl.title(_("Lotus Notes Converter - Phase 2/2 Import Message %d of %d (%.1f%%)") % (c, ac, float(10.*(ac + 9.*c)/ac)))
-                        self.update()
+                            if not self.running:
+                                # Interrupt the importation process
+                                process.terminate()
+                                terminating = True
 
-            if self.Format.get() == Format.MBOX and self.MBOXType.get() == SubdirectoryMBOX.YES:
-                f.close()
+                    # set returncode if the process has exited
+                    process.poll()
 
-        # If need to call EML2PST helper function run Phase 3
-        if self.Format.get() == Format.PST and self.EML2PST:
-            self.log(ErrorLevel.NORMAL, _("Starting importation of EML files into PST file"))
-            # Force Popen to not create a CMD windows. Don't use "Shell=True" as although
-            # not a security risk here (the user of NSF2X already has console access), but
-            # its use is discouraged.
-            CREATE_NO_WINDOW = 0x08000000
-            process = subprocess.Popen([self.EML2PST,
-                                        os.path.join(self.destPath, dest),
-                                        os.path.join(self.destPath, (dest + ".pst"))],
-                                       stdout=subprocess.PIPE,
-                                       stderr=subprocess.PIPE,
-                                       universal_newlines=True,
-                                       creationflags=CREATE_NO_WINDOW)
-
-            terminating = False
-            while process.returncode is None:
-                if not terminating:
-                    # handle output by direct access to stdout and stderr
-                    for line in process.stdout:
+                # Check if helper function quit with an error
+                if process.returncode:
+                    if not terminating:
+                        self.log(ErrorLevel.ERROR, _("Helper process return the error code (%d)") % process.returncode)
+                    for line in process.stderr:
                         if line.endswith('\n'):
                             line = line[:-1]
+                        self.log(ErrorLevel.ERROR, line)
+                    self.log(ErrorLevel.ERROR, _("Importation of EML files into PST is incomplete"))
 
-                        # Interpret the stdout line, allowing for translated strings
-                        if line[:18] == "Importing message ":
-                            c = int(line[18:])
-                            tl.title(_("Lotus Notes Converter - Phase 3/3 Import Message %d of %d (%.1f%%)") % (c, ac, float(10.*(7*ac + 3.*c)/ac)))
-                            self.update()
-                        elif line[:23] == "Importing EML files in ":
-                            self.log(ErrorLevel.NORMAL, _("Importing EML files in %s") % line[23:])
-                        elif line[:19] == "Opening PST file - ":
-                            self.log(ErrorLevel.NORMAL, _("Importing EML files in %s") % line[19:])
-                        else:
-                            self.log(ErrorLevel.NORMAL, line)
-
-                        if not self.running:
-                            # Interrupt the importation process
-                            process.terminate()
-                            terminating = True
-
-                # set returncode if the process has exited
-                process.poll()
-
-            # Check if helper function quit with an error
-            if process.returncode:
-                if not terminating:
-                    self.log(ErrorLevel.ERROR, _("Helper process return the error code (%d)") % process.returncode)
-                for line in process.stderr:
-                    if line.endswith('\n'):
-                        line = line[:-1]
-                    self.log(ErrorLevel.ERROR, line)
-                self.log(ErrorLevel.ERROR, _("Importation of EML files into PST is incomplete"))
-
-            # Remove the EML files and the directory structure
-            self.log(ErrorLevel.NORMAL, _("Removing temporary EML files"))
-            shutil.rmtree(os.path.join(self.destPath, dest))
-
-        # Alert user if there were too many exceptions
-        if e == nex:
-            self.log(ErrorLevel.ERROR, _("Too many exceptions during mail importation. Stopping"))
-
-        if self.Format.get() == Format.MBOX and self.MBOXType.get() == SubdirectoryMBOX.NO:
-            f.close()
-        self.log(ErrorLevel.NORMAL, _("Finished populating : %s") % dest)
-        self.log(ErrorLevel.NORMAL, _("Exceptions: %d ... Documents OK : %d Untreated : %d\n") %
-                 (e, c - e, max(0, ac - c)))
-
-        return True
+                # Remove the EML files and the directory structure
+                self.log(ErrorLevel.NORMAL, _("Removing temporary EML files"))
+                shutil.rmtree(os.path.join(self.destPath, dest))
+
+            # Alert user if there were too many exceptions
+            if e == nex:
+                self.log(ErrorLevel.ERROR, _("Too many exceptions during mail importation. Stopping"))
+
+            if self.Format.get() == Format.MBOX and self.MBOXType.get() == SubdirectoryMBOX.NO:
+                f.close()
+                journal.Commit()
+            elif archive is not None:
+                archive.Close()
+            elif manifest is not None:
+                manifest.Save()
+                if manifest.Count() > 1:
+                    self.log(ErrorLevel.NORMAL, _("Messages imported into %d PST files, listed in %s") %
+                             (manifest.Count(), manifest.path))
+            elif self.imap is not None:
+                e += self.RecordUploads(journal, self.imap.Flush())
+
+            # The offsets of the journal are those of the unsorted files, so only
+            # sort the files of a conversion that won't be resumed. The locations
+            # of the index, the catalog and the metadata are updated
+            if self.SortByDate.get() == SortByDate.YES and e == 0 and self.running:
+                moves = {}
+                for mbox in mboxes:
+                    moves.update(self.SortMBOX(mbox))
+                if moves:
+                    try:
+                        if self.index is not None:
+                            self.index.Relocate(moves)
+                        if self.exports is not None:
+                            self.exports.Relocate(moves)
+                        if meta is not None:
+                            meta.Relocate(moves)
+                    except OSError as ex:
+                        self.log(ErrorLevel.ERROR, _("Can not update the locations of the sorted messages : %s") % ex)
+
+            if self.Delta.get() == Delta.YES:
+                if e == 0 and self.running:
+                    state["until"] = until
+                    state["format"] = self.Format.get()
+                else:
+                    self.log(ErrorLevel.WARN, _("Conversion incomplete, the next delta will restart from %s") %
+                             state.get("until", _("the beginning")))
+            SaveState(statefile, state)
+            if self.index is not None:
+                self.index.Flush()
+            if self.exports is not None:
+                self.exports.Flush()
+            if meta is not None:
+                meta.Close()
+                self.log(ErrorLevel.NORMAL, _("Metadata of %d messages written to %s") % (meta.records, meta.path))
+            journal.Close(e == 0 and self.running)
+            if record:
+                trace = os.path.join(record, dest + ".trace.json.gz")
+                self.log(ErrorLevel.NORMAL, _("Saving the trace of the conversion to %s") % trace)
+                dBNotes._trace.Save(trace) # pylint: disable=W0212
+            if resumed > 0:
+                self.log(ErrorLevel.NORMAL, _("%d documents already exported by the previous conversion") % resumed)
+            self.log(ErrorLevel.NORMAL, _("Finished populating : %s") % dest)
+            self.log(ErrorLevel.NORMAL, _("Exceptions: %d ... Documents OK : %d Untreated : %d\n") %
+                     (e, c - e, max(0, ac - c)))
+
+            return e == 0 and self.running
+        finally:
+            # Also close the MBOX file, with its index and its compression
+            # threads, and the journal when the conversion stops early
+            if self.Format.get() == Format.MBOX and f is not None:
+                f.close()
+                journal.Commit()
+            journal.Close()
 
     def ConvertToMIME(self, doc, _NotesEntries):
         """Method to Convert NotesItem to MIME internally to the NSF file"""
         # Check if NoteID is empty before continuing and give more informative
         # error message
+        self.NotesStatus = None
         if doc.NoteID is None or doc.NoteID == '':
             self.log(ErrorLevel.ERROR, _("Notes message has empty NoteID"))
             return False
@@ -1184,113 +2558,152 @@ class Gui(tkinter.Frame):
                     _NotesEntries.NSFNoteClose(hNote)
                 raise
 
+        self.NotesStatus = stat
         return stat == 0
 
-    def WriteMIMEHeader(self, f, mime):
-        """Method to write MIME headers to EML file"""
-        if mime != None:
-            headers = mime.Headers
-            encoding = mime.Encoding
-
-            # if it's a binary part, force it to b64
-            if encoding == 1730 or encoding == 1729:
-                # MIMEEntity.ENC_IDENTITY_BINARY and MIMEEntity.ENC_IDENTITY_8BIT
-                mime.EncodeContent(1727)  # MIMEEntity.ENC_BASE64
-                headers = mime.Headers
-
-            # Place the From and Date fields first to simplify conversion to MBOX format
-            if self.Format.get() == Format.MBOX:
-                content = mime.GetSomeHeaders(['From'], True)
-                if content.startswith('From: '):
-                    _from = content[6:]
-                elif content.startswith('From:'):
-                    _from = content[5:]
-                else:
-                    _from = content
-                if _from.endswith('\n'):
-                    _from = _from[:-1]
-                content = mime.GetSomeHeaders(['Date'], True)
-                if content.startswith('Date: '):
-                    _date = content[6:]
-                elif content.startswith('Date:'):
-                    _date = content[5:]
-                else:
-                    _date = content
-                if _date.endswith('\n'):
-                    _date = _date[:-1]
-                mboxheader = 'From ' + _from + ' ' + _date+ '\n'
-                f.write(mboxheader.encode('utf-8'))
-
-            # message envelope. If no MIME-Version header, add one
-            if "MIME-Version:" not in headers:
-                f.write(b"MIME-Version: 1.0\n")
-
-            # Write the rest of the headers, but exclude the MIME content-type to be placed last
-            content = mime.GetSomeHeaders(["Content-type"], False)
-            # Some of the text might be in utf-8 so give it special treatment
-            f.write(content.encode('utf-8'))
-            if not content.endswith('\n'):
-                f.write(b'\n')
-
-    def WriteMIMEChildren(self, f, mime, first):
-        """Iterate over children of MIME object"""
-        if mime != None:
-            contentType = mime.ContentType
-            headers = mime.Headers
-            encoding = mime.Encoding
-
-            # if it's a binary part, force it to b64
-            if encoding == 1730 or encoding == 1729:
-                # MIMEEntity.ENC_IDENTITY_BINARY and MIMEEntity.ENC_IDENTITY_8BIT
-                mime.DecodeContent()
-                mime.EncodeContent(1727)  # MIMEEntity.ENC_BASE64
-                headers = mime.Headers
-
-            if first:
-                content = mime.GetSomeHeaders(["Content-type"], True)
-                f.write(content.encode('utf-8'))
-                if not content.endswith('\n'):
-                    f.write(b'\n')
+    def Retrying(self, error, attempt, what):
+        """Method to decide if an operation that failed with error, a Notes status
+        code or a COM exception, is retried. If so, waits before the retry while
+        still treating the events of the GUI, so that the conversion can be
+        stopped during the wait"""
+        if self.Retry.get() == Retry.NO or attempt >= RetryAttempts or not self.running:
+            return False
+        if not IsTransient(error):
+            return False
+        delay = RetryDelay * 2 ** attempt
+        self.log(ErrorLevel.WARN, _("Transient error for %s (%s). Retrying in %d seconds") %
+                 (what, error, delay))
+        deadline = time.time() + delay
+        waited = tkinter.BooleanVar(self, False)
+        def tick():
+            if not self.running or time.time() >= deadline:
+                waited.set(True)
             else:
-                f.write(headers.encode('utf-8'))
-                if not headers.endswith('\n'):
-                    f.write(b'\n')
-
-            f.write(b'\n')
-            content = mime.ContentAsText
-            if content != None:
-                f.write(content.encode('utf-8'))
-                if not content.endswith('\n'):
-                    f.write(b'\n')
-
-            f.flush()
+                self.after(100, tick)
+        self.after(100, tick)
+        self.wait_variable(waited)
+        return self.running
+
+    def RetryConvertToMIME(self, doc, _NotesEntries, path):
+        """Method calling ConvertToMIME and retrying after transient errors with a
+        reloaded C API. Returns the result of ConvertToMIME and the NotesEntries
+        instance to use for the following documents"""
+        attempt = 0
+        while True:
+            try:
+                if self.ConvertToMIME(doc, _NotesEntries):
+                    return True, _NotesEntries
+                if not self.Retrying(self.NotesStatus, attempt, _("note id 0x%s") % doc.NoteID):
+                    return False, _NotesEntries
+            except pywintypes.com_error as ex: # pylint: disable=E1101
+                if not self.Retrying(ex, attempt, _("note id 0x%s") % doc.NoteID):
+                    raise
+            attempt += 1
+
+            # Reload nnotes.dll and reopen the database with the C API
+            self.log(ErrorLevel.INFO, _("Reopening Lotus database %s with C API") % path)
+            _NotesEntries.NSFDbClose()
+            _NotesEntries = NotesEntries()
+            stat = _NotesEntries.NSFDbOpen(path)
+            if stat != 0:
+                raise ValueError(_("Can not open Lotus database %s with C API (ErrorID %d)") %
+                                 (path, stat))
+
+    def OpenPST(self, dest, n):
+        """Method to open the n-th PST file of a conversion, creating it if it
+        doesn't exist. Returns its path, the display name of its message store
+        and its MAPI root folder"""
+        store = PSTName(dest, n)
+        pst = os.path.join(self.destPath, store + ".pst")
+
+        # Can't guarantee that MAPISVC.INF contains the service "MSPST MS" and so
+        # can't use MAPI to create PST. This is now the only place the Outlook
+        # Object Model is used, and it would be great to get rid of it.
+        try:
+            Outlook = win32com.client.Dispatch(r'Outlook.Application')
+        except pywintypes.com_error as ex: # pylint: disable=E1101
+            self.log(ErrorLevel.ERROR, _("Could not connect to Outlook !"))
+            self.log(ErrorLevel.ERROR, _("Exception %s :") % ex)
+            Outlook = None
+        ns = Outlook.GetNamespace(r'MAPI')
+        self.log(ErrorLevel.NORMAL, _("Opening PST file - %s") % pst)
+        ns.AddStore(pst)
+        rootFolder = ns.Folders.GetLast()
+        rootFolder.Name = store
+
+        # Reopen the message store created with OOM and only use MAPI from here
+        # on out.
+        try:
+            MAPI = mapiex.mapi()
+            MAPI.OpenMessageStore(store)
+            return pst, store, MAPI.OpenRootFolder()
+        except Exception as ex:
+            self.log(ErrorLevel.ERROR, _("Could not connect to MAPI !"))
+            self.log(ErrorLevel.ERROR, _("Exception %s :") % ex)
+            raise
+
+    def PSTFull(self, pst, eml, messages):
+        """Method to test if importing the EML file into the PST file would take
+        it over the limits on its size or on its number of messages"""
+        maxsize, maxmessages = self.pstlimits
+        if maxmessages is not None and messages >= maxmessages:
+            return True
+        if maxsize is not None and messages > 0:
+            return os.path.getsize(pst) + os.path.getsize(eml) > maxsize
+        return False
 
-            if contentType.startswith("multipart"):
-                try:
-                    # The preamble attribute might not exist
-                    content = mime.preamble
-                    if content != "":
-                        f.write(content.encode('utf-8'))
-                        if not content.endswith('\n'):
-                            f.write(b'\n')
-                except AttributeError:
-                    pass
-
-                child = mime.GetFirstChildEntity()
-                while child != None:
-                    content = child.BoundaryStart
-                    f.write(content.encode('utf-8'))
-                    if not content.endswith('\n'):
-                        f.write(b'\n')
-
-                    self.WriteMIMEChildren(f, child, False)
-
-                    content = child.BoundaryEnd
-                    f.write(content.encode('utf-8'))
-                    if not content.endswith('\n'):
-                        f.write(b'\n')
-
-                    child = child.GetNextSibling()
+    def RetryImportEML(self, pstfld, eml, dest, name):
+        """Method to import an EML file into a PST folder, retrying after transient
+        errors with a new MAPI session. Returns the PST folder to use for the
+        following messages"""
+        attempt = 0
+        while True:
+            try:
+                pstfld.ImportEML(eml)
+                return pstfld
+            except pywintypes.com_error as ex: # pylint: disable=E1101
+                if not self.Retrying(ex, attempt, eml):
+                    raise
+            attempt += 1
+
+            self.log(ErrorLevel.INFO, _("Reopening the MAPI session"))
+            MAPI = mapiex.mapi()
+            MAPI.OpenMessageStore(dest)
+            pstfld = MAPI.OpenRootFolder().CreateSubFolder(name)
+
+    def RetryWriteMIMEOutput(self, f, doc):
+        """Method calling WriteMIMEOutput and rewriting the message after transient
+        COM errors"""
+        start = f.tell()
+        attempt = 0
+        while True:
+            try:
+                return self.WriteMIMEOutput(f, doc)
+            except pywintypes.com_error as ex: # pylint: disable=E1101
+                if not self.Retrying(ex, attempt, _("note id 0x%s") % doc.NoteID):
+                    raise
+            attempt += 1
+
+            # Discard the part of the message already written
+            f.seek(start)
+            f.truncate(start)
+
+    def WriteEncrypted(self, f_mime, mime, streamer):
+        """Method writing the body of a message as an S/MIME enveloped part. The
+        body is written to an encryption session of the encryptor rather than
+        to memory, and the envelope is streamed to the output. The attachments
+        of an encrypted message are never written in clear to the store"""
+        session = self.encryptor.Open()
+        store = streamer.store if streamer is not None else None
+        if store is not None:
+            streamer.store = None
+        try:
+            mimewriter.WriteMIMEChildren(session, mime, True, streamer)
+            self.encryptor.WriteEnvelope(f_mime, session)
+        finally:
+            session.Close()
+            if store is not None:
+                streamer.store = store
 
     def WriteMIMEOutput(self, f_mime, doc):
         """Write MIME Output to EML file"""
@@ -1298,121 +2711,97 @@ class Gui(tkinter.Frame):
             # Get first Body item with a MIME encoding
             mime = doc.GetMIMEEntity("Body")
             if mime != None:
-                self.WriteMIMEHeader(f_mime, mime)
+                # The streamer reads the parts that aren't text and encodes the
+                # binary parts without modifying the document. The recording of
+                # a trace needs the content of all parts, so don't use it then
+                streamer = None if os.environ.get("NSF2X_RECORD") else self.streamer
                 if self.Encrypt.get() == EncryptionType.NONE:
-                    self.WriteMIMEChildren(f_mime, mime, True)
+                    # Write the whole message at once, except for large parts
+                    mimewriter.WriteMIMEMessage(f_mime, mime, self.Format.get() == Format.MBOX,
+                                                self.resolver, streamer)
                 else:
+                    mimewriter.WriteMIMEHeader(f_mime, mime, self.Format.get() == Format.MBOX,
+                                               self.resolver, streamer)
                     enc = doc.GetFirstItem("Encrypt")
                     if enc != None and enc.Text == '1':
-                        # See https://msdn.microsoft.com/en-us/library/windows/desktop/aa382376(v=vs.85).aspx
-                        # Note that the PROV_RSA_AES provider supplies RC2, RC4 and
-                        # AES encryption whereas as the PROV_RSA_FULL provider only
-                        # gives RC2 and RC4 encryption. Try all possible combinations
-                        # of providers to try and get a valid provider. Don't try and
-                        # create a new provider however as we want a key that the user
-                        # actually uses.
-                        if not self.hCryptoProv:
-                            # Loop through the various provider names, that are
-                            # associated with PROV_RSA_AES
-                            for prov in (win32cryptcon.MS_ENH_RSA_AES_PROV, None):
-                                try:
-                                    # pylint: disable=E1101
-                                    self.hCryptoProv = win32crypt.CryptAcquireContext(None, prov, win32cryptcon.PROV_RSA_AES, win32cryptcon.CRYPT_SILENT)
-                                    break
-                                except OSError as ex:
-                                    self.log(ErrorLevel.ERROR, _("Exception : %s"), ex)
-
+                        if os.environ.get("NSF2X_SMIME_CERT") and self.encryptor is None:
+                            # Encrypt with openssl for the PEM certificate given
+                            self.encryptor = smime.Encryptor(smime.OpenSSLBackend(os.environ["NSF2X_SMIME_CERT"],
+                                                                                  EncryptionAlgorithms[self.Encrypt.get()]))
+                        if self.encryptor is not None:
+                            self.WriteEncrypted(f_mime, mime, streamer)
+                        else:
+                            # See https://msdn.microsoft.com/en-us/library/windows/desktop/aa382376(v=vs.85).aspx
+                            # Note that the PROV_RSA_AES provider supplies RC2, RC4 and
+                            # AES encryption whereas as the PROV_RSA_FULL provider only
+                            # gives RC2 and RC4 encryption. Try all possible combinations
+                            # of providers to try and get a valid provider. Don't try and
+                            # create a new provider however as we want a key that the user
+                            # actually uses.
                             if not self.hCryptoProv:
-                                if self.Encrypt.get() == EncryptionType.AES128 or self.Encrypt.get() == EncryptionType.AES256:
-                                    self.log(ErrorLevel.ERROR, _("Windows cryptographic provider does not support AES encryption"))
-                                    self.log(ErrorLevel.ERROR, _("Falling back to 3DES 168bit encryption"))
-                                    self.Encrypt.set(EncryptionType.DES)
-
-                                # Loop through the various provider names, that
-                                # are associated with PROV_RSA_FULL
-                                for prov in (win32cryptcon.MS_ENHANCED_PROV,
-                                             win32cryptcon.MS_STRONG_PROV,
-                                             win32cryptcon.MS_DEF_PROV, None):
+                                # Loop through the various provider names, that are
+                                # associated with PROV_RSA_AES
+                                for prov in (win32cryptcon.MS_ENH_RSA_AES_PROV, None):
                                     try:
                                         # pylint: disable=E1101
-                                        self.hCryptoProv = win32crypt.CryptAcquireContext(None, prov, win32cryptcon.PROV_RSA_FULL, win32cryptcon.CRYPT_SILENT)
+                                        self.hCryptoProv = win32crypt.CryptAcquireContext(None, prov, win32cryptcon.PROV_RSA_AES, win32cryptcon.CRYPT_SILENT)
                                         break
                                     except OSError as ex:
                                         self.log(ErrorLevel.ERROR, _("Exception : %s"), ex)
 
-                            if not self.hCryptoProv:
-                                self.log(ErrorLevel.ERROR,
-                                         _("Can not open Windows cryptographic provider"))
-
-                        if self.hCryptoProv and not self.certificate:
-                            # pylint: disable=E1101
-                            hstorehandle = win32crypt.CertOpenSystemStore("MY", self.hCryptoProv)
-
-                            for cert in hstorehandle.CertEnumCertificatesInStore():
-                                try:
-                                    (certtype, dummy_privcert) = cert.CryptAcquireCertificatePrivateKey(win32cryptcon.CRYPT_ACQUIRE_SILENT_FLAG)
-                                    if certtype == win32cryptcon.AT_KEYEXCHANGE:
-                                        # Ok we have the users key as we can access both
-                                        # the public and private keys and the key is flagged
-                                        # for use with Exchange
-                                        self.certificate = cert
-                                        break
-                                except OSError:
-                                    pass
+                                if not self.hCryptoProv:
+                                    if self.Encrypt.get() == EncryptionType.AES128 or self.Encrypt.get() == EncryptionType.AES256:
+                                        self.log(ErrorLevel.ERROR, _("Windows cryptographic provider does not support AES encryption"))
+                                        self.log(ErrorLevel.ERROR, _("Falling back to 3DES 168bit encryption"))
+                                        self.Encrypt.set(EncryptionType.DES)
+
+                                    # Loop through the various provider names, that
+                                    # are associated with PROV_RSA_FULL
+                                    for prov in (win32cryptcon.MS_ENHANCED_PROV,
+                                                 win32cryptcon.MS_STRONG_PROV,
+                                                 win32cryptcon.MS_DEF_PROV, None):
+                                        try:
+                                            # pylint: disable=E1101
+                                            self.hCryptoProv = win32crypt.CryptAcquireContext(None, prov, win32cryptcon.PROV_RSA_FULL, win32cryptcon.CRYPT_SILENT)
+                                            break
+                                        except OSError as ex:
+                                            self.log(ErrorLevel.ERROR, _("Exception : %s"), ex)
+
+                                if not self.hCryptoProv:
+                                    self.log(ErrorLevel.ERROR,
+                                             _("Can not open Windows cryptographic provider"))
 
-                            if not self.certificate:
-                                self.log(ErrorLevel.ERROR,
-                                         _("Could not obtain the users Exchange certificate."))
+                            if self.hCryptoProv and not self.certificate:
+                                # pylint: disable=E1101
+                                hstorehandle = win32crypt.CertOpenSystemStore("MY", self.hCryptoProv)
 
-                        if not self.hCryptoProv or not self.certificate:
-                            self.log(ErrorLevel.ERROR, _("Disabling all encryption !!"))
-                            self.WriteMIMEChildren(f_mime, mime, True)
-                            self.Encrypt.set(EncryptionType.NONE)
-                        else:
-                            f_smime = io.BytesIO()
-                            self.WriteMIMEChildren(f_smime, mime, True)
-
-                            encodingtype = win32cryptcon.PKCS_7_ASN_ENCODING | win32cryptcon.X509_ASN_ENCODING
-
-                            if self.Encrypt.get() == EncryptionType.RC2CBC:
-                                encryptalgorithm = {"ObjId" :
-                                                    win32cryptcon.szOID_RSA_RC2CBC,
-                                                    "Parameters" : None}
-                            elif self.Encrypt.get() == EncryptionType.DES:
-                                encryptalgorithm = {"ObjId" :
-                                                    win32cryptcon.szOID_RSA_DES_EDE3_CBC,
-                                                    "Parameters" : None}
-                            elif self.Encrypt.get() == EncryptionType.AES128:
-                                # Why does win32cryptcon not define szOID_NIST_AES128_CBC
-                                # and szOID_NIST_AES256_CBC ???
-                                # szOID_NIST_AES128_CBC = "2.16.840.1.101.3.4.1.2"
-                                # szOID_NIST_AES256_CBC = "2.16.840.1.101.3.4.1.42"
-                                encryptalgorithm = {"ObjId" : "2.16.840.1.101.3.4.1.2",
-                                                    "Parameters" : None}
-                            elif self.Encrypt.get() == EncryptionType.AES256:
-                                encryptalgorithm = {"ObjId" : "2.16.840.1.101.3.4.1.42",
-                                                    "Parameters" : None}
+                                for cert in hstorehandle.CertEnumCertificatesInStore():
+                                    try:
+                                        (certtype, dummy_privcert) = cert.CryptAcquireCertificatePrivateKey(win32cryptcon.CRYPT_ACQUIRE_SILENT_FLAG)
+                                        if certtype == win32cryptcon.AT_KEYEXCHANGE:
+                                            # Ok we have the users key as we can access both
+                                            # the public and private keys and the key is flagged
+                                            # for use with Exchange
+                                            self.certificate = cert
+                                            break
+                                    except OSError:
+                                        pass
+
+                                if not self.certificate:
+                                    self.log(ErrorLevel.ERROR,
+                                             _("Could not obtain the users Exchange certificate."))
+
+                            if not self.hCryptoProv or not self.certificate:
+                                self.log(ErrorLevel.ERROR, _("Disabling all encryption !!"))
+                                mimewriter.WriteMIMEChildren(f_mime, mime, True, streamer)
+                                self.Encrypt.set(EncryptionType.NONE)
                             else:
-                                # This shouldn't be possible
-                                raise NameError(_("Unrecognised encryption selected"))
-
-                            encryptparams = {"MsgEncodingType" : encodingtype, "CryptProv" :
-                                             self.hCryptoProv, "ContentEncryptionAlgorithm" :
-                                             encryptalgorithm}
-                            # pylint: disable=E1101
-                            blob = win32crypt.CryptEncryptMessage(encryptparams,
-                                                                  [self.certificate],
-                                                                  f_smime.getvalue())
-
-                            f_mime.write(b'Content-Type: application/x-pkcs7-mime;smime-type=enveloped-data;name="smime.p7m"\n')
-                            f_mime.write(b'Content-Transfer-Encoding: base64\n')
-                            f_mime.write(b'Content-Disposition: attachment;filename="smime.p7m"\n')
-                            f_mime.write(b'\n')
-
-                            f_mime.write(codecs.encode(blob, "base64"))
-                            f_smime.close()
+                                if self.encryptor is None:
+                                    self.encryptor = smime.Encryptor(smime.CryptoAPIBackend(self.hCryptoProv, self.certificate,
+                                                                                            EncryptionAlgorithms[self.Encrypt.get()]))
+                                self.WriteEncrypted(f_mime, mime, streamer)
                     else:
-                        self.WriteMIMEChildren(f_mime, mime, True)
+                        mimewriter.WriteMIMEChildren(f_mime, mime, True, streamer)
                 return True
             else:
                 self.log(ErrorLevel.WARN, _("Message 0x%s has no MIME body") % doc.NoteID)
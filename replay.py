@@ -0,0 +1,361 @@
+# -*- coding: utf-8 -*-
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+# Copyright (C) 2016 Free Software Foundation
+# Author : David Bateman <dbateman@free.fr>
+
+"""Recording and replay of the Notes COM objects used by NSF2X.
+
+Recorder wraps a COM object, and the objects it returns, and records every
+property read and method call with its result and duration in a Trace. The
+trace is saved as gzipped JSON. Replayer gives back objects that return the
+recorded results in the same order, waiting for the recorded durations, so
+that the export code can be profiled on a machine without Notes. For example
+
+    python replay.py trace.json.gz [mbox] [latency]
+
+replays the export of the messages of a recorded database with mimewriter.py
+and prints the time taken. The traces contain the full text of the messages.
+The export of synthetic messages can also be measured with
+
+    python replay.py synthetic [messages] [parts] [size] [certificate]
+
+where the messages are encrypted for the PEM certificate, if one is given.
+"""
+
+# Ignore variable/function/Method naming conventions of PEP8. I like my names
+# pylint: disable=C0103
+
+import base64
+import datetime
+import email.mime.application
+import email.mime.multipart
+import email.mime.text
+import gzip
+import json
+import os
+import sys
+import tempfile
+import time
+
+import fakenotes
+import mimewriter
+import smime
+
+class Trace(object):
+    """Recorded results of the calls to a tree of COM objects. The object 0 is
+    the root object. For each object the results are stored by call, a call
+    being a property name or a method name with its arguments"""
+    def __init__(self, objects=None):
+        """Trace initialisation method"""
+        self.objects = objects if objects is not None else [{}]
+
+    def NewObject(self):
+        """Method returning the number of a new recorded object"""
+        self.objects.append({})
+        return len(self.objects) - 1
+
+    def Add(self, obj, call, result, elapsed):
+        """Method to record the result of a call on the object obj"""
+        self.objects[obj].setdefault(call, []).append([result, round(elapsed, 6)])
+
+    def Save(self, path):
+        """Method to save the trace to a gzipped JSON file"""
+        with gzip.open(path, "wt", encoding="utf-8") as f:
+            json.dump({"version" : 1, "objects" : self.objects}, f, separators=(",", ":"))
+
+def LoadTrace(path):
+    """Function to read a trace saved with Trace.Save"""
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        data = json.load(f)
+    if data.get("version") != 1:
+        raise ValueError("Unsupported trace file %s" % path)
+    return Trace(data["objects"])
+
+def ArgumentKey(arg):
+    """Function returning the value of an argument in the key of a call"""
+    if isinstance(arg, (Recorder, Replayer)):
+        return {"o" : arg._obj}
+    if isinstance(arg, (tuple, list)):
+        return [ArgumentKey(a) for a in arg]
+    if hasattr(arg, "_oleobj_"):
+        # A COM object that wasn't obtained from the recorded objects
+        return {"o" : None}
+    return arg
+
+def CallKey(name, args=None):
+    """Function returning the key of a call in the trace"""
+    if args is None:
+        return name
+    return name + json.dumps([ArgumentKey(a) for a in args], separators=(",", ":"), default=str)
+
+class Recorder(object):
+    """Wrapper of a COM object recording its use in a Trace"""
+    def __init__(self, target, trace=None, obj=0):
+        """Recorder initialisation method"""
+        self.__dict__["_target"] = target
+        self.__dict__["_trace"] = trace if trace is not None else Trace()
+        self.__dict__["_obj"] = obj
+
+    def _encode(self, value):
+        """Method converting a result to a JSON value, wrapping COM objects"""
+        if value is None or isinstance(value, (bool, int, float, str)):
+            return value, value
+        if isinstance(value, Recorder):
+            return {"o" : value._obj}, value
+        if hasattr(value, "_oleobj_"):
+            wrapped = Recorder(value, self._trace, self._trace.NewObject())
+            return {"o" : wrapped._obj}, wrapped
+        if isinstance(value, datetime.datetime):
+            return {"d" : value.isoformat()}, value
+        if isinstance(value, bytes):
+            return {"b" : base64.b64encode(value).decode("ascii")}, value
+        if isinstance(value, (tuple, list)):
+            pairs = [self._encode(v) for v in value]
+            return {"t" : [p[0] for p in pairs]}, tuple(p[1] for p in pairs)
+        return str(value), value
+
+    def _call(self, name, method):
+        def call(*args):
+            key = CallKey(name, args)
+            args = [a._target if isinstance(a, Recorder) else a for a in args]
+            start = time.perf_counter()
+            result = method(*args)
+            elapsed = time.perf_counter() - start
+            encoded, result = self._encode(result)
+            self._trace.Add(self._obj, key, encoded, elapsed)
+            return result
+        return call
+
+    def __getattr__(self, name):
+        start = time.perf_counter()
+        try:
+            value = getattr(self._target, name)
+        except AttributeError:
+            # Record the missing attribute, so the replay raises it as well
+            self._trace.Add(self._obj, CallKey(name), {"e" : None}, 0.)
+            raise
+        elapsed = time.perf_counter() - start
+        if callable(value) and not hasattr(value, "_oleobj_"):
+            return self._call(name, value)
+        encoded, value = self._encode(value)
+        self._trace.Add(self._obj, CallKey(name), encoded, elapsed)
+        return value
+
+    def __setattr__(self, name, value):
+        setattr(self._target, name, value)
+
+class Replayer(object):
+    """Object returning the results recorded in a Trace for an object. The
+    results of a call are returned in the order they were recorded, and the
+    last one is repeated if the call is made more often than recorded"""
+    def __init__(self, trace, obj=0, clock=None, replayers=None):
+        """Replayer initialisation method"""
+        self.__dict__["_trace"] = trace
+        self.__dict__["_obj"] = obj
+        self.__dict__["_clock"] = clock if clock is not None else Clock()
+        self.__dict__["_position"] = {}
+        # The replayers of all the objects of the trace, so that an object
+        # returned several times keeps its position in the trace
+        self.__dict__["_replayers"] = replayers if replayers is not None else {obj : self}
+
+    def _decode(self, value):
+        """Method converting a JSON value of the trace to a result"""
+        if isinstance(value, dict):
+            if "o" in value:
+                obj = value["o"]
+                if obj not in self._replayers:
+                    self._replayers[obj] = Replayer(self._trace, obj, self._clock,
+                                                    self._replayers)
+                return self._replayers[obj]
+            if "d" in value:
+                return datetime.datetime.strptime(value["d"][:19], "%Y-%m-%dT%H:%M:%S")
+            if "b" in value:
+                return base64.b64decode(value["b"])
+            if "t" in value:
+                return tuple(self._decode(v) for v in value["t"])
+            if "e" in value:
+                raise AttributeError("Missing attribute of object %d" % self._obj)
+        return value
+
+    def _result(self, key):
+        results = self._trace.objects[self._obj].get(key)
+        if not results:
+            raise AttributeError("%s was not recorded for object %d" % (key, self._obj))
+        i = self._position.get(key, 0)
+        self._position[key] = i + 1
+        value, elapsed = results[min(i, len(results) - 1)]
+        self._clock.Wait(elapsed)
+        return self._decode(value)
+
+    def __getattr__(self, name):
+        key = CallKey(name)
+        if key in self._trace.objects[self._obj]:
+            return self._result(key)
+        def call(*args):
+            return self._result(CallKey(name, args))
+        return call
+
+    def __setattr__(self, name, value):
+        pass
+
+class Clock(object):
+    """Reproduction of the recorded durations of the calls. Durations shorter
+    than the resolution of time.sleep are accumulated"""
+    def __init__(self, scale=1.):
+        """Clock initialisation method"""
+        self.scale = scale
+        self.debt = 0.
+        self.total = 0.
+
+    def Wait(self, elapsed):
+        """Method to wait for the recorded duration of a call"""
+        if self.scale <= 0:
+            return
+        self.debt += elapsed * self.scale
+        self.total += elapsed * self.scale
+        if self.debt >= 0.001:
+            start = time.perf_counter()
+            time.sleep(self.debt)
+            self.debt -= time.perf_counter() - start
+
+class CountingFile(object):
+    """Unbuffered file counting the calls to write and flush, each write being
+    a system call"""
+    def __init__(self, path):
+        """CountingFile initialisation method"""
+        self.f = open(path, "wb", buffering=0)
+        self.writes = 0
+        self.flushes = 0
+        self.size = 0
+
+    def write(self, data):
+        """Method to write data to the file"""
+        self.writes += 1
+        self.size += len(data)
+        return self.f.write(data)
+
+    def flush(self):
+        """Method to flush the file"""
+        self.flushes += 1
+        self.f.flush()
+
+    def tell(self):
+        """Method returning the position in the file"""
+        return self.f.tell()
+
+    def close(self):
+        """Method to close the file"""
+        self.f.close()
+
+def Export(db, mbox=False, streamer=None, encryptor=None):
+    """Function exporting the messages of a database to a temporary MBOX file,
+    in the manner of Phase 2 of NSF2X. If encryptor isn't None the bodies are
+    encrypted with it. Returns the number of messages, the number of bytes,
+    writes and flushes, the time taken and the peak memory"""
+    (fd, path) = tempfile.mkstemp(suffix=".mbox")
+    os.close(fd)
+    f = CountingFile(path)
+    n = 0
+    start = time.perf_counter()
+    try:
+        for fld in db.Views:
+            if not (fld.Name == "($Sent)" or fld.IsFolder):
+                continue
+            doc = fld.GetFirstDocument()
+            while doc:
+                mime = doc.GetMIMEEntity("Body")
+                if mime != None:
+                    if encryptor is None:
+                        mimewriter.WriteMIMEMessage(f, mime, mbox, None, streamer)
+                    else:
+                        mimewriter.WriteMIMEHeader(f, mime, mbox, None, streamer)
+                        session = encryptor.Open()
+                        try:
+                            mimewriter.WriteMIMEChildren(session, mime, True, streamer)
+                            encryptor.WriteEnvelope(f, session)
+                        finally:
+                            session.Close()
+                    f.write(b"\n")
+                    f.flush()
+                    n += 1
+                doc = fld.GetNextDocument(doc)
+        elapsed = time.perf_counter() - start
+    finally:
+        f.close()
+        os.remove(path)
+    return n, f.size, f.writes, f.flushes, elapsed, mimewriter.PeakMemory()
+
+def Benchmark(path, mbox=False, latency=1.):
+    """Function replaying the export of the messages of a recorded database.
+    Returns the result of Export and the recorded time of the calls"""
+    clock = Clock(latency)
+    db = Replayer(LoadTrace(path), 0, clock)
+    return Export(db, mbox) + (clock.total,)
+
+def SyntheticMessage(parts, size=2000):
+    """Function returning a message with a multipart/alternative body and parts
+    attachments of size bytes"""
+    msg = email.mime.multipart.MIMEMultipart("mixed")
+    msg["From"] = "sender@example.com"
+    msg["To"] = "recipient@example.com"
+    msg["Date"] = "Mon, 01 Jan 2018 00:00:00 +0000"
+    msg["Subject"] = "Synthetic message"
+    body = email.mime.multipart.MIMEMultipart("alternative")
+    body.attach(email.mime.text.MIMEText("Synthetic body\n" * 50))
+    body.attach(email.mime.text.MIMEText("<p>Synthetic body</p>\n" * 50, "html"))
+    msg.attach(body)
+    for i in range(parts):
+        msg.attach(email.mime.application.MIMEApplication(bytes(bytearray(j % 256 for j in range(size)))))
+    return msg.as_bytes()
+
+def SyntheticBenchmark(messages=1000, parts=10, size=2000, mbox=True, certificate=None):
+    """Function exporting a database of synthetic messages with fakenotes.py,
+    streaming the parts larger than mimewriter.StreamThreshold. If certificate
+    isn't None the messages are encrypted for this PEM certificate with
+    openssl. Returns the result of Export"""
+    rfc822 = SyntheticMessage(parts, size)
+    db = fakenotes.Database("", [("Inbox", "%x" % (i + 1), rfc822) for i in range(messages)])
+    encryptor = None
+    if certificate:
+        encryptor = smime.Encryptor(smime.OpenSSLBackend(certificate))
+    try:
+        return Export(db, mbox, mimewriter.Streamer(fakenotes.Stream), encryptor)
+    finally:
+        if encryptor is not None:
+            encryptor.Close()
+
+def Report(result):
+    """Function printing the result of Export per message"""
+    n = max(result[0], 1)
+    print("Messages : %d, bytes : %d, writes/message : %.1f, flushes/message : %.1f, time/message : %.1fus" %
+          (result[0], result[1], float(result[2]) / n, float(result[3]) / n, 1.e6 * result[4] / n))
+    if result[5] is not None:
+        print("Peak memory : %.1f MB" % (result[5] / 1048576.))
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        raise OSError("replay [traceFile] [mbox] [latency]\n       replay synthetic [messages] [parts] [size] [certificate]")
+    if sys.argv[1] == "synthetic":
+        Report(SyntheticBenchmark(int(sys.argv[2]) if len(sys.argv) > 2 else 1000,
+                                  int(sys.argv[3]) if len(sys.argv) > 3 else 10,
+                                  int(sys.argv[4]) if len(sys.argv) > 4 else 2000,
+                                  True, sys.argv[5] if len(sys.argv) > 5 else None))
+    else:
+        result = Benchmark(sys.argv[1], "mbox" in sys.argv[2:3],
+                           float(sys.argv[3]) if len(sys.argv) > 3 else 1.)
+        Report(result)
+        print("Recorded time of the Notes calls : %.3fs" % result[6])
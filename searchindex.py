@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+# Copyright (C) 2016 Free Software Foundation
+# Author : David Bateman <dbateman@free.fr>
+
+"""Full-text index of the messages exported by NSF2X.
+
+SearchIndex writes the messages to an SQLite database with an FTS5 index of
+their subject, sender, recipients and plain-text body. The table messages
+holds one row per message, identified by the name of the NSF file, the folder
+and the NoteID, as a document can be in several folders, with the UNID, the
+date in seconds since the epoch and the location of the message in the
+output. The FTS5 table text has the same rowid as the row of the message. A
+message exported again to a folder replaces its row.
+
+The rows are inserted by a separate thread with sqlitewriter, in a
+transaction per batch of BatchRows messages, so that the export doesn't wait
+for SQLite. The index can be queried from the command line with
+
+  python searchindex.py [index] [query] [limit]
+
+where query is in the FTS5 syntax, for example 'subject:budget AND smith'.
+"""
+
+# Ignore variable/function/Method naming conventions of PEP8. I like my names
+# pylint: disable=C0103
+
+import binascii
+import email.errors
+import email.header
+import html
+import re
+import sqlite3
+import sys
+import time
+
+import sqlitewriter
+
+# Messages inserted in a single transaction
+BatchRows = sqlitewriter.BatchRows
+
+# Characters of the body kept in the index
+MaxBody = 1 << 20
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (id INTEGER PRIMARY KEY, mailbox TEXT, folder TEXT,
+  noteid TEXT, unid TEXT, date INTEGER, subject TEXT, sender TEXT, recipients TEXT,
+  location TEXT, UNIQUE (mailbox, folder, noteid));
+CREATE INDEX IF NOT EXISTS messages_date ON messages (date);
+CREATE VIRTUAL TABLE IF NOT EXISTS text USING fts5(subject, sender, recipients, body,
+  tokenize = 'unicode61 remove_diacritics 2');
+"""
+
+_TAG = re.compile(r"(?is)<(script|style)\b.*?</\1\s*>|<[^>]*>")
+
+def Header(mime, names):
+    """Function returning the decoded value of the headers names of a MIME
+    entity, separated by ", " """
+    values = []
+    for line in re.split(r"\n(?![ \t])", mime.GetSomeHeaders(names, True)):
+        value = line.partition(":")[2].strip()
+        if not value:
+            continue
+        try:
+            value = str(email.header.make_header(email.header.decode_header(value)))
+        except (LookupError, UnicodeError, ValueError, email.errors.HeaderParseError):
+            pass
+        values.append(" ".join(value.split()))
+    return ", ".join(values)
+
+def _text(mime):
+    """Function returning the decoded text of a text part"""
+    content = mime.ContentAsText or ""
+    encoding = mime.Encoding
+    try:
+        if encoding == 1726:   # MIMEEntity.ENC_QUOTED_PRINTABLE
+            data = binascii.a2b_qp(content.encode("ascii", "replace"))
+        elif encoding == 1727: # MIMEEntity.ENC_BASE64
+            data = binascii.a2b_base64(content.encode("ascii", "replace"))
+        else:
+            return content
+    except binascii.Error:
+        return content
+    match = re.search(r'(?i)charset="?([^";\s]+)', mime.GetSomeHeaders(["Content-Type"], True))
+    try:
+        return data.decode(match.group(1) if match else "utf-8", "replace")
+    except LookupError:
+        return data.decode("utf-8", "replace")
+
+def BodyText(mime):
+    """Function returning the plain-text body of a MIME message, from its first
+    text/plain part or otherwise its first text/html part stripped of its
+    tags. The parts that are attachments are ignored"""
+    plain = None
+    markup = None
+    stack = [mime]
+    while stack and plain is None:
+        mime = stack.pop()
+        if mime is None:
+            continue
+        if mime.ContentType == "multipart":
+            children = []
+            child = mime.GetFirstChildEntity()
+            while child is not None:
+                children.append(child)
+                child = child.GetNextSibling()
+            stack.extend(reversed(children))
+        elif (mime.ContentType == "text" and
+              "attachment" not in mime.GetSomeHeaders(["Content-Disposition"], True).lower()):
+            if mime.ContentSubType == "plain":
+                plain = _text(mime)
+            elif mime.ContentSubType == "html" and markup is None:
+                markup = _text(mime)
+    if plain is None and markup is not None:
+        plain = html.unescape(_TAG.sub(" ", markup))
+    return (plain or "")[:MaxBody]
+
+class SearchIndex(sqlitewriter.SQLiteWriter):
+    """SQLite full-text index of the messages, written by a separate thread"""
+    schema = _SCHEMA
+    kind = "index"
+    table = "messages"
+
+    def __init__(self, path, batch=BatchRows):
+        """SearchIndex initialisation method"""
+        sqlitewriter.SQLiteWriter.__init__(self, path, batch)
+
+    @property
+    def messages(self):
+        """Number of messages written to the index"""
+        return self.written
+
+    def Add(self, mailbox, folder, noteid, unid, date, subject, sender, recipients, location, body):
+        """Method to add a message to the index, replacing any previous version"""
+        self._append((mailbox, folder, noteid, unid, date, subject, sender, recipients, location, body))
+
+    def _write(self, rows):
+        for row in rows:
+            old = self.db.execute("SELECT id FROM messages "
+                                  "WHERE mailbox = ? AND folder = ? AND noteid = ?", row[:3]).fetchone()
+            if old is not None:
+                self.db.execute("DELETE FROM text WHERE rowid = ?", old)
+                self.db.execute("DELETE FROM messages WHERE id = ?", old)
+            rowid = self.db.execute("INSERT INTO messages (mailbox, folder, noteid, unid, date, "
+                                    "subject, sender, recipients, location) "
+                                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", row[:9]).lastrowid
+            self.db.execute("INSERT INTO text (rowid, subject, sender, recipients, body) "
+                            "VALUES (?, ?, ?, ?, ?)", (rowid, row[5], row[6], row[7], row[9]))
+
+def Search(path, query, limit=20):
+    """Function returning the (date, mailbox, folder, subject, sender,
+    location, snippet) of the messages of an index matching an FTS5 query,
+    best matches first"""
+    db = sqlite3.connect(path)
+    try:
+        return db.execute("SELECT m.date, m.mailbox, m.folder, m.subject, m.sender, m.location, "
+                          "snippet(text, 3, '[', ']', '...', 12) "
+                          "FROM text JOIN messages m ON m.id = text.rowid "
+                          "WHERE text MATCH ? ORDER BY rank LIMIT ?", (query, limit)).fetchall()
+    finally:
+        db.close()
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        raise OSError("searchindex [index] [query] [limit]")
+    start = time.time()
+    results = Search(sys.argv[1], sys.argv[2], int(sys.argv[3]) if len(sys.argv) > 3 else 20)
+    for date, mailbox, folder, subject, sender, location, snippet in results:
+        print("%s  %s/%s  %s  (%s)" % (time.strftime("%Y-%m-%d", time.gmtime(date)) if date else "----------",
+                                      mailbox, folder, subject, sender))
+        print("    %s" % location)
+        print("    %s" % " ".join(snippet.split()))
+    print("%d messages found in %.1f ms" % (len(results), 1000. * (time.time() - start)))
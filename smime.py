@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+# Copyright (C) 2016 Free Software Foundation
+# Author : David Bateman <dbateman@free.fr>
+
+"""S/MIME re-encryption of the messages exported by NSF2X.
+
+The body of an encrypted Notes message is exported as an S/MIME enveloped
+part. The encryption is done by a backend, any object with a method
+Open(pool) returning an encryption session. The session is a file to which
+the MIME body is written, with a method Finish() returning the PKCS#7
+enveloped data in DER format as an iterable of bytes, and a method Close()
+to release it. The backends CryptoAPIBackend (Windows CryptoAPI, with the
+certificate of the Exchange user) and OpenSSLBackend (the openssl command,
+with a PEM certificate) are supplied.
+
+Encryptor writes the envelope of the sessions in base64. The messages are
+encrypted one after the other, in the thread exporting them. CryptoAPIBackend
+encrypts the body once it is complete, while OpenSSLBackend encrypts it in a
+separate process while it is written, its output being read by a thread.
+"""
+
+# Ignore variable/function/Method naming conventions of PEP8. I like my names
+# pylint: disable=C0103
+
+import concurrent.futures
+import queue
+import subprocess
+
+import mimewriter
+
+# Content encryption algorithms, with their OID and the openssl option
+Algorithms = {"rc2" : ("1.2.840.113549.3.2", "-rc2"),
+              "3des" : ("1.2.840.113549.3.7", "-des3"),
+              "aes128" : ("2.16.840.1.101.3.4.1.2", "-aes128"),
+              "aes256" : ("2.16.840.1.101.3.4.1.42", "-aes256")}
+
+def _blocks(chunks, size):
+    """Generator regrouping an iterable of bytes in blocks of size bytes,
+    except for the last block"""
+    buf = b""
+    for data in chunks:
+        buf += data
+        while len(buf) >= size:
+            yield buf[:size]
+            buf = buf[size:]
+    if buf:
+        yield buf
+
+class CryptoAPISession(object):
+    """Encryption session of CryptoAPIBackend. CryptEncryptMessage needs the
+    whole body, so it is kept in memory until Finish is called"""
+    def __init__(self, backend):
+        """CryptoAPISession initialisation method"""
+        self.backend = backend
+        self.pieces = []
+
+    def write(self, data):
+        """Method to add a part of the body"""
+        self.pieces.append(data)
+
+    def Finish(self):
+        """Method returning the enveloped data"""
+        import win32crypt # pylint: disable=E0401
+        import win32cryptcon # pylint: disable=E0401
+        encryptparams = {"MsgEncodingType" : win32cryptcon.PKCS_7_ASN_ENCODING | win32cryptcon.X509_ASN_ENCODING,
+                         "CryptProv" : self.backend.provider,
+                         "ContentEncryptionAlgorithm" : {"ObjId" : Algorithms[self.backend.algorithm][0],
+                                                         "Parameters" : None}}
+        data = b"".join(self.pieces)
+        self.pieces = []
+        # pylint: disable=E1101
+        return [win32crypt.CryptEncryptMessage(encryptparams, [self.backend.certificate], data)]
+
+    def Close(self):
+        """Method to release the session"""
+        self.pieces = []
+
+class CryptoAPIBackend(object):
+    """Backend encrypting with win32crypt.CryptEncryptMessage for a certificate
+    of a Windows certificate store"""
+    def __init__(self, provider, certificate, algorithm="3des"):
+        """CryptoAPIBackend initialisation method"""
+        self.provider = provider
+        self.certificate = certificate
+        self.algorithm = algorithm
+
+    def Open(self, dummy_pool):
+        """Method returning a new encryption session"""
+        return CryptoAPISession(self)
+
+class OpenSSLSession(object):
+    """Encryption session of OpenSSLBackend. The body is piped to openssl as it
+    is written, while its output is read by a thread of the pool"""
+    def __init__(self, backend, pool):
+        """OpenSSLSession initialisation method"""
+        self.process = subprocess.Popen([backend.openssl, "cms", "-encrypt", "-binary",
+                                         "-outform", "DER", Algorithms[backend.algorithm][1],
+                                         backend.certificate],
+                                        stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                        stderr=subprocess.PIPE)
+        self.output = queue.Queue()
+        self.reader = pool.submit(self._read)
+
+    def _read(self):
+        while True:
+            data = self.process.stdout.read(mimewriter.StreamChunk)
+            if not data:
+                break
+            self.output.put(data)
+        self.output.put(None)
+
+    def write(self, data):
+        """Method to add a part of the body"""
+        self.process.stdin.write(data)
+
+    def Finish(self):
+        """Generator of the enveloped data"""
+        self.process.stdin.close()
+        while True:
+            data = self.output.get()
+            if data is None:
+                break
+            yield data
+        self.reader.result()
+        error = self.process.stderr.read()
+        if self.process.wait() != 0:
+            raise OSError("openssl cms failed : %s" % error.decode("utf-8", "replace").strip())
+
+    def Close(self):
+        """Method to release the session, stopping openssl if the encryption
+        wasn't finished"""
+        if self.process.poll() is None:
+            self.process.kill()
+            self.process.wait()
+        try:
+            # Flushing the body buffered for a killed openssl fails
+            self.process.stdin.close()
+        except BrokenPipeError:
+            pass
+        self.process.stdout.close()
+        self.process.stderr.close()
+
+class OpenSSLBackend(object):
+    """Backend encrypting with the openssl command for a PEM certificate"""
+    def __init__(self, certificate, algorithm="3des", openssl="openssl"):
+        """OpenSSLBackend initialisation method"""
+        self.certificate = certificate
+        self.algorithm = algorithm
+        self.openssl = openssl
+
+    def Open(self, pool):
+        """Method returning a new encryption session"""
+        return OpenSSLSession(self, pool)
+
+class Encryptor(object):
+    """Encryption of the messages with a backend. The pool only holds the
+    thread reading the output of the current session, if the backend needs
+    one"""
+    def __init__(self, backend):
+        """Encryptor initialisation method"""
+        self.backend = backend
+        self.pool = concurrent.futures.ThreadPoolExecutor(1)
+        self.messages = 0
+        self.size = 0
+
+    def Open(self):
+        """Method returning a session to which the MIME body is written"""
+        return self.backend.Open(self.pool)
+
+    def WriteEnvelope(self, f, session):
+        """Method to write the S/MIME part enveloping the body written to a
+        session. The envelope is encoded in base64 block by block, so that it
+        is never completely in memory"""
+        f.write(b'Content-Type: application/x-pkcs7-mime;smime-type=enveloped-data;name="smime.p7m"\n')
+        f.write(b'Content-Transfer-Encoding: base64\n')
+        f.write(b'Content-Disposition: attachment;filename="smime.p7m"\n')
+        f.write(b'\n')
+        for data in _blocks(session.Finish(), mimewriter.Base64Block):
+            self.size += len(data)
+            f.write(mimewriter.Base64Lines(data))
+        self.messages += 1
+
+    def Close(self):
+        """Method to stop the thread of the pool"""
+        self.pool.shutdown()
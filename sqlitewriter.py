@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+# Copyright (C) 2016 Free Software Foundation
+# Author : David Bateman <dbateman@free.fr>
+"""SQLite databases written by NSF2X in a separate thread.
+
+SQLiteWriter is the base of the full-text index and the export catalog. The
+rows added are queued, and written by the single thread of a pool, which owns
+the connection, in a transaction per batch of BatchRows rows, so that the
+export doesn't wait for SQLite. The export only waits when two batches are
+pending. The database is in WAL mode, and the errors of SQLite are raised as
+OSError.
+"""
+
+# Ignore variable/function/Method naming conventions of PEP8. I like my names
+# pylint: disable=C0103
+
+import concurrent.futures
+import sqlite3
+import time
+
+# Rows inserted in a single transaction
+BatchRows = 2000
+
+class SQLiteWriter(object):
+    """SQLite database written by a separate thread. The derived classes give
+    the schema, the name of the database in the error messages and the table
+    with the locations, and write a batch of rows with _write"""
+    schema = ""
+    kind = "database"
+    table = None
+
+    def __init__(self, path, batch=BatchRows):
+        """SQLiteWriter initialisation method"""
+        self.path = path
+        self.batch = batch
+        self.rows = []
+        self.pending = []
+        self.written = 0
+        self.elapsed = 0.
+        # The connection is only used by the thread of the pool
+        self.pool = concurrent.futures.ThreadPoolExecutor(1)
+        self.db = self.pool.submit(self._open).result()
+
+    def _open(self):
+        db = None
+        try:
+            db = sqlite3.connect(self.path, check_same_thread=False)
+            db.execute("PRAGMA journal_mode = WAL")
+            db.execute("PRAGMA synchronous = NORMAL")
+            db.executescript(self.schema)
+            self._prepare(db)
+        except sqlite3.Error as ex:
+            if db is not None:
+                db.close()
+            raise OSError("Can not create the %s %s : %s" % (self.kind, self.path, ex))
+        return db
+
+    def _prepare(self, db):
+        """Method called by the thread of the pool once the schema is created"""
+        pass
+
+    def _append(self, row):
+        """Method to queue a row, written with the next batch"""
+        self.rows.append(row)
+        if len(self.rows) >= self.batch:
+            self._submit()
+
+    def _submit(self):
+        rows = self.rows
+        self.rows = []
+        self.pending.append(self.pool.submit(self._insert, rows))
+        # Only wait if SQLite is two batches behind
+        while len(self.pending) > 2:
+            self.pending.pop(0).result()
+
+    def _insert(self, rows):
+        start = time.time()
+        try:
+            with self.db:
+                self._write(rows)
+        except sqlite3.Error as ex:
+            raise OSError("Can not write to the %s %s : %s" % (self.kind, self.path, ex))
+        self.written += len(rows)
+        self.elapsed += time.time() - start
+
+    def _write(self, rows):
+        """Method writing a batch of rows, in the transaction of _insert"""
+        raise NotImplementedError
+
+    def Relocate(self, locations):
+        """Method to replace the locations of the rows moved in the output,
+        given by a dictionary of the old and the new locations"""
+        self.Flush()
+        self.pool.submit(self._relocate, locations).result()
+
+    def _relocate(self, locations):
+        # A single UPDATE, as a new location can be the old one of another row
+        try:
+            with self.db:
+                self.db.execute("CREATE TEMP TABLE IF NOT EXISTS moves (old TEXT PRIMARY KEY, new TEXT)")
+                self.db.executemany("INSERT OR REPLACE INTO moves (old, new) VALUES (?, ?)", locations.items())
+                self._move()
+                self.db.execute("DELETE FROM moves")
+        except sqlite3.Error as ex:
+            raise OSError("Can not write to the %s %s : %s" % (self.kind, self.path, ex))
+
+    def _move(self):
+        """Method updating the locations of the table from the temporary table
+        moves"""
+        self.db.execute("UPDATE %s SET location = (SELECT new FROM moves WHERE old = location) "
+                        "WHERE location IN (SELECT old FROM moves)" % self.table)
+
+    def Flush(self):
+        """Method to wait until all the rows added are written. The error of a
+        batch is only raised once"""
+        if self.rows:
+            self._submit()
+        pending = self.pending
+        self.pending = []
+        for future in pending:
+            future.result()
+
+    def Close(self):
+        """Method to write the remaining rows and close the database"""
+        try:
+            self.Flush()
+        finally:
+            self.pool.submit(self.db.close).result()
+            self.pool.shutdown()
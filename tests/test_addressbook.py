@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+# Copyright (C) 2016 Free Software Foundation
+# Author : David Bateman <dbateman@free.fr>
+
+"""Tests of the resolution of Notes names of addressbook.py"""
+
+# Ignore variable/function/Method naming conventions of PEP8. I like my names
+# pylint: disable=C0103
+
+import base64
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+import addressbook
+
+class _Directory(object):
+    """Directory of two names, recording the names looked up"""
+    addresses = {"jane doe/sales/acme" : "jane.doe@acme.com", "john smith/acme" : "john.smith@acme.com"}
+
+    def __init__(self):
+        self.queries = []
+
+    def Lookup(self, names):
+        self.queries.append(list(names))
+        return dict((name, self.addresses[addressbook.NameKey(name)]) for name in names
+                    if addressbook.NameKey(name) in self.addresses)
+
+class NamesTest(unittest.TestCase):
+    """Notes names and their keys"""
+    def test_notes_name(self):
+        for address in ("CN=Jane Doe/OU=Sales/O=Acme@Acme", "Jane Doe/Sales/Acme", "Jane Doe@Acme", "jdoe@Acme"):
+            self.assertTrue(addressbook.IsNotesName(address), address)
+        for address in ("jane.doe@acme.com", "jdoe", ""):
+            self.assertFalse(addressbook.IsNotesName(address), address)
+
+    def test_key(self):
+        # The canonical and abbreviated forms have the same key, without the domain
+        for name in ("CN=Jane Doe/OU=Sales/O=Acme@Acme", "Jane Doe/Sales/Acme", '"jane doe/sales/acme"',
+                     "cn = Jane Doe / ou=Sales / o=Acme"):
+            self.assertEqual(addressbook.NameKey(name), "jane doe/sales/acme", name)
+        self.assertEqual(addressbook.NameKey("jane.doe@acme.com"), "jane.doe@acme.com")
+
+    def test_common_name(self):
+        self.assertEqual(addressbook.CommonName("CN=Jane Doe/OU=Sales/O=Acme@Acme"), "Jane Doe")
+        self.assertEqual(addressbook.CommonName("Jane Doe@Acme"), "Jane Doe")
+
+class ResolverTest(unittest.TestCase):
+    """Names resolved with Resolver"""
+    def test_cache(self):
+        directory = _Directory()
+        resolver = addressbook.Resolver(directory)
+        self.assertEqual(resolver.Resolve("CN=Jane Doe/OU=Sales/O=Acme@Acme"), "jane.doe@acme.com")
+        # The other forms of the name and the unknown names are found in the cache
+        self.assertEqual(resolver.Resolve("Jane Doe/Sales/Acme"), "jane.doe@acme.com")
+        self.assertIsNone(resolver.Resolve("Nobody/Acme"))
+        self.assertIsNone(resolver.Resolve("CN=Nobody/O=Acme"))
+        self.assertEqual(directory.queries, [["CN=Jane Doe/OU=Sales/O=Acme@Acme"], ["Nobody/Acme"]])
+        self.assertEqual((resolver.hits, resolver.misses, resolver.HitRate()), (2, 2, 0.5))
+
+    def test_eviction(self):
+        directory = _Directory()
+        resolver = addressbook.Resolver(directory, 2)
+        resolver.Resolve("Jane Doe/Sales/Acme")
+        resolver.Resolve("John Smith/Acme")
+        # Using a name makes it the most recently used, so the other one is dropped
+        resolver.Resolve("Jane Doe/Sales/Acme")
+        resolver.Resolve("Nobody/Acme")
+        self.assertEqual(list(resolver.cache), ["jane doe/sales/acme", "nobody/acme"])
+        resolver.Resolve("John Smith/Acme")
+        self.assertEqual(directory.queries, [["Jane Doe/Sales/Acme"], ["John Smith/Acme"], ["Nobody/Acme"],
+                                             ["John Smith/Acme"]])
+        self.assertEqual(len(resolver.cache), 2)
+
+    def test_prefetch(self):
+        directory = _Directory()
+        resolver = addressbook.Resolver(directory)
+        self.assertEqual(resolver.Prefetch(["Jane Doe/Sales/Acme", "CN=Jane Doe/OU=Sales/O=Acme", "Nobody/Acme",
+                                            "bob@example.com", ""]), 2)
+        self.assertEqual(resolver.Prefetch(["Nobody/Acme"]), 0)
+        self.assertEqual(len(directory.queries), 1)
+        self.assertEqual(resolver.Resolve("Jane Doe/Sales/Acme"), "jane.doe@acme.com")
+
+    def test_rewrite_headers(self):
+        resolver = addressbook.Resolver(_Directory())
+        headers = ('From: CN=Jane Doe/OU=Sales/O=Acme@Acme\r\n'
+                   'To: bob@example.com,\r\n "John Smith" <John Smith/Acme@Acme>\r\n'
+                   'Subject: CN=Jane Doe/O=Acme\r\n'
+                   'Cc: Unknown Person/Acme@Acme\r\n')
+        self.assertEqual(resolver.RewriteHeaders(headers),
+                         'From: Jane Doe <jane.doe@acme.com>\r\n'
+                         'To: bob@example.com, John Smith <john.smith@acme.com>\r\n'
+                         'Subject: CN=Jane Doe/O=Acme\r\n'
+                         'Cc: Unknown Person/Acme@Acme\r\n')
+        self.assertIsNone(resolver.RewriteAddresses("bob@example.com"))
+
+class FileDirectoryTest(unittest.TestCase):
+    """Directories read from CSV and LDIF files"""
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _file(self, name, text):
+        path = os.path.join(self.dir, name)
+        with io.open(path, "w", encoding="utf-8-sig", newline="") as f:
+            f.write(text)
+        return path
+
+    def test_csv(self):
+        path = self._file("names.csv", 'Name,Address\r\n"CN=Ren\xe9 Dupont/O=Acme",rene@acme.com\r\n'
+                                       'Jane Doe/Sales/Acme, jane.doe@acme.com \r\n'
+                                       'No Address/Acme,\r\n'
+                                       'Jane Doe/Sales/Acme,other@acme.com\r\n')
+        directory = addressbook.OpenDirectory(path)
+        self.assertIsInstance(directory, addressbook.CSVDirectory)
+        self.assertEqual(directory.addresses, {"ren\xe9 dupont/acme" : "rene@acme.com",
+                                               "jane doe/sales/acme" : "jane.doe@acme.com"})
+        self.assertEqual(directory.Lookup(["Ren\xe9 Dupont/Acme@Acme", "No Address/Acme"]),
+                         {"Ren\xe9 Dupont/Acme@Acme" : "rene@acme.com"})
+
+    def test_ldif(self):
+        cn = base64.b64encode("Ren\xe9 Dupont".encode("utf-8")).decode("ascii")
+        path = self._file("names.ldif", "# Domino directory\n"
+                                        "dn: CN=Jane Doe,OU=Sales,O=Acme\n"
+                                        "cn: Jane Doe\n"
+                                        "mail: jane.doe@ac\n me.com\n"
+                                        "\n"
+                                        "dn: CN=Ren\xe9 Dupont,O=Acme\n"
+                                        "cn:: %s\n"
+                                        "mail: rene@acme.com\n"
+                                        "\n"
+                                        "dn: CN=Sales,O=Acme\n"
+                                        "cn: Sales\n" % cn)
+        directory = addressbook.OpenDirectory(path)
+        self.assertIsInstance(directory, addressbook.LDIFDirectory)
+        self.assertEqual(directory.addresses, {"jane doe/sales/acme" : "jane.doe@acme.com",
+                                               "jane doe" : "jane.doe@acme.com",
+                                               "ren\xe9 dupont/acme" : "rene@acme.com",
+                                               "ren\xe9 dupont" : "rene@acme.com"})
+
+if __name__ == '__main__':
+    unittest.main()
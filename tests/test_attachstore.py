@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+# Copyright (C) 2016 Free Software Foundation
+# Author : David Bateman <dbateman@free.fr>
+
+"""Tests of the attachment store of attachstore.py"""
+
+# Ignore variable/function/Method naming conventions of PEP8. I like my names
+# pylint: disable=C0103
+
+import email
+import gzip
+import hashlib
+import os
+import shutil
+import tempfile
+import unittest
+
+import attachstore
+import mimewriter
+
+def Chunks(data):
+    """Function returning the chunks function of AttachmentStore.Add for data"""
+    return lambda: [data[i:i + 1000] for i in range(0, len(data), 1000)]
+
+class AttachmentStoreTest(unittest.TestCase):
+    """Contents stored and referenced with AttachmentStore"""
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.root = os.path.join(self.dir, "store")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_add(self):
+        store = attachstore.AttachmentStore(self.root)
+        data = os.urandom(10000)
+        digest = hashlib.sha256(data).hexdigest()
+        self.assertEqual(store.Add(Chunks(data)), (digest, 10000))
+        self.assertEqual(store.Add(Chunks(data)), (digest, 10000))
+        with open(attachstore.BlobPath(self.root, digest), "rb") as f:
+            self.assertEqual(f.read(), data)
+        self.assertEqual(os.listdir(os.path.dirname(attachstore.BlobPath(self.root, digest))), [digest])
+        self.assertEqual((store.parts, store.size, store.distinct, store.unique, store.stored),
+                         (2, 20000, 10000, 1, 10000))
+        self.assertEqual(store.Ratio(), 2.)
+
+    def test_ratio_existing(self):
+        # The contents already in the store count in the ratio
+        data = [os.urandom(5000) for dummy in range(2)]
+        store = attachstore.AttachmentStore(self.root)
+        store.Add(Chunks(data[0]))
+        store = attachstore.AttachmentStore(self.root)
+        for dummy in range(3):
+            store.Add(Chunks(data[0]))
+        store.Add(Chunks(data[1]))
+        self.assertEqual((store.size, store.distinct, store.unique, store.stored), (20000, 10000, 1, 5000))
+        self.assertEqual(store.Ratio(), 2.)
+        self.assertEqual(attachstore.AttachmentStore(self.root).Ratio(), 0.)
+
+    def test_rehydrate(self):
+        store = attachstore.AttachmentStore(self.root)
+        data = os.urandom(6000)
+        headers = ('Content-Type: application/octet-stream; name="data.bin"\n'
+                   'Content-Transfer-Encoding: binary\n'
+                   'Content-Disposition: attachment; filename="data.bin"\n')
+        (digest, size) = store.Add(Chunks(data))
+        message = ('Subject: attachment\nMIME-Version: 1.0\n'
+                   'Content-Type: multipart/mixed; boundary="b"\n\n'
+                   '--b\nContent-Type: text/plain\n\nFrom the store\n'
+                   '--b\n' + attachstore.AttachmentStore.Reference(headers, digest, size, True) +
+                   '--b--\n')
+        src = os.path.join(self.dir, "dehydrated.eml")
+        dst = os.path.join(self.dir, "rehydrated.eml")
+        with open(src, "wb") as f:
+            f.write(message.encode("ascii"))
+        self.assertEqual(attachstore.Rehydrate(self.root, src, dst), (1, 1))
+        with open(dst, "rb") as f:
+            rebuilt = email.message_from_binary_file(f)
+        parts = rebuilt.get_payload()
+        self.assertEqual(parts[0].get_payload(), "From the store")
+        self.assertEqual(parts[1]["Content-Transfer-Encoding"], "base64")
+        self.assertEqual(parts[1].get_filename(), "data.bin")
+        self.assertEqual(parts[1].get_payload(decode=True), data)
+
+    def test_rehydrate_text(self):
+        store = attachstore.AttachmentStore(self.root)
+        data = b"From the start\nline \xe9\n" * 300
+        (digest, size) = store.Add(Chunks(data))
+        headers = ('Content-Type: text/plain; charset="iso-8859-1"\n'
+                   'Content-Transfer-Encoding: quoted-printable\n')
+        src = os.path.join(self.dir, "in")
+        dst = os.path.join(self.dir, "out")
+        os.makedirs(os.path.join(src, "Inbox"))
+        with open(os.path.join(src, "Inbox", "1.eml"), "wb") as f:
+            f.write(b"Subject: text\nMIME-Version: 1.0\n" +
+                    attachstore.AttachmentStore.Reference(headers, digest, size).encode("ascii"))
+        self.assertEqual(attachstore.Rehydrate(self.root, src, dst), (1, 1))
+        with open(os.path.join(dst, "Inbox", "1.eml"), "rb") as f:
+            raw = f.read()
+        self.assertNotIn(b"\nFrom ", raw)
+        self.assertEqual(email.message_from_bytes(raw).get_payload(decode=True), data)
+
+    def _dehydrated(self, n):
+        """Method returning a message referencing an attachment of the store"""
+        (digest, size) = attachstore.AttachmentStore(self.root).Add(Chunks(b"%d" % n * 5000))
+        headers = 'Content-Type: application/octet-stream\nContent-Transfer-Encoding: base64\n'
+        return (b"Subject: %d\nMIME-Version: 1.0\n" % n +
+                attachstore.AttachmentStore.Reference(headers, digest, size).encode("ascii"))
+
+    def test_rehydrate_maildir(self):
+        src = os.path.join(self.dir, "in")
+        dst = os.path.join(self.dir, "out")
+        paths = [os.path.join("new", "1.M1P1Q1.host"), os.path.join("cur", "2.M1P1Q2.host:2,S"),
+                 os.path.join(".Sent", "new", "3f", "3.M1P1Q3.host")]
+        for sub in ("tmp", ".Sent/tmp"):
+            os.makedirs(os.path.join(src, sub))
+        for n, path in enumerate(paths):
+            os.makedirs(os.path.dirname(os.path.join(src, path)), exist_ok=True)
+            with open(os.path.join(src, path), "wb") as f:
+                f.write(self._dehydrated(n))
+        open(os.path.join(src, ".Sent", "maildirfolder"), "wb").close()
+        self.assertEqual(attachstore.Rehydrate(self.root, src, dst), (3, 3))
+        for n, path in enumerate(paths):
+            with open(os.path.join(dst, path), "rb") as f:
+                self.assertEqual(email.message_from_binary_file(f).get_payload(decode=True), b"%d" % n * 5000)
+
+    def test_rehydrate_gzip(self):
+        src = os.path.join(self.dir, "in.mbox.gz")
+        dst = os.path.join(self.dir, "out.mbox.gz")
+        with gzip.open(src, "wb") as f:
+            f.write(b"From - \n" + self._dehydrated(1) + b"\nFrom - \n" + self._dehydrated(2))
+        self.assertEqual(attachstore.Rehydrate(self.root, src, dst), (1, 2))
+        with gzip.open(dst, "rb") as f:
+            messages = f.read().split(b"\nFrom - \n")
+        self.assertEqual([email.message_from_bytes(m).get_payload(decode=True) for m in messages],
+                         [b"1" * 5000, b"2" * 5000])
+
+    def test_reference(self):
+        headers = "Content-Type: application/pdf\nContent-Transfer-Encoding: binary"
+        reference = attachstore.AttachmentStore.Reference(headers, "0" * 64, 10, True)
+        part = email.message_from_string(reference)
+        self.assertEqual(part.get_content_type(), "message/external-body")
+        self.assertEqual(part.get_param("access-type"), attachstore.AccessType)
+        self.assertIn("Content-Transfer-Encoding: base64", reference)
+        self.assertEqual(mimewriter.EncodingHeader(headers, "base64"),
+                         "Content-Type: application/pdf\nContent-Transfer-Encoding: base64")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+# Copyright (C) 2016 Free Software Foundation
+# Author : David Bateman <dbateman@free.fr>
+
+"""Tests of the catalog of the exported documents of catalog.py"""
+
+# Ignore variable/function/Method naming conventions of PEP8. I like my names
+# pylint: disable=C0103
+
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+import catalog
+
+class HashingFileTest(unittest.TestCase):
+    """Size and digest of the messages written through HashingFile"""
+    def test_digest(self):
+        out = io.BytesIO(b"previous")
+        out.seek(0, io.SEEK_END)
+        f = catalog.HashingFile(out)
+        f.write(b"Subject: a\n\n")
+        f.write(b"body\n")
+        self.assertEqual(f.size, 17)
+        self.assertEqual(f.Digest(), hashlib.sha256(b"Subject: a\n\nbody\n").hexdigest())
+        self.assertEqual(f.tell(), 25)
+
+    def test_rewrite(self):
+        # Seeking back to the start of the message discards what was counted
+        f = catalog.HashingFile(io.BytesIO())
+        f.write(b"failed attempt")
+        f.seek(0)
+        f.write(b"second")
+        self.assertEqual((f.size, f.Digest()), (6, hashlib.sha256(b"second").hexdigest()))
+
+    def test_no_digest(self):
+        f = catalog.HashingFile(io.BytesIO(), False)
+        f.write(b"data")
+        self.assertEqual((f.size, f.Digest()), (4, None))
+
+class CatalogTest(unittest.TestCase):
+    """Runs recorded with Catalog"""
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "test.exports.sqlite")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _run(self, documents, settings=""):
+        exports = catalog.Catalog(self.path, settings, 2)
+        for document in documents:
+            exports.Add(*document)
+        exports.Close()
+        return exports
+
+    def test_runs(self):
+        first = self._run([("jsmith", "Inbox", "8FA", "U1", "jsmith.mbox|0|10", 10, "a", "OK"),
+                           ("jsmith", "Inbox", "8FB", "U2", "jsmith.mbox|10|20", 10, "b", "OK"),
+                           ("jsmith", "Inbox", "8FC", "U3", "", None, None, "SKIPPED")], "mbox")
+        second = self._run([("jsmith", "Inbox", "8FA", "U1", "jsmith.mbox|0|10", 10, "a", "OK")], "mbox bgzf")
+        self.assertEqual((first.run, second.run), (1, 2))
+        self.assertEqual(first.documents, 3)
+        self.assertEqual([(run, settings, count) for run, started, settings, count in catalog.Runs(self.path)],
+                         [(1, "mbox", 3), (2, "mbox bgzf", 1)])
+
+    def test_find(self):
+        self._run([("jsmith", "Inbox", "8FA", "U1", "a.eml", 10, "a", "OK")])
+        self._run([("jsmith", "Inbox", "8FA", "U1", "b.eml", 12, "b", "OK"),
+                   ("jsmith", "Inbox", "8FA", "U1", "c.eml", 12, "c", "OK")])
+        # The latest run first, a document added again replacing its row
+        self.assertEqual([(r[0], r[5]) for r in catalog.Find(self.path, "0x8fa")], [(2, "c.eml"), (1, "a.eml")])
+        self.assertEqual(len(catalog.Find(self.path, "U1")), 2)
+        self.assertEqual(catalog.Find(self.path, "999"), [])
+
+    def test_diff(self):
+        self._run([("jsmith", "Inbox", "1", "U1", "1.eml", 1, "a", "OK"),
+                   ("jsmith", "Inbox", "2", "U2", "2.eml", 1, "b", "OK"),
+                   ("jsmith", "Inbox", "3", "U3", "3.eml", 1, "c", "OK")])
+        self._run([("jsmith", "Inbox", "1", "U1", "1.eml", 1, "a", "OK"),
+                   ("jsmith", "Inbox", "2", "U2", "2.eml", 1, "B", "OK"),
+                   ("jsmith", "Inbox", "4", "U4", "4.eml", 1, "d", "OK")])
+        self.assertEqual(catalog.Diff(self.path, 1, 2),
+                         [("changed", "jsmith", "Inbox", "2", "U2", "2.eml"),
+                          ("removed", "jsmith", "Inbox", "3", "U3", "3.eml"),
+                          ("added", "jsmith", "Inbox", "4", "U4", "4.eml")])
+
+    def test_folders(self):
+        # A document exported to two folders has a row for each
+        self._run([("jsmith", "Inbox", "1", "U1", "Inbox/1.eml", 1, "a", "OK"),
+                   ("jsmith", "Projects", "1", "U1", "Projects/1.eml", 1, "a", "OK")])
+        self._run([("jsmith", "Inbox", "1", "U1", "Inbox/1.eml", 1, "a", "OK")])
+        self.assertEqual(sorted(r[5] for r in catalog.Find(self.path, "1") if r[0] == 1),
+                         ["Inbox/1.eml", "Projects/1.eml"])
+        self.assertEqual(catalog.Diff(self.path, 1, 2),
+                         [("removed", "jsmith", "Projects", "1", "U1", "Projects/1.eml")])
+
+    def test_relocate(self):
+        exports = catalog.Catalog(self.path)
+        exports.Add("jsmith", "Inbox", "1", "U1", "a.mbox|0|10", 10, "a", "OK")
+        exports.Add("jsmith", "Inbox", "2", "U2", "a.mbox|10|30", 20, "b", "OK")
+        exports.Add("jsmith", "Inbox", "3", "U3", "", None, None, "SKIPPED")
+        exports.Relocate({"a.mbox|0|10" : "a.mbox|20|30", "a.mbox|10|30" : "a.mbox|0|20"})
+        exports.Close()
+        self.assertEqual([catalog.Find(self.path, n)[0][5] for n in ("1", "2", "3")],
+                         ["a.mbox|20|30", "a.mbox|0|20", ""])
+
+    def test_relocate_run(self):
+        # Only the locations of the current run are moved
+        self._run([("jsmith", "Inbox", "1", "U1", "a.mbox|0|10", 10, "a", "OK")])
+        exports = catalog.Catalog(self.path)
+        exports.Add("jsmith", "Inbox", "2", "U2", "a.mbox|0|10", 10, "b", "OK")
+        exports.Relocate({"a.mbox|0|10" : "a.mbox|50|60"})
+        exports.Close()
+        self.assertEqual([(r[0], r[5]) for r in catalog.Find(self.path, "1")], [(1, "a.mbox|0|10")])
+        self.assertEqual([(r[0], r[5]) for r in catalog.Find(self.path, "2")], [(2, "a.mbox|50|60")])
+
+    def test_error(self):
+        os.makedirs(self.path)
+        self.assertRaises(OSError, catalog.Catalog, self.path)
+
+if __name__ == '__main__':
+    unittest.main()
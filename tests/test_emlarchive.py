@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+# Copyright (C) 2016 Free Software Foundation
+# Author : David Bateman <dbateman@free.fr>
+
+"""Tests of the archives of EML files of emlarchive.py"""
+
+# Ignore variable/function/Method naming conventions of PEP8. I like my names
+# pylint: disable=C0103
+
+import io
+import os
+import shutil
+import tarfile
+import tempfile
+import unittest
+import zipfile
+
+import emlarchive
+
+def Message(n):
+    """Function returning the file of EML message n"""
+    return io.BytesIO(b"Subject: message %d\n\n" % n + b"body\n" * (n * 100))
+
+class ArchiveNameTest(unittest.TestCase):
+    """Names of the messages in the archives"""
+    def test_name(self):
+        self.assertEqual(emlarchive.ArchiveName("Inbox\\Projects", 3), "Inbox/Projects/3.eml")
+
+class ZipArchiveTest(unittest.TestCase):
+    """ZIP archives of EML files"""
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "test.zip")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_add(self):
+        for compress in (False, True):
+            archive = emlarchive.ZipArchive(self.path, compress=compress)
+            offsets = [archive.Add(emlarchive.ArchiveName("Inbox", n), Message(n)) for n in range(1, 4)]
+            archive.Close()
+            with zipfile.ZipFile(self.path) as z:
+                self.assertEqual(z.namelist(), ["Inbox/1.eml", "Inbox/2.eml", "Inbox/3.eml"])
+                for n, info in enumerate(z.infolist(), 1):
+                    self.assertEqual(z.read(info), Message(n).getvalue())
+                    self.assertEqual(info.header_offset, offsets[n - 1][0])
+            self.assertEqual([start for start, end in offsets[1:]], [end for start, end in offsets[:-1]])
+
+    def test_append(self):
+        archive = emlarchive.ZipArchive(self.path)
+        archive.Add(emlarchive.ArchiveName("Inbox", 1), Message(1))
+        archive.Close()
+        archive = emlarchive.ZipArchive(self.path, True)
+        self.assertEqual(archive.NextIndex("Inbox"), 2)
+        self.assertEqual(archive.NextIndex("Sent"), 1)
+        archive.Add(emlarchive.ArchiveName("Inbox", 2), Message(2))
+        archive.Close()
+        with zipfile.ZipFile(self.path) as z:
+            self.assertEqual(z.namelist(), ["Inbox/1.eml", "Inbox/2.eml"])
+
+    def test_incomplete(self):
+        # The central directory is lost if NSF2X crashes
+        archive = emlarchive.ZipArchive(self.path)
+        end = archive.Add(emlarchive.ArchiveName("Inbox", 1), Message(1))[1]
+        archive.Close()
+        with open(self.path, "r+b") as f:
+            f.truncate(end)
+        self.assertRaises(zipfile.BadZipfile, emlarchive.ZipArchive, self.path, True)
+
+class TarArchiveTest(unittest.TestCase):
+    """Tar archives of EML files"""
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "test.tar")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _index(self):
+        with io.open(self.path + ".idx", encoding="utf-8") as f:
+            return [line.rstrip("\n").split("\t") for line in f]
+
+    def test_add(self):
+        archive = emlarchive.TarArchive(self.path)
+        for n in range(1, 4):
+            archive.Add(emlarchive.ArchiveName("Inbox", n), Message(n))
+        archive.Close()
+        with tarfile.open(self.path) as tar:
+            self.assertEqual(tar.getnames(), ["Inbox/1.eml", "Inbox/2.eml", "Inbox/3.eml"])
+            self.assertEqual(tar.extractfile("Inbox/2.eml").read(), Message(2).getvalue())
+        # The index gives the offset and the size of the content
+        with open(self.path, "rb") as f:
+            for n, (name, offset, size) in enumerate(self._index(), 1):
+                self.assertEqual(name, emlarchive.ArchiveName("Inbox", n))
+                f.seek(int(offset))
+                self.assertEqual(f.read(int(size)), Message(n).getvalue())
+
+    def test_resume(self):
+        # An archive interrupted after its second message is resumed after the
+        # end of the first one recorded in the journal
+        archive = emlarchive.TarArchive(self.path)
+        end = archive.Add(emlarchive.ArchiveName("Inbox", 1), Message(1))[1]
+        archive.Add(emlarchive.ArchiveName("Inbox", 2), Message(2))
+        archive.f.close()
+        archive.index.close()
+        archive = emlarchive.TarArchive(self.path, True, end)
+        self.assertEqual(archive.NextIndex("Inbox"), 2)
+        archive.Add(emlarchive.ArchiveName("Inbox", 2), Message(3))
+        archive.Close()
+        with tarfile.open(self.path) as tar:
+            self.assertEqual(tar.getnames(), ["Inbox/1.eml", "Inbox/2.eml"])
+            self.assertEqual(tar.extractfile("Inbox/2.eml").read(), Message(3).getvalue())
+        self.assertEqual([name for name, offset, size in self._index()], ["Inbox/1.eml", "Inbox/2.eml"])
+
+    def test_truncated(self):
+        # Without a journal, a truncated last entry is dropped
+        archive = emlarchive.TarArchive(self.path)
+        archive.Add(emlarchive.ArchiveName("Inbox", 1), Message(1))
+        end = archive.Add(emlarchive.ArchiveName("Inbox", 2), Message(2))[1]
+        archive.f.truncate(end - 100)
+        archive.f.close()
+        archive.index.close()
+        archive = emlarchive.TarArchive(self.path, True)
+        self.assertEqual(archive.NextIndex("Inbox"), 2)
+        archive.Close()
+        with tarfile.open(self.path) as tar:
+            self.assertEqual(tar.getnames(), ["Inbox/1.eml"])
+
+if __name__ == '__main__':
+    unittest.main()
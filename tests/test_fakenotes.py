@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+# Copyright (C) 2016 Free Software Foundation
+# Author : David Bateman <dbateman@free.fr>
+
+"""Tests of the in-memory Notes objects of fakenotes.py"""
+
+# Ignore variable/function/Method naming conventions of PEP8. I like my names
+# pylint: disable=C0103
+
+import email
+import io
+import unittest
+
+import fakenotes
+import mimewriter
+import replay
+
+class DatabaseTest(unittest.TestCase):
+    """Tests of Database, View and Document"""
+    def setUp(self):
+        self.rfc822 = replay.SyntheticMessage(2, 100)
+        self.db = fakenotes.Database("", [("Inbox", "1", self.rfc822), ("($Sent)", "2", self.rfc822),
+                                          ("Inbox", "3", self.rfc822)])
+
+    def test_views(self):
+        self.assertEqual([v.Name for v in self.db.Views], ["Inbox", "($Sent)"])
+        self.assertEqual([v.IsFolder for v in self.db.Views], [True, False])
+        self.assertEqual(self.db.AllDocuments.Count, 3)
+
+    def test_documents(self):
+        inbox = self.db.Views[0]
+        doc = inbox.GetFirstDocument()
+        self.assertEqual(doc.NoteID, "1")
+        doc = inbox.GetNextDocument(doc)
+        self.assertEqual(doc.NoteID, "3")
+        self.assertIsNone(inbox.GetNextDocument(doc))
+        self.assertEqual(doc.GetFirstItem("Subject").Text, "Synthetic message")
+        self.assertEqual(doc.GetFirstItem("Form").Text, "Memo")
+        self.assertIsNone(doc.GetFirstItem("Categories"))
+
+    def test_mime_tree(self):
+        mime = self.db.Views[0].GetFirstDocument().GetMIMEEntity("Body")
+        self.assertEqual((mime.ContentType, mime.ContentSubType), ("multipart", "mixed"))
+        child = mime.GetFirstChildEntity()
+        self.assertEqual(child.ContentSubType, "alternative")
+        self.assertTrue(child.BoundaryStart.startswith("--"))
+        types = []
+        while child is not None:
+            types.append(child.ContentType)
+            last = child
+            child = child.GetNextSibling()
+        self.assertEqual(types, ["multipart", "application", "application"])
+        self.assertTrue(last.BoundaryEnd.endswith("--\n"))
+        self.assertEqual(last.Encoding, fakenotes.MIMEEntity.ENC_BASE64)
+
+    def test_headers(self):
+        mime = self.db.Views[0].GetFirstDocument().GetMIMEEntity("Body")
+        self.assertEqual(mime.GetSomeHeaders(["Subject"], True), "Subject: Synthetic message\n")
+        self.assertNotIn("Subject", mime.GetSomeHeaders(["Subject"], False))
+
+    def test_write_message(self):
+        # The message written by mimewriter has the same parts as the source
+        f = io.BytesIO()
+        doc = self.db.Views[0].GetFirstDocument()
+        mimewriter.WriteMIMEMessage(f, doc.GetMIMEEntity("Body"), False, None,
+                                    mimewriter.Streamer(fakenotes.Stream))
+        written = email.message_from_bytes(f.getvalue())
+        source = email.message_from_bytes(self.rfc822)
+        self.assertEqual([p.get_content_type() for p in written.walk()],
+                         [p.get_content_type() for p in source.walk()])
+        # The line break before a boundary belongs to the boundary
+        for part, original in zip(written.walk(), source.walk()):
+            if part.get_content_maintype() == "text":
+                self.assertEqual(part.get_payload(decode=True).rstrip(b"\n"),
+                                 original.get_payload(decode=True).rstrip(b"\n"))
+            elif not part.is_multipart():
+                self.assertEqual(part.get_payload(decode=True), original.get_payload(decode=True))
+
+class StreamTest(unittest.TestCase):
+    """Tests of Stream"""
+    def test_read_write(self):
+        stream = fakenotes.Stream()
+        stream.Write(b"abcdef")
+        self.assertTrue(stream.IsEOS)
+        stream.Position = 0
+        self.assertEqual(stream.Read(4), b"abcd")
+        self.assertEqual(stream.Read(4), b"ef")
+        self.assertEqual(stream.Bytes, 6)
+        stream.Truncate()
+        self.assertEqual(stream.Bytes, 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+# Copyright (C) 2016 Free Software Foundation
+# Author : David Bateman <dbateman@free.fr>
+
+"""Tests of the IMAP upload of imapwriter.py against its LocalServer"""
+
+# Ignore variable/function/Method naming conventions of PEP8. I like my names
+# pylint: disable=C0103
+
+import imaplib
+import time
+import unittest
+
+import imapwriter
+
+class EncodingTest(unittest.TestCase):
+    """Mailbox names and strings of IMAP"""
+    def test_mailbox(self):
+        self.assertEqual(imapwriter.EncodeMailbox("Inbox"), "Inbox")
+        self.assertEqual(imapwriter.EncodeMailbox("R&D"), "R&-D")
+        # Example of RFC 3501
+        self.assertEqual(imapwriter.EncodeMailbox("~peter/mail/台北/日本語"),
+                         "~peter/mail/&U,BTFw-/&ZeVnLIqe-")
+
+    def test_quote(self):
+        self.assertEqual(imapwriter.Quote('a "b" \\c'), '"a \\"b\\" \\\\c"')
+
+class UploadTest(unittest.TestCase):
+    """Upload to a server with plain APPEND"""
+    capabilities = ""
+
+    def setUp(self):
+        self.server = imapwriter.LocalServer(self.capabilities)
+
+    def tearDown(self):
+        self.server.Stop()
+
+    def _upload(self, messages, folders, connections=2):
+        uploader = imapwriter.IMAPUploader(self.server.URL(), "", connections)
+        for folder in folders:
+            uploader.CreateFolder(folder)
+        for folder, data, flags, date, key in messages:
+            uploader.Append(folder, data, flags, date, key)
+        results = uploader.Close()
+        return uploader, results
+
+    def test_upload(self):
+        folders = ["", "Sent", "Archive\\2016"]
+        messages = [(folders[i % 3], b"Subject: message %d\n\nFrom line %d\n" % (i, i),
+                     ("\\Seen",) if i % 2 else (), 1456824600 + 3600 * i, i) for i in range(120)]
+        uploader, results = self._upload(messages, folders)
+        self.assertEqual(sorted(results), [(i, None) for i in range(120)])
+        self.assertEqual((uploader.messages, uploader.failed), (120, 0))
+        self.assertEqual(sorted(self.server.mailboxes), [b"Archive", b"Archive/2016", b"INBOX", b"Sent"])
+        self.assertEqual(self.server.mailboxes[b"Archive"], [])
+        for n, mailbox in enumerate([b"INBOX", b"Sent", b"Archive/2016"]):
+            # The batches are uploaded in parallel, so the order of the
+            # messages is only kept within a batch
+            received = sorted(self.server.mailboxes[mailbox], key=lambda m: int(m[2].split()[2]))
+            self.assertEqual(len(received), 40)
+            for i, (flags, date, data) in zip(range(n, 120, 3), received):
+                self.assertEqual(data, b"Subject: message %d\r\n\r\nFrom line %d\r\n" % (i, i))
+                self.assertEqual(flags, b"\\Seen" if i % 2 else b"")
+                internal = imaplib.Internaldate2tuple(b'INTERNALDATE "' + date + b'"')
+                self.assertEqual(time.mktime(internal), 1456824600 + 3600 * i)
+
+    def test_prefix(self):
+        uploader = imapwriter.IMAPUploader(self.server.URL() + "Notes/jsmith", "")
+        try:
+            self.assertEqual(uploader.Mailbox(""), "Notes/jsmith")
+            self.assertEqual(uploader.CreateFolder("Projets\\été"), "Notes/jsmith/Projets/&AOk-t&AOk-")
+            uploader.Append("Projets\\été", b"Subject: prefix\n\nbody\n", key="k")
+        finally:
+            results = uploader.Close()
+        self.assertEqual(results, [("k", None)])
+        self.assertIn(b"Notes/jsmith", self.server.mailboxes)
+        self.assertEqual(len(self.server.mailboxes[b"Notes/jsmith/Projets/&AOk-t&AOk-"]), 1)
+
+    def test_errors(self):
+        # The messages of a mailbox that wasn't created are refused, without
+        # failing the messages of the other mailboxes
+        messages = [("" if i < 3 or i >= 6 else "Missing", b"Subject: %d\n\nbody\n" % i, (), 0, i)
+                    for i in range(9)]
+        uploader, results = self._upload(messages, [""], 1)
+        self.assertEqual([key for key, error in results if error is None], [0, 1, 2, 6, 7, 8])
+        self.assertTrue(all("TRYCREATE" in error for key, error in results if error is not None))
+        self.assertEqual((uploader.messages, uploader.failed), (6, 3))
+        self.assertEqual(len(self.server.mailboxes[b"INBOX"]), 6)
+
+    def test_batch_order(self):
+        messages = [("", b"Subject: message %d\n\nbody\n" % i, (), 0, i) for i in range(imapwriter.BatchMessages)]
+        self._upload(messages, [])
+        self.assertEqual([m[2] for m in self.server.mailboxes[b"INBOX"]],
+                         [b"Subject: message %d\r\n\r\nbody\r\n" % i for i in range(imapwriter.BatchMessages)])
+
+    def test_count(self):
+        uploader = imapwriter.IMAPUploader(self.server.URL(), "")
+        try:
+            self.assertEqual((uploader.Count(""), uploader.Count("Sent")), (0, 0))
+            uploader.CreateFolder("Sent")
+            for i in range(3):
+                uploader.Append("Sent", b"Subject: %d\n\nbody\n" % i)
+            uploader.Flush()
+            self.assertEqual((uploader.Count(""), uploader.Count("Sent")), (0, 3))
+        finally:
+            uploader.Close()
+
+    def test_done(self):
+        uploader = imapwriter.IMAPUploader(self.server.URL(), "")
+        try:
+            results = []
+            for i in range(imapwriter.BatchMessages * 3):
+                uploader.Append("", b"Subject: %d\n\nbody\n" % i, key=i)
+                results.extend(uploader.Done())
+        finally:
+            results.extend(uploader.Close())
+        self.assertEqual(results, [(i, None) for i in range(imapwriter.BatchMessages * 3)])
+
+class LiteralPlusTest(UploadTest):
+    """Upload to a server with LITERAL+, as pipelined APPEND commands"""
+    capabilities = "LITERAL+"
+
+class MultiAppendTest(UploadTest):
+    """Upload to a server with LITERAL+ and MULTIAPPEND, as an APPEND command
+    per batch"""
+    capabilities = "LITERAL+ MULTIAPPEND"
+
+class URLTest(unittest.TestCase):
+    """URLs of the IMAP servers"""
+    def test_invalid(self):
+        self.assertRaises(ValueError, imapwriter.IMAPUploader, "http://host/", "")
+        self.assertRaises(ValueError, imapwriter.IMAPUploader, "imap:///", "")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+# Copyright (C) 2016 Free Software Foundation
+# Author : David Bateman <dbateman@free.fr>
+
+"""Tests of the Maildir output of maildir.py"""
+
+# Ignore variable/function/Method naming conventions of PEP8. I like my names
+# pylint: disable=C0103
+
+import mailbox
+import os
+import shutil
+import tempfile
+import unittest
+
+import maildir
+
+class MaildirTest(unittest.TestCase):
+    """Maildir++ directories written with Maildir"""
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "jsmith")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _write(self, box, folder, data):
+        box.CreateFolder(folder)
+        (tmp, new) = box.NewMessage(folder)
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.rename(tmp, new)
+        return new
+
+    def test_folders(self):
+        box = maildir.Maildir(self.path)
+        self.assertEqual(box.FolderPath(""), self.path)
+        self.assertEqual(box.FolderPath("Projects\\v1.0"), os.path.join(self.path, ".Projects.v1_0"))
+        self._write(box, "", b"Subject: inbox\n\nbody\n")
+        self._write(box, "Projects\\v1.0", b"Subject: project\n\nbody\n")
+        self.assertTrue(os.path.exists(os.path.join(self.path, ".Projects.v1_0", "maildirfolder")))
+        self.assertFalse(os.path.exists(os.path.join(self.path, "maildirfolder")))
+        # Read back with the Maildir++ support of the standard library
+        md = mailbox.Maildir(self.path, factory=None, create=False)
+        self.assertEqual([m["Subject"] for m in md], ["inbox"])
+        self.assertEqual(md.list_folders(), ["Projects.v1_0"])
+        self.assertEqual([m["Subject"] for m in md.get_folder("Projects.v1_0")], ["project"])
+
+    def test_unique_names(self):
+        box = maildir.Maildir(self.path)
+        names = set(box.UniqueName() for dummy in range(1000))
+        self.assertEqual(len(names), 1000)
+        self.assertFalse(any("/" in name or ":" in name for name in names))
+
+    def test_messages(self):
+        for fanout in (False, True):
+            box = maildir.Maildir(os.path.join(self.dir, str(fanout)), fanout)
+            self.assertEqual(list(box.Messages()), [])
+            paths = [self._write(box, folder, b"Subject: %s\n\nbody\n" % folder.encode("ascii"))
+                     for folder in ("", "Sent", "Projects\\v1")]
+            # A message read by a mail client is moved to cur
+            read = os.path.join(box.FolderPath("Sent"), "cur", os.path.basename(paths[1]) + ":2,S")
+            os.rename(paths[1], read)
+            self.assertEqual(sorted(box.Messages()), sorted([paths[0], read, paths[2]]))
+
+    def test_fanout(self):
+        box = maildir.Maildir(self.path, True)
+        paths = [self._write(box, "", b"Subject: %d\n\nbody\n" % n) for n in range(20)]
+        for path in paths:
+            sub = os.path.basename(os.path.dirname(path))
+            self.assertEqual(len(sub), 2)
+            self.assertEqual(os.path.dirname(os.path.dirname(path)), os.path.join(self.path, "new"))
+        self.assertEqual(os.listdir(os.path.join(self.path, "tmp")), [])
+
+if __name__ == '__main__':
+    unittest.main()
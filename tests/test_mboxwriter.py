@@ -0,0 +1,363 @@
+# -*- coding: utf-8 -*-
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+# Copyright (C) 2016 Free Software Foundation
+# Author : David Bateman <dbateman@free.fr>
+
+"""Tests of the MBOX files of mboxwriter.py"""
+
+# Ignore variable/function/Method naming conventions of PEP8. I like my names
+# pylint: disable=C0103
+
+import gzip
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+import mboxwriter
+
+def Message(n, body):
+    """Function returning the "From " line and the headers of message n
+    followed by body"""
+    return (b"From nsf2x@localhost Mon Mar  1 09:30:00 2016\n"
+            b"Subject: message %d\n\n" % n) + body
+
+class MBOXTest(unittest.TestCase):
+    """MBOX files written with MBOXFile"""
+    compress = False
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "test.mbox")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _write(self, f, n, pieces, date=0):
+        f.BeginMessage("%X" % (0x100 + n), date)
+        for piece in pieces:
+            f.write(piece)
+        f.EndMessage()
+
+    def test_escaping(self):
+        body = b"From the start\n>From quoted\n>>From twice\nNot From here\nFrom\n"
+        f = mboxwriter.MBOXFile(self.path, compress=self.compress)
+        self._write(f, 1, [Message(1, body)])
+        f.close()
+        self.assertEqual(mboxwriter.ReadMessage(self.path, 0),
+                         Message(1, b">From the start\n>>From quoted\n>>>From twice\nNot From here\nFrom\n"))
+
+    def test_split_lines(self):
+        # "From " lines split across the buffers written
+        body = b"a\nFrom one\nFr" + b"om two\n>" + b">From three\n" + b"F" + b"rom" + b" four\nFrom"
+        f = mboxwriter.MBOXFile(self.path, compress=self.compress)
+        header = Message(1, b"")
+        pieces = [header[:10], header[10:]] + [b"a\nFrom one\nFr", b"om two\n>", b">From three\n",
+                                               b"F", b"rom", b" four\nFrom"]
+        self.assertEqual(b"".join(pieces), Message(1, body))
+        self._write(f, 1, pieces)
+        f.close()
+        self.assertEqual(mboxwriter.ReadMessage(self.path, 0),
+                         Message(1, b"a\n>From one\n>From two\n>>>From three\n>From four\nFrom"))
+
+    def test_index(self):
+        f = mboxwriter.MBOXFile(self.path, compress=self.compress)
+        for n in range(3):
+            self._write(f, n, [Message(n, b"body %d\n" % n)], 1456824600 + n)
+        f.close()
+        entries = list(mboxwriter.ReadIndex(self.path))
+        self.assertEqual([(date, noteid) for offset, length, date, noteid in entries],
+                         [(1456824600, "100"), (1456824601, "101"), (1456824602, "102")])
+        self.assertEqual(mboxwriter.ReadIndexEntry(self.path, 2), entries[2])
+        self.assertRaises(IndexError, mboxwriter.ReadIndexEntry, self.path, 3)
+        for n in range(3):
+            self.assertEqual(mboxwriter.ReadMessage(self.path, n), Message(n, b"body %d\n" % n))
+
+    def test_append(self):
+        f = mboxwriter.MBOXFile(self.path, compress=self.compress)
+        self._write(f, 0, [Message(0, b"first\n")])
+        f.close()
+        f = mboxwriter.MBOXFile(self.path, True, self.compress)
+        self._write(f, 1, [Message(1, b"second\n")])
+        f.close()
+        self.assertEqual([mboxwriter.ReadMessage(self.path, n) for n in range(2)],
+                         [Message(0, b"first\n"), Message(1, b"second\n")])
+
+    def test_truncate(self):
+        # A message that failed is removed with the records beyond it
+        f = mboxwriter.MBOXFile(self.path, compress=self.compress)
+        self._write(f, 0, [Message(0, b"kept\n")])
+        f.flush()
+        start = f.tell()
+        self._write(f, 1, [Message(1, b"failed\n")])
+        f.truncate(start)
+        f.seek(start)
+        self._write(f, 2, [Message(2, b"retried\n")])
+        f.close()
+        self.assertEqual([noteid for offset, length, date, noteid in mboxwriter.ReadIndex(self.path)],
+                         ["100", "102"])
+        self.assertEqual(mboxwriter.ReadMessage(self.path, 1), Message(2, b"retried\n"))
+
+    def test_close(self):
+        # Closing the file again has no effect
+        f = mboxwriter.MBOXFile(self.path, compress=self.compress)
+        self._write(f, 0, [Message(0, b"body\n")])
+        f.close()
+        f.close()
+        self.assertEqual(mboxwriter.ReadMessage(self.path, 0), Message(0, b"body\n"))
+
+    def test_message_date(self):
+        class MIME(object):
+            """MIME entity with a Date header"""
+            def __init__(self, date):
+                self.date = date
+            def GetSomeHeaders(self, dummy_names, dummy_inclusive):
+                return "Date: " + self.date
+        self.assertEqual(mboxwriter.MessageDate(MIME("Tue, 01 Mar 2016 10:30:00 +0100")), 1456824600)
+        self.assertEqual(mboxwriter.MessageDate(MIME("not a date")), 0)
+        self.assertEqual(mboxwriter.MessageDate(None), 0)
+
+class BGZFMBOXTest(MBOXTest):
+    """MBOX files written with MBOXFile in the BGZF format"""
+    compress = True
+
+    def _blocks(self):
+        with open(self.path, "rb") as f:
+            return [length for offset, size, length in mboxwriter._blocks(f)] # pylint: disable=W0212
+
+    def test_gzip(self):
+        # The file is read by any gzip tool, with the offsets of the uncompressed data
+        f = mboxwriter.MBOXFile(self.path, compress=True)
+        body = os.urandom(3 * mboxwriter.BlockSize)
+        for n in range(2):
+            self._write(f, n, [Message(n, body)])
+        f.close()
+        with gzip.open(self.path, "rb") as z:
+            self.assertEqual(z.read(), Message(0, body) + b"\n" + Message(1, body) + b"\n")
+        with open(self.path, "rb") as raw:
+            self.assertTrue(raw.read().endswith(mboxwriter.BlockEOF))
+        (offset, length) = mboxwriter.ReadIndexEntry(self.path, 1)[:2]
+        self.assertEqual((offset, length), (len(Message(0, body)) + 1, len(Message(1, body))))
+        self.assertEqual(mboxwriter.ReadMessage(self.path, 1), Message(1, body))
+
+    def test_shared_blocks(self):
+        # Small messages fill the blocks rather than each starting its own
+        f = mboxwriter.MBOXFile(self.path, compress=True)
+        for n in range(2000):
+            self._write(f, n, [Message(n, b"body %d\n" % n)])
+            f.flush()
+        f.close()
+        size = sum(len(Message(n, b"body %d\n" % n)) + 1 for n in range(2000))
+        self.assertEqual(self._blocks(), [mboxwriter.BlockSize] * (size // mboxwriter.BlockSize) +
+                         [size % mboxwriter.BlockSize, 0])
+        for n in (0, 1500, 1999):
+            self.assertEqual(mboxwriter.ReadMessage(self.path, n), Message(n, b"body %d\n" % n))
+
+    def test_checkpoint(self):
+        # The messages are on disk once a checkpoint is reached
+        f = mboxwriter.MBOXFile(self.path, compress=True)
+        body = b"x" * 1000 + b"\n"
+        ends = []
+        while f.durable == 0:
+            self._write(f, len(ends), [Message(len(ends), body)])
+            ends.append(f.tell())
+            f.flush()
+        self.assertEqual(f.durable, ends[-1])
+        self.assertGreaterEqual(f.durable, mboxwriter.CheckpointSize)
+        self.assertEqual(sum(self._blocks()), f.durable)
+        self._write(f, len(ends), [Message(len(ends), body)])
+        self.assertEqual(sum(self._blocks()), ends[-1])
+        end = f.tell()
+        f.close()
+        self.assertEqual(f.durable, end)
+
+    def test_discard_written(self):
+        # A failed message is removed even once some of its blocks are in the file
+        f = mboxwriter.MBOXFile(self.path, compress=True)
+        self._write(f, 0, [Message(0, b"kept\n")])
+        start = f.tell()
+        f.BeginMessage("101")
+        f.write(Message(1, os.urandom((2 * f.out.workers + 4) * mboxwriter.BlockSize)))
+        self.assertGreater(os.path.getsize(self.path), 0)
+        f.truncate(start)
+        f.seek(start)
+        self._write(f, 2, [Message(2, b"retried\n")])
+        f.close()
+        with gzip.open(self.path, "rb") as z:
+            self.assertEqual(z.read(), Message(0, b"kept\n") + b"\n" + Message(2, b"retried\n") + b"\n")
+
+    def test_resume(self):
+        # A file reopened is cut back to a message in the middle of a block
+        f = mboxwriter.MBOXFile(self.path, compress=True)
+        for n in range(3):
+            self._write(f, n, [Message(n, b"body %d\n" % n)])
+        f.close()
+        end = mboxwriter.ReadIndexEntry(self.path, 1)[0]
+        f = mboxwriter.MBOXFile(self.path, True, True)
+        self.assertEqual(f.tell(), sum(len(Message(n, b"body %d\n" % n)) + 1 for n in range(3)))
+        f.truncate(end)
+        self._write(f, 3, [Message(3, b"after\n")])
+        f.close()
+        self.assertEqual([noteid for offset, length, date, noteid in mboxwriter.ReadIndex(self.path)],
+                         ["100", "103"])
+        self.assertEqual(mboxwriter.ReadMessage(self.path, 1), Message(3, b"after\n"))
+        with gzip.open(self.path, "rb") as z:
+            self.assertEqual(z.read(), Message(0, b"body 0\n") + b"\n" + Message(3, b"after\n") + b"\n")
+
+class SortTest(unittest.TestCase):
+    """MBOX files sorted by date with SortMBOX"""
+    compress = False
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "test.mbox")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _mbox(self, dates, stray=False):
+        f = mboxwriter.MBOXFile(self.path, compress=self.compress)
+        for n, date in enumerate(dates):
+            f.BeginMessage("%X" % (0x100 + n), date)
+            f.write(Message(n, b"From %d\n" % n * (n + 1)))
+            f.EndMessage()
+            if stray:
+                # Separator of a skipped document, written without a message
+                f.EndMessage()
+        f.close()
+
+    def _sorted(self):
+        return [(date, noteid) for offset, length, date, noteid in mboxwriter.ReadIndex(self.path)]
+
+    def test_sort(self):
+        dates = [300, 0, 100, 200, 100, 0, 50]
+        self._mbox(dates)
+        self.assertEqual(mboxwriter.SortMBOX(self.path)[:2], (7, 0))
+        # The undated messages last, the same dates in the order of the file
+        self.assertEqual(self._sorted(), [(50, "106"), (100, "102"), (100, "104"), (200, "103"),
+                                          (300, "100"), (0, "101"), (0, "105")])
+        for i, n in enumerate([6, 2, 4, 3, 0, 1, 5]):
+            self.assertEqual(mboxwriter.ReadMessage(self.path, i), Message(n, b">From %d\n" % n * (n + 1)))
+        # The run files and the sorted file are removed
+        self.assertEqual(sorted(os.listdir(self.dir)), ["test.mbox", "test.mbox.idx"])
+
+    def test_runs(self):
+        # Sorted in several runs merged in the new file
+        dates = [(n * 7919) % 101 for n in range(60)]
+        self._mbox(dates)
+        (count, runs, temp) = mboxwriter.SortMBOX(self.path, 2000)
+        self.assertEqual(count, 60)
+        self.assertGreater(runs, 1)
+        self.assertGreater(temp, 0)
+        order = sorted(range(60), key=lambda n: (dates[n] or 1000, n))
+        self.assertEqual(self._sorted(), [(dates[n], "%X" % (0x100 + n)) for n in order])
+        self.assertEqual(mboxwriter.ReadMessage(self.path, 59), Message(order[59], b">From %d\n" % order[59] *
+                                                                       (order[59] + 1)))
+
+    def test_moved(self):
+        # The offsets given are those of the locations of the journal
+        dates = [3, 1, 2]
+        locations = []
+        f = mboxwriter.MBOXFile(self.path, compress=self.compress)
+        for n, date in enumerate(dates):
+            start = f.tell()
+            f.BeginMessage("%X" % (0x100 + n), date)
+            f.write(Message(n, b"body\n" * (n + 1)))
+            f.EndMessage()
+            f.flush()
+            locations.append((start, f.tell()))
+        f.close()
+        moves = []
+        mboxwriter.SortMBOX(self.path, moved=lambda old, new: moves.append((old, new)))
+        self.assertEqual([old for old, new in moves], [locations[1], locations[2], locations[0]])
+        with (gzip.open if self.compress else open)(self.path, "rb") as f:
+            data = f.read()
+        for i, (n, (old, new)) in enumerate(zip([1, 2, 0], moves)):
+            self.assertEqual(new[0], mboxwriter.ReadIndexEntry(self.path, i)[0])
+            self.assertEqual(new[1] - new[0], old[1] - old[0])
+            self.assertEqual(data[new[0]:new[1]], Message(n, b"body\n" * (n + 1)) + b"\n")
+        self.assertEqual(moves[-1][1][1], len(data))
+
+    def test_stray_separators(self):
+        self._mbox([2, 1], True)
+        self.assertEqual(mboxwriter.SortMBOX(self.path)[0], 2)
+        self.assertEqual(self._sorted(), [(1, "101"), (2, "100")])
+
+    def test_unindexed(self):
+        self._mbox([2, 1])
+        with open(self.path, "ab") as f:
+            f.write(mboxwriter.CompressBlock(b"lost\n") if self.compress else b"lost\n")
+        self.assertRaises(ValueError, mboxwriter.SortMBOX, self.path)
+        self.assertEqual(self._sorted(), [(2, "100"), (1, "101")])
+
+class BGZFSortTest(SortTest):
+    """BGZF MBOX files sorted by date with SortMBOX"""
+    compress = True
+
+class BGZFTest(unittest.TestCase):
+    """Blocks written by BGZFWriter"""
+    def test_blocks(self):
+        out = io.BytesIO()
+        writer = mboxwriter.BGZFWriter(out, 2)
+        data = os.urandom(mboxwriter.BlockSize // 2)
+        for dummy in range(7):
+            writer.write(data)
+        writer.Close()
+        blocks = out.getvalue()
+        sizes = []
+        pos = 0
+        while pos < len(blocks):
+            # BSIZE is the size of the block minus one
+            size = int.from_bytes(blocks[pos + 16:pos + 18], "little") + 1
+            sizes.append(len(gzip.decompress(blocks[pos:pos + size])))
+            self.assertLessEqual(size, 1 << 16)
+            pos += size
+        self.assertEqual(pos, len(blocks))
+        self.assertEqual(sizes, [mboxwriter.BlockSize] * 3 + [len(data), 0])
+        self.assertEqual(gzip.decompress(blocks), data * 7)
+        self.assertEqual(writer.size, len(data) * 7)
+
+    def test_discard(self):
+        out = io.BytesIO()
+        # The blocks of the dropped data aren't written before the Sync
+        writer = mboxwriter.BGZFWriter(out, 2)
+        writer.write(b"kept\n")
+        writer.Sync()
+        writer.write(b"dropped\n" * 20000)
+        writer.Discard()
+        writer.Close()
+        self.assertEqual(gzip.decompress(out.getvalue()), b"kept\n")
+
+    def test_mark(self):
+        # The data before the mark is kept, in the same block as the data after it
+        out = io.BytesIO()
+        writer = mboxwriter.BGZFWriter(out, 1)
+        writer.write(b"a" * (mboxwriter.BlockSize + 10))
+        writer.Mark()
+        writer.write(os.urandom(5 * mboxwriter.BlockSize))
+        self.assertGreater(len(out.getvalue()), 0)
+        writer.Discard()
+        self.assertEqual(writer.size, mboxwriter.BlockSize + 10)
+        writer.write(b"b" * 10)
+        writer.Close()
+        self.assertEqual(gzip.decompress(out.getvalue()), b"a" * (mboxwriter.BlockSize + 10) + b"b" * 10)
+        self.assertEqual(len(out.getvalue()), len(mboxwriter.CompressBlock(b"a" * mboxwriter.BlockSize)) +
+                         len(mboxwriter.CompressBlock(b"a" * 10 + b"b" * 10)) + len(mboxwriter.BlockEOF))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+# Copyright (C) 2016 Free Software Foundation
+# Author : David Bateman <dbateman@free.fr>
+
+"""Tests of the JSON lines metadata of metadata.py"""
+
+# Ignore variable/function/Method naming conventions of PEP8. I like my names
+# pylint: disable=C0103
+
+import email
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import fakenotes
+import metadata
+
+_MESSAGE = (b'Subject: =?utf-8?q?R=C3=A9union?=\n'
+            b'From: "Smith, John" <jsmith@example.com>\n'
+            b'To: =?utf-8?q?Ren=C3=A9?= <rene@example.com>, jdoe@example.com\n'
+            b'Cc: a@example.com,\n  b@example.com\n'
+            b'Message-ID: <1@example.com>\n'
+            b'MIME-Version: 1.0\n'
+            b'Content-Type: multipart/mixed; boundary=b\n\n'
+            b'--b\nContent-Type: text/plain\n\nbody\n'
+            b'--b\nContent-Type: application/pdf; name="report.pdf"\n\n%PDF\n'
+            b'--b\nContent-Type: text/plain\nContent-Disposition: attachment; filename="notes.txt"\n\nnotes\n'
+            b'--b\nContent-Type: image/png\n\nPNG\n'
+            b'--b--\n')
+
+def MIME(data):
+    """Function returning the in-memory MIMEEntity of a message"""
+    return fakenotes.MIMEEntity(email.message_from_bytes(data))
+
+class _Resolver(object):
+    """Resolver of the Notes names to SMTP addresses"""
+    @staticmethod
+    def RewriteAddresses(value):
+        return value.replace("jdoe@example.com", "jane.doe@example.com")
+
+class RecordTest(unittest.TestCase):
+    """Metadata of the messages"""
+    def test_record(self):
+        record = metadata.Record(MIME(_MESSAGE), "jsmith", "Inbox", "8FA", "U1", 1456824600, 1234,
+                                 "jsmith.mbox|0|1235")
+        self.assertEqual(record["subject"], "R\xe9union")
+        self.assertEqual(record["message_id"], "<1@example.com>")
+        self.assertIsNone(record["in_reply_to"])
+        self.assertEqual(record["date"], "2016-03-01T09:30:00Z")
+        self.assertEqual(record["from"], [{"name" : "Smith, John", "address" : "jsmith@example.com"}])
+        self.assertEqual(record["to"], [{"name" : "Ren\xe9", "address" : "rene@example.com"},
+                                        {"name" : "", "address" : "jdoe@example.com"}])
+        self.assertEqual([a["address"] for a in record["cc"]], ["a@example.com", "b@example.com"])
+        self.assertEqual(record["bcc"], [])
+        self.assertEqual((record["parts"], record["attachments"]), (4, 3))
+        self.assertEqual(record["attachment_names"], ["report.pdf", "notes.txt"])
+        self.assertEqual((record["size"], record["location"]), (1234, "jsmith.mbox|0|1235"))
+
+    def test_resolver(self):
+        record = metadata.Record(MIME(_MESSAGE), "jsmith", "Inbox", "8FA", "U1", 0, None, "", _Resolver())
+        self.assertEqual(record["to"][1]["address"], "jane.doe@example.com")
+        self.assertIsNone(record["date"])
+
+class MetadataWriterTest(unittest.TestCase):
+    """Files written with MetadataWriter"""
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _lines(self, path):
+        opener = gzip.open if path.endswith(".gz") else open
+        with opener(path, "rb") as f:
+            return [json.loads(line.decode("utf-8")) for line in f]
+
+    def test_append(self):
+        for name in ("meta.jsonl", "meta.jsonl.gz"):
+            path = os.path.join(self.dir, name)
+            compress = name.endswith(".gz")
+            meta = metadata.MetadataWriter(path, compress)
+            meta.Write({"noteid" : "1", "subject" : "caf\xe9"})
+            meta.Close()
+            meta = metadata.MetadataWriter(path, compress, True)
+            meta.Write({"noteid" : "2"})
+            meta.Close()
+            self.assertEqual(meta.records, 1)
+            self.assertEqual(self._lines(path), [{"noteid" : "1", "subject" : "caf\xe9"}, {"noteid" : "2"}])
+
+    def test_trim(self):
+        # A line truncated by a crash is removed before appending
+        path = os.path.join(self.dir, "meta.jsonl")
+        with open(path, "wb") as f:
+            f.write(b'{"noteid":"1"}\n{"noteid":"2","sub')
+        meta = metadata.MetadataWriter(path, False, True)
+        meta.Write({"noteid" : "3"})
+        meta.Close()
+        self.assertEqual(self._lines(path), [{"noteid" : "1"}, {"noteid" : "3"}])
+
+    def test_relocate(self):
+        for name in ("meta.jsonl", "meta.jsonl.gz"):
+            path = os.path.join(self.dir, name)
+            meta = metadata.MetadataWriter(path, name.endswith(".gz"))
+            meta.Write({"noteid" : "1", "subject" : '"location":"x"}', "location" : "caf\xe9.mbox|0|10"})
+            meta.Write({"noteid" : "2", "location" : "caf\xe9.mbox|10|30"})
+            meta.Write({"noteid" : "3", "location" : "other.mbox|0|10"})
+            meta.Relocate({"caf\xe9.mbox|0|10" : "caf\xe9.mbox|20|30", "caf\xe9.mbox|10|30" : "caf\xe9.mbox|0|20"})
+            # Records written after the relocation are added to the file
+            meta.Write({"noteid" : "4", "location" : "caf\xe9.mbox|0|10"})
+            meta.Close()
+            self.assertEqual([(r["noteid"], r["location"]) for r in self._lines(path)],
+                             [("1", "caf\xe9.mbox|20|30"), ("2", "caf\xe9.mbox|0|20"),
+                              ("3", "other.mbox|0|10"), ("4", "caf\xe9.mbox|0|10")])
+            self.assertEqual(self._lines(path)[0]["subject"], '"location":"x"}')
+            self.assertEqual(os.listdir(self.dir).count(name + ".tmp"), 0)
+
+if __name__ == '__main__':
+    unittest.main()
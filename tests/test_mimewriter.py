@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+# Copyright (C) 2016 Free Software Foundation
+# Author : David Bateman <dbateman@free.fr>
+
+"""Tests of the encoding and streaming of the MIME parts of mimewriter.py"""
+
+# Ignore variable/function/Method naming conventions of PEP8. I like my names
+# pylint: disable=C0103
+
+import base64
+import binascii
+import email
+import io
+import os
+import unittest
+
+import fakenotes
+import mimewriter
+
+def Decode(encoding, data):
+    """Function returning the data encoded by BestEncoding"""
+    if encoding == "base64":
+        return binascii.a2b_base64(data)
+    if encoding == "quoted-printable":
+        return binascii.a2b_qp(data)
+    return data
+
+def Write(rfc822, streamer=None):
+    """Function returning a message written by WriteMIMEMessage"""
+    f = io.BytesIO()
+    mimewriter.WriteMIMEMessage(f, fakenotes.MIMEEntity(email.message_from_bytes(rfc822)), False, None, streamer)
+    return f.getvalue()
+
+def Multipart(*parts):
+    """Function returning a multipart/mixed message of the parts, given as
+    their headers and their content"""
+    return (b"Subject: parts\nMIME-Version: 1.0\nContent-Type: multipart/mixed; boundary=b\n\n" +
+            b"".join(b"--b\n" + headers + b"\n\n" + content + b"\n" for headers, content in parts) + b"--b--\n")
+
+class Base64LinesTest(unittest.TestCase):
+    """Base64 encoding in lines with Base64Lines"""
+    def test_lines(self):
+        data = os.urandom(mimewriter.Base64Line * 3 + 10)
+        encoded = mimewriter.Base64Lines(data)
+        lines = encoded.split(b"\n")
+        self.assertEqual([len(l) for l in lines], [76, 76, 76, 16, 0])
+        self.assertEqual(base64.b64decode(encoded), data)
+
+    def test_blocks(self):
+        # Blocks of Base64Block bytes encoded separately make the same lines
+        data = os.urandom(mimewriter.Base64Block * 2 + 100)
+        blocks = [data[i:i + mimewriter.Base64Block] for i in range(0, len(data), mimewriter.Base64Block)]
+        self.assertEqual(b"".join(mimewriter.Base64Lines(b) for b in blocks), mimewriter.Base64Lines(data))
+
+    def test_empty(self):
+        self.assertEqual(mimewriter.Base64Lines(b""), b"\n")
+
+class BestEncodingTest(unittest.TestCase):
+    """Content-Transfer-Encoding chosen by BestEncoding"""
+    def _check(self, data, istext, expected):
+        encoding, encoded = mimewriter.BestEncoding(data, istext)
+        self.assertEqual(encoding, expected)
+        self.assertEqual(Decode(encoding, encoded), data)
+
+    def test_7bit(self):
+        self._check(b"Hello\r\nworld\r\n", True, "7bit")
+        self._check(b"Hello\nworld\n", True, "7bit")
+        self._check(b"no line break", False, "7bit")
+
+    def test_binary_line_breaks(self):
+        # The line breaks of a binary part are only kept by base64
+        self._check(b"a\r\nb\r\n", False, "base64")
+        self._check(b"a\nb\n", False, "base64")
+        self._check(b"\r" * 100, False, "base64")
+
+    def test_quoted_printable(self):
+        self._check("caf\xe9\nd\xe9j\xe0 vu\n".encode("latin-1"), True, "quoted-printable")
+        self._check(b"bare\rCR\n", True, "quoted-printable")
+        self._check(b"abc\xe9" * 10, False, "quoted-printable")
+
+    def test_long_lines(self):
+        # Lines longer than 998 characters aren't allowed in 7bit
+        self._check(b"x" * 998 + b"\n", True, "7bit")
+        self._check(b"x" * 999 + b"\n", True, "quoted-printable")
+        self._check(b"x" * 2000, False, "quoted-printable")
+
+    def test_base64(self):
+        self._check(os.urandom(1000), True, "base64")
+        self._check(bytes(bytearray(range(256))) * 4, False, "base64")
+
+    def test_empty(self):
+        self._check(b"", True, "7bit")
+        self._check(b"", False, "7bit")
+
+class StreamerTest(unittest.TestCase):
+    """Parts written with a Streamer"""
+    def test_unchanged(self):
+        # The parts copied in chunks are written byte for byte as without a Streamer
+        pdf = base64.encodebytes(os.urandom(5000)).rstrip(b"\n")
+        rfc822 = Multipart((b"Content-Type: text/plain", b"hello\nFrom the start"),
+                           (b"Content-Type: application/pdf\nContent-Transfer-Encoding: base64", pdf),
+                           (b"Content-Type: image/png\nContent-Transfer-Encoding: base64",
+                            base64.encodebytes(os.urandom(100)).rstrip(b"\n")))
+        streamer = mimewriter.Streamer(fakenotes.Stream, 1000, 100)
+        self.assertEqual(Write(rfc822, streamer), Write(rfc822))
+        self.assertEqual(Write(rfc822, mimewriter.Streamer(fakenotes.Stream)), Write(rfc822))
+        # Only the large part was streamed
+        self.assertEqual(streamer.parts, 1)
+        self.assertEqual(streamer.size, len(pdf))
+
+    def _parts(self, written):
+        return [(part.get("Content-Transfer-Encoding"), part.get_payload(decode=True))
+                for part in email.message_from_bytes(written).walk() if not part.is_multipart()]
+
+    def test_recode(self):
+        # The binary parts are encoded in the smallest encoding keeping their bytes
+        large = os.urandom(3000)
+        rfc822 = Multipart((b"Content-Type: application/octet-stream\nContent-Transfer-Encoding: binary",
+                            b"a\r\nb\r\n"),
+                           (b"Content-Type: application/octet-stream\nContent-Transfer-Encoding: binary",
+                            b"y" * 2000),
+                           (b"Content-Type: application/octet-stream\nContent-Transfer-Encoding: binary",
+                            large),
+                           (b"Content-Type: application/octet-stream\nContent-Transfer-Encoding: binary", b""))
+        # The parts larger than the threshold are streamed in base64
+        for threshold, encodings in ((mimewriter.StreamThreshold, ["base64", "quoted-printable", "base64", "7bit"]),
+                                     (1000, ["base64", "base64", "base64", "7bit"])):
+            streamer = mimewriter.Streamer(fakenotes.Stream, threshold, 100)
+            parts = self._parts(Write(rfc822, streamer))
+            self.assertEqual([encoding for encoding, payload in parts], encodings)
+            self.assertEqual((parts[0][1], parts[2][1]), (b"a\r\nb\r\n", large))
+            # The line break before a boundary belongs to the boundary
+            self.assertEqual((parts[1][1].rstrip(b"\n"), parts[3][1].rstrip(b"\n")), (b"y" * 2000, b""))
+            self.assertEqual(streamer.parts, 2 if threshold == 1000 else 0)
+
+    def test_chunks(self):
+        stream = fakenotes.Stream()
+        stream.Write(b"0123456789" * 10)
+        stream.Position = 0
+        streamer = mimewriter.Streamer(fakenotes.Stream, chunk=30)
+        self.assertEqual([len(c) for c in streamer._chunks(stream)], [30, 30, 30, 10]) # pylint: disable=W0212
+        stream.Position = 0
+        self.assertEqual([len(c) for c in streamer._chunks(stream, 40)], [40, 40, 20]) # pylint: disable=W0212
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+# Copyright (C) 2016 Free Software Foundation
+# Author : David Bateman <dbateman@free.fr>
+
+"""Tests of the recording and replay of the Notes objects of replay.py"""
+
+# Ignore variable/function/Method naming conventions of PEP8. I like my names
+# pylint: disable=C0103
+
+import gzip
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+import fakenotes
+import mimewriter
+import replay
+
+def _Wrap(value):
+    """Function wrapping the fake Notes objects in a value as COM objects"""
+    if isinstance(value, (tuple, list)):
+        return [_Wrap(v) for v in value]
+    if type(value).__module__ == fakenotes.__name__:
+        return _COM(value)
+    return value
+
+class _COM(object):
+    """Fake Notes object seen by Recorder as a COM object"""
+    _oleobj_ = None
+
+    def __init__(self, target):
+        self.__dict__["_target"] = target
+
+    def __getattr__(self, name):
+        value = getattr(self._target, name)
+        if callable(value):
+            return lambda *args: _Wrap(value(*[a._target if isinstance(a, _COM) else a for a in args]))
+        return _Wrap(value)
+
+def Export(db):
+    """Function returning the MBOX messages of the folders of a database"""
+    out = io.BytesIO()
+    for fld in db.Views:
+        doc = fld.GetFirstDocument()
+        while doc:
+            mimewriter.WriteMIMEMessage(out, doc.GetMIMEEntity("Body"), True)
+            out.write(b"\n")
+            doc = fld.GetNextDocument(doc)
+    return out.getvalue()
+
+_MESSAGES = [("Inbox", "1", b"Subject: first\nFrom: a@b.c\n\nbody\n"),
+             ("($Sent)", "2", b"Subject: second\nMIME-Version: 1.0\nContent-Type: multipart/mixed; boundary=b\n\n"
+                              b"--b\nContent-Type: text/plain\n\ntext\n"
+                              b"--b\nContent-Type: application/octet-stream\nContent-Transfer-Encoding: base64\n\n"
+                              b"AAECAwQ=\n--b--\n"),
+             ("Inbox", "3", b"Subject: third\n\nFrom the start\n")]
+
+class ReplayTest(unittest.TestCase):
+    """Exports recorded with Recorder and replayed with Replayer"""
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "trace.json.gz")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_round_trip(self):
+        expected = Export(fakenotes.Database("", _MESSAGES))
+        recorder = replay.Recorder(_COM(fakenotes.Database("", _MESSAGES)))
+        self.assertEqual(Export(recorder), expected)
+        recorder._trace.Save(self.path) # pylint: disable=W0212
+        # The replay of the saved trace gives the same messages byte for byte
+        clock = replay.Clock(0.)
+        self.assertEqual(Export(replay.Replayer(replay.LoadTrace(self.path), 0, clock)), expected)
+        self.assertEqual(clock.total, 0.)
+
+    def test_results(self):
+        trace = replay.Trace()
+        for value in (1, 2):
+            trace.Add(0, replay.CallKey("Count"), value, 0.)
+        trace.Add(0, replay.CallKey("GetItemValue", ["Subject"]), {"t" : ["a", {"b" : "YWI="}]}, 0.)
+        trace.Add(0, replay.CallKey("Created"), {"d" : "2016-03-01T09:30:00+01:00"}, 0.)
+        trace.Add(0, replay.CallKey("Missing"), {"e" : None}, 0.)
+        replayer = replay.Replayer(trace, 0, replay.Clock(0.))
+        # The last result is repeated once the recorded ones are used
+        self.assertEqual([replayer.Count for dummy in range(3)], [1, 2, 2])
+        self.assertEqual(replayer.GetItemValue("Subject"), ("a", b"ab"))
+        self.assertEqual(replayer.Created.isoformat(), "2016-03-01T09:30:00")
+        self.assertRaises(AttributeError, getattr, replayer, "Missing")
+        self.assertRaises(AttributeError, replayer.GetItemValue, "Body")
+
+    def test_clock(self):
+        clock = replay.Clock(2.)
+        for dummy in range(10):
+            clock.Wait(0.0001)
+        self.assertAlmostEqual(clock.total, 0.002)
+        self.assertLess(clock.debt, 0.001)
+
+    def test_version(self):
+        replay.Trace().Save(self.path)
+        self.assertEqual(replay.LoadTrace(self.path).objects, [{}])
+        with gzip.open(self.path, "wt") as f:
+            f.write('{"version":2,"objects":[{}]}')
+        self.assertRaises(ValueError, replay.LoadTrace, self.path)
+
+if __name__ == '__main__':
+    unittest.main()
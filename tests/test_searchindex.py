@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+# Copyright (C) 2016 Free Software Foundation
+# Author : David Bateman <dbateman@free.fr>
+
+"""Tests of the full-text index of searchindex.py"""
+
+# Ignore variable/function/Method naming conventions of PEP8. I like my names
+# pylint: disable=C0103
+
+import email
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+import fakenotes
+import searchindex
+
+def MIME(data):
+    """Function returning the in-memory MIMEEntity of a message"""
+    return fakenotes.MIMEEntity(email.message_from_bytes(data))
+
+class BodyTextTest(unittest.TestCase):
+    """Text extracted from the MIME messages"""
+    def test_header(self):
+        mime = MIME(b"Subject: =?utf-8?q?Caf=C3=A9?= du\n  matin\nTo: a@b.c\nTo: d@e.f\n\nbody\n")
+        self.assertEqual(searchindex.Header(mime, ["Subject"]), "Caf\xe9 du matin")
+        self.assertEqual(searchindex.Header(mime, ["To"]), "a@b.c, d@e.f")
+        self.assertEqual(searchindex.Header(mime, ["Cc"]), "")
+
+    def test_plain(self):
+        mime = MIME(b"MIME-Version: 1.0\nContent-Type: multipart/mixed; boundary=b\n\n"
+                    b"--b\nContent-Type: multipart/alternative; boundary=c\n\n"
+                    b"--c\nContent-Type: text/plain; charset=iso-8859-1\n"
+                    b"Content-Transfer-Encoding: quoted-printable\n\nd=E9j=E0 vu\n"
+                    b"--c\nContent-Type: text/html\n\n<p>html</p>\n--c--\n"
+                    b"--b\nContent-Type: text/plain\nContent-Disposition: attachment\n\nattached\n"
+                    b"--b--\n")
+        self.assertEqual(searchindex.BodyText(mime).strip(), "d\xe9j\xe0 vu")
+
+    def test_html(self):
+        mime = MIME(b"MIME-Version: 1.0\nContent-Type: text/html; charset=utf-8\n"
+                    b"Content-Transfer-Encoding: base64\n\n" +
+                    email.base64mime.body_encode(b"<style>p {}</style><p>Caf&eacute; <b>noir</b></p>").encode("ascii"))
+        self.assertEqual(" ".join(searchindex.BodyText(mime).split()), "Caf\xe9 noir")
+
+class SearchIndexTest(unittest.TestCase):
+    """Messages indexed with SearchIndex"""
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "test.index")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_search(self):
+        index = searchindex.SearchIndex(self.path, 2)
+        index.Add("jsmith", "Inbox", "8FA", "U1", 1456824600, "Budget 2016", "John Smith", "Jane Doe",
+                  "jsmith.mbox|0|100", "The budget for the caf\xe9 is attached")
+        index.Add("jsmith", "Inbox", "8FB", "U2", 1456824700, "Lunch", "Jane Doe", "John Smith",
+                  "jsmith.mbox|100|200", "Meet at noon")
+        index.Add("jdoe", "Sent", "8FA", "U3", 0, "Re: Budget", "Jane Doe", "John Smith",
+                  "jdoe.mbox|0|50", "Thanks")
+        index.Close()
+        self.assertEqual(index.messages, 3)
+        results = searchindex.Search(self.path, "subject:budget")
+        self.assertEqual(sorted((r[1], r[5]) for r in results),
+                         [("jdoe", "jdoe.mbox|0|50"), ("jsmith", "jsmith.mbox|0|100")])
+        # remove_diacritics matches the accented words
+        results = searchindex.Search(self.path, "cafe")
+        self.assertEqual([r[3] for r in results], ["Budget 2016"])
+        self.assertIn("[caf\xe9]", results[0][6])
+        self.assertEqual(len(searchindex.Search(self.path, "smith", 1)), 1)
+
+    def test_replace(self):
+        # A message exported again replaces its row and its text
+        for body in ("first version", "second version"):
+            index = searchindex.SearchIndex(self.path)
+            index.Add("jsmith", "Inbox", "8FA", "U1", 0, "Subject", "From", "To", "loc", body)
+            index.Close()
+        self.assertEqual(searchindex.Search(self.path, "first"), [])
+        self.assertEqual(len(searchindex.Search(self.path, "second")), 1)
+        db = sqlite3.connect(self.path)
+        try:
+            self.assertEqual(db.execute("SELECT COUNT(*) FROM messages").fetchone(), (1,))
+            self.assertEqual(db.execute("SELECT COUNT(*) FROM text").fetchone(), (1,))
+        finally:
+            db.close()
+
+    def test_folders(self):
+        # A document in two folders is indexed in each of them
+        index = searchindex.SearchIndex(self.path)
+        for folder in ("Inbox", "Projects", "Inbox"):
+            index.Add("jsmith", folder, "8FA", "U1", 0, "Budget", "", "", folder + "/1.eml", "body")
+        index.Close()
+        self.assertEqual(sorted((r[2], r[5]) for r in searchindex.Search(self.path, "budget")),
+                         [("Inbox", "Inbox/1.eml"), ("Projects", "Projects/1.eml")])
+
+    def test_relocate(self):
+        # Two messages swap their locations
+        index = searchindex.SearchIndex(self.path)
+        for noteid, location in (("1", "a.mbox|0|10"), ("2", "a.mbox|10|30"), ("3", "b.mbox|0|10")):
+            index.Add("jsmith", "Inbox", noteid, "", 0, "message " + noteid, "", "", location, "body")
+        index.Relocate({"a.mbox|0|10" : "a.mbox|20|30", "a.mbox|10|30" : "a.mbox|0|20"})
+        index.Close()
+        self.assertEqual(sorted((r[3], r[5]) for r in searchindex.Search(self.path, "body")),
+                         [("message 1", "a.mbox|20|30"), ("message 2", "a.mbox|0|20"),
+                          ("message 3", "b.mbox|0|10")])
+
+    def test_error(self):
+        os.makedirs(self.path)
+        self.assertRaises(OSError, searchindex.SearchIndex, self.path)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+# Copyright (C) 2016 Free Software Foundation
+# Author : David Bateman <dbateman@free.fr>
+
+"""Tests of the S/MIME encryption with OpenSSLBackend"""
+
+# pylint: disable=C0103
+
+import base64
+import io
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+import smime
+
+@unittest.skipIf(shutil.which("openssl") is None, "openssl isn't installed")
+class OpenSSLTest(unittest.TestCase):
+    """Encryption of bodies for a self-signed certificate"""
+    @classmethod
+    def setUpClass(cls):
+        cls.dir = tempfile.mkdtemp()
+        cls.key = os.path.join(cls.dir, "key.pem")
+        cls.cert = os.path.join(cls.dir, "cert.pem")
+        subprocess.check_call(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+                               "-subj", "/CN=nsf2x", "-keyout", cls.key, "-out", cls.cert],
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.dir)
+
+    def _decrypt(self, envelope):
+        der = base64.b64decode(envelope.partition(b"\n\n")[2])
+        return subprocess.run(["openssl", "cms", "-decrypt", "-binary", "-inform", "DER",
+                               "-inkey", self.key, "-recip", self.cert],
+                              input=der, stdout=subprocess.PIPE, check=True).stdout
+
+    def test_envelope(self):
+        encryptor = smime.Encryptor(smime.OpenSSLBackend(self.cert, "aes256"))
+        try:
+            bodies = [b"Content-Type: text/plain\n\nsecret\n",
+                      b"Content-Type: application/octet-stream\n\n" + os.urandom(200000)]
+            for body in bodies:
+                session = encryptor.Open()
+                try:
+                    for i in range(0, len(body), 4096):
+                        session.write(body[i:i + 4096])
+                    out = io.BytesIO()
+                    encryptor.WriteEnvelope(out, session)
+                finally:
+                    session.Close()
+                envelope = out.getvalue()
+                self.assertTrue(envelope.startswith(b"Content-Type: application/x-pkcs7-mime;"))
+                self.assertTrue(all(len(line) <= 76 for line in envelope.partition(b"\n\n")[2].split(b"\n")))
+                self.assertEqual(self._decrypt(envelope), body)
+            self.assertEqual(encryptor.messages, 2)
+        finally:
+            encryptor.Close()
+
+    def test_abandoned_session(self):
+        encryptor = smime.Encryptor(smime.OpenSSLBackend(self.cert))
+        try:
+            session = encryptor.Open()
+            session.write(b"partial")
+            session.Close()
+            session = encryptor.Open()
+            session.write(b"complete\n")
+            out = io.BytesIO()
+            encryptor.WriteEnvelope(out, session)
+            session.Close()
+            self.assertEqual(self._decrypt(out.getvalue()), b"complete\n")
+        finally:
+            encryptor.Close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+# Copyright (C) 2016 Free Software Foundation
+# Author : David Bateman <dbateman@free.fr>
+
+"""Tests of the SQLite databases written in a separate thread of sqlitewriter.py"""
+
+# Ignore variable/function/Method naming conventions of PEP8. I like my names
+# pylint: disable=C0103
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import unittest
+
+import sqlitewriter
+
+class _Writer(sqlitewriter.SQLiteWriter):
+    """Database of locations, recording the threads writing to it"""
+    schema = "CREATE TABLE IF NOT EXISTS rows (name TEXT PRIMARY KEY, location TEXT);"
+    kind = "test database"
+    table = "rows"
+
+    def __init__(self, path, batch):
+        self.threads = set()
+        sqlitewriter.SQLiteWriter.__init__(self, path, batch)
+
+    def _write(self, rows):
+        self.threads.add(threading.current_thread().ident)
+        self.db.executemany("INSERT INTO rows (name, location) VALUES (?, ?)", rows)
+
+class SQLiteWriterTest(unittest.TestCase):
+    """Rows written with SQLiteWriter"""
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "test.sqlite")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _rows(self):
+        db = sqlite3.connect(self.path)
+        try:
+            return db.execute("SELECT name, location FROM rows ORDER BY name").fetchall()
+        finally:
+            db.close()
+
+    def test_batches(self):
+        writer = _Writer(self.path, 3)
+        for n in range(10):
+            writer._append(("%d" % n, "a.mbox|%d|%d" % (n, n + 1))) # pylint: disable=W0212
+        # Only the complete batches are written before Flush
+        self.assertEqual(len(writer.rows), 1)
+        writer.Flush()
+        self.assertEqual((writer.written, len(self._rows())), (10, 10))
+        writer.Close()
+        self.assertEqual(len(writer.threads), 1)
+        self.assertNotIn(threading.current_thread().ident, writer.threads)
+
+    def test_relocate(self):
+        writer = _Writer(self.path, 100)
+        for name, location in (("1", "a|0|10"), ("2", "a|10|30"), ("3", "b|0|10")):
+            writer._append((name, location)) # pylint: disable=W0212
+        # The locations are exchanged, and the rows not yet written are moved
+        writer.Relocate({"a|0|10" : "a|20|30", "a|10|30" : "a|0|20"})
+        writer.Close()
+        self.assertEqual(self._rows(), [("1", "a|20|30"), ("2", "a|0|20"), ("3", "b|0|10")])
+
+    def test_errors(self):
+        writer = _Writer(self.path, 2)
+        writer._append(("1", "a")) # pylint: disable=W0212
+        writer._append(("1", "b")) # pylint: disable=W0212
+        self.assertRaises(OSError, writer.Flush)
+        writer.Close()
+        # The batch is written in a single transaction
+        self.assertEqual(self._rows(), [])
+        self.assertRaises(OSError, _Writer, self.dir, 2)
+
+if __name__ == '__main__':
+    unittest.main()